@@ -0,0 +1,175 @@
+import os
+import random
+import argparse
+import yaml
+
+WORDS = (
+    "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore "
+    "et dolore magna aliqua enim ad minim veniam quis nostrud exercitation ullamco laboris nisi aliquip"
+).split()
+
+SNIPPETS_DIR = "_snippets"
+
+def make_paragraph(rng, words=60):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+def make_body(rng, size, heading_density, include_paths=(), frontmatter=False, title=None):
+    """
+    Returns markdown of roughly size bytes with heading_density headings per KiB.
+    """
+    parts = []
+
+    if frontmatter:
+        parts.append(f"---\nauthor: {rng.choice(WORDS)}\ntags: [{rng.choice(WORDS)}, {rng.choice(WORDS)}]\n---\n")
+
+    if title:
+        parts.append(f"# {title}\n")
+
+    headings = max(0, round(size / 1024 * heading_density))
+    paragraphs = max(1, size // 400)
+    heading_every = max(1, paragraphs // headings) if headings else None
+    include_paths = list(include_paths)
+
+    for i in range(paragraphs):
+        if heading_every and i % heading_every == 0:
+            level = rng.randint(2, 4)
+            parts.append(f"{'#' * level} {rng.randint(1, 20)} {make_paragraph(rng, 3).rstrip('.')}\n")
+
+        parts.append(make_paragraph(rng) + "\n")
+
+        if include_paths and rng.random() < 0.5:
+            parts.append(f'<!-- include file="{include_paths.pop()}" heading-level="2" -->\n')
+
+        if i % 7 == 3:
+            parts.append("```\n# not a heading\n```\n")
+
+    for path in include_paths:
+        parts.append(f'<!-- include file="{path}" heading-level="2" -->\n')
+
+    return "\n".join(parts)
+
+def make_directories(root, depth, branching):
+    directories = [root]
+    level = [root]
+
+    for _ in range(depth):
+        next_level = []
+        for directory in level:
+            for i in range(branching):
+                next_level.append(os.path.join(directory, f"{i + 1:02d} Part {i + 1}"))
+        directories.extend(next_level)
+        level = next_level
+
+    for directory in directories:
+        os.makedirs(directory, exist_ok=True)
+
+    return directories
+
+def write_order(rng, directory, names, titles=0.2):
+    items = []
+    for name in rng.sample(names, len(names)):
+        if rng.random() < titles:
+            items.append({name: os.path.splitext(name)[0].upper()})
+        else:
+            items.append(name)
+
+    with open(os.path.join(directory, "order.yaml"), 'w') as f:
+        yaml.safe_dump({"root": [{"order": items}]}, f, sort_keys=False)
+
+def generate_corpus(
+    root,
+    files=200,
+    depth=3,
+    branching=3,
+    size=2048,
+    heading_density=2.0,
+    include_density=0.1,
+    frontmatter=0.2,
+    order_coverage=0.5,
+    snippets=20,
+    seed=0
+):
+    """
+    Writes a synthetic source tree to root and returns the paths of its markdown files.
+
+    Files are spread round-robin over a tree of the given depth and branching. include_density
+    is the share of files that include a snippet, frontmatter the share that starts with YAML
+    frontmatter and order_coverage the share of directories that get an order.yaml.
+    """
+    rng = random.Random(seed)
+    directories = make_directories(root, depth, branching)
+
+    snippets_dir = os.path.join(root, SNIPPETS_DIR)
+    os.makedirs(snippets_dir, exist_ok=True)
+    open(os.path.join(snippets_dir, ".no_compile"), 'w').close()
+
+    snippet_paths = []
+    for i in range(snippets):
+        path = os.path.join(snippets_dir, f"snippet-{i:03d}.md")
+        with open(path, 'w') as f:
+            f.write(make_body(rng, max(256, size // 4), heading_density, title=f"Snippet {i}"))
+        snippet_paths.append(path)
+
+    paths = []
+    for i in range(files):
+        directory = directories[i % len(directories)]
+        path = os.path.join(directory, f"{i // len(directories) + 1:02d} Section {i}.md")
+
+        include_paths = []
+        if snippet_paths and rng.random() < include_density:
+            include_paths = [os.path.relpath(rng.choice(snippet_paths), directory)]
+
+        with open(path, 'w') as f:
+            f.write(make_body(
+                rng,
+                size,
+                heading_density,
+                include_paths=include_paths,
+                frontmatter=rng.random() < frontmatter,
+                title=f"Section {i}" if rng.random() < 0.7 else None
+            ))
+        paths.append(path)
+
+    for directory in directories:
+        if rng.random() < order_coverage:
+            names = sorted(name for name in os.listdir(directory) if name != SNIPPETS_DIR and name != "order.yaml")
+            write_order(rng, directory, names)
+
+    return paths
+
+def add_corpus_arguments(parser):
+    parser.add_argument("--files", type=int, default=200, help="Number of markdown files (default: 200)")
+    parser.add_argument("--depth", type=int, default=3, help="Depth of the directory tree (default: 3)")
+    parser.add_argument("--branching", type=int, default=3, help="Subdirectories per directory (default: 3)")
+    parser.add_argument("--size", type=int, default=2048, help="Approximate size of each file in bytes (default: 2048)")
+    parser.add_argument("--heading-density", type=float, default=2.0, help="Headings per KiB of text (default: 2.0)")
+    parser.add_argument("--include-density", type=float, default=0.1, help="Share of files with an include (default: 0.1)")
+    parser.add_argument("--frontmatter", type=float, default=0.2, help="Share of files with frontmatter (default: 0.2)")
+    parser.add_argument("--order-coverage", type=float, default=0.5, help="Share of directories with an order.yaml (default: 0.5)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+
+def corpus_options(args):
+    return {
+        "files": args.files,
+        "depth": args.depth,
+        "branching": args.branching,
+        "size": args.size,
+        "heading_density": args.heading_density,
+        "include_density": args.include_density,
+        "frontmatter": args.frontmatter,
+        "order_coverage": args.order_coverage,
+        "seed": args.seed,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic markdown tree for benchmarking.")
+    parser.add_argument("root", help="Directory to write the tree to")
+    add_corpus_arguments(parser)
+
+    args = parser.parse_args()
+
+    paths = generate_corpus(args.root, **corpus_options(args))
+    print(f"Wrote {len(paths)} files to {args.root}")
+
+if __name__ == "__main__":
+    main()
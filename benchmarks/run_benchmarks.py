@@ -0,0 +1,152 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import statistics
+
+from markdown_utils import compile_markdown
+from generate_corpus import SNIPPETS_DIR, add_corpus_arguments, corpus_options, generate_corpus
+
+RESULTS_VERSION = 1
+
+def time_call(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    return {
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "repeat": repeat,
+    }
+
+def deepest_directory(root):
+    deepest = root
+    for dir_path, dir_names, _ in os.walk(root):
+        dir_names[:] = sorted(name for name in dir_names if name != SNIPPETS_DIR)
+        if dir_path.count(os.sep) > deepest.count(os.sep):
+            deepest = dir_path
+    return deepest
+
+def make_benchmarks(source, paths, scratch):
+    contents = [(path, compile_markdown.read_file_safely(path)) for path in paths]
+    joined = "\n".join(content for _, content in contents)
+    target = os.path.relpath(deepest_directory(source), source)
+
+    def adjust_headings():
+        compile_markdown.adjust_headings(joined, 2)
+
+    def process_includes():
+        for path, content in contents:
+            compile_markdown.process_includes(content, os.path.dirname(path))
+
+    def get_content_for_path():
+        for path in paths:
+            compile_markdown.get_content_for_path(path, depth=2)
+
+    def process_folder():
+        "".join(compile_markdown.process_folder(source, include_all=True))
+
+    def compile_all(**options):
+        def run():
+            output = tempfile.mkdtemp(dir=scratch)
+            try:
+                compile_markdown.compile_all(source, output, **options)
+            finally:
+                shutil.rmtree(output)
+        return run
+
+    return {
+        "adjust_headings": adjust_headings,
+        "process_includes": process_includes,
+        "get_content_for_path": get_content_for_path,
+        "process_folder": process_folder,
+        "compile_all": compile_all(),
+        "compile_all_recursive": compile_all(recursive=True),
+        "compile_all_propagate": compile_all(propagate=True, target=target),
+    }
+
+def run_benchmarks(corpus, repeat=5, selected=None):
+    """
+    Generates a corpus in a temporary directory and returns the timings of every benchmark in seconds.
+    """
+    scratch = tempfile.mkdtemp(prefix="markdown-utils-bench-")
+    try:
+        source = os.path.join(scratch, "book")
+        paths = generate_corpus(source, **corpus)
+        benchmarks = make_benchmarks(source, paths, scratch)
+
+        results = {}
+        for name, func in benchmarks.items():
+            if selected and name not in selected:
+                continue
+            results[name] = time_call(func, repeat)
+            print(f"{name:<24} min {results[name]['min'] * 1000:10.2f} ms   median {results[name]['median'] * 1000:10.2f} ms")
+
+        return results
+    finally:
+        shutil.rmtree(scratch)
+
+def compare_results(baseline, results, threshold=0.1):
+    """
+    Returns the names of benchmarks whose minimum time grew by more than threshold over the baseline.
+    """
+    regressions = []
+
+    if baseline.get("corpus") != results.get("corpus"):
+        print("Warning: the baseline was recorded with a different corpus")
+
+    for name, result in results["results"].items():
+        previous = baseline["results"].get(name)
+        if previous is None:
+            print(f"{name:<24} {'new':>10}")
+            continue
+
+        ratio = result["min"] / previous["min"] if previous["min"] else float("inf")
+        regressed = ratio > 1 + threshold
+        if regressed:
+            regressions.append(name)
+
+        print(f"{name:<24} {ratio:9.2f}x{'   REGRESSION' if regressed else ''}")
+
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark markdown_utils on a synthetic markdown tree.")
+    add_corpus_arguments(parser)
+    parser.add_argument("-n", "--repeat", type=int, default=5, help="Timed runs per benchmark (default: 5)")
+    parser.add_argument("-o", "--output", help="Write the results as JSON to this file")
+    parser.add_argument("-c", "--compare", help="Compare against the results stored in this JSON file")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Slowdown that counts as a regression (default: 0.1 = 10%%)")
+    parser.add_argument("benchmarks", nargs="*", help="Benchmarks to run (default: all)")
+
+    args = parser.parse_args()
+
+    corpus = corpus_options(args)
+    results = {
+        "version": RESULTS_VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "corpus": corpus,
+        "results": run_benchmarks(corpus, args.repeat, set(args.benchmarks)),
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+
+        if compare_results(baseline, results, args.threshold):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,465 @@
+import os
+import sys
+import argparse
+from collections import Counter, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import yaml
+
+from markdown_utils.compile_markdown import (
+    FRONTMATTER_PATTERN,
+    EXISTING_TITLE_PATTERN,
+    INCLUDE_PATTERN,
+    INCLUDE_ATTRIBUTE_PATTERN,
+    adjust_headings,
+    get_folder_title,
+    iter_folder_items,
+    remove_leading_number,
+    resolve_document,
+    resolve_include_path,
+)
+from markdown_utils.order_plan import PlanCache, compile_order
+from markdown_utils.tree_index import TreeIndex
+
+DEFAULT_JOBS = os.cpu_count() or 1
+BATCH_SIZE = 512
+
+# A problem found in the tree. severity is "error" for anything that breaks or silently changes the
+# compiled output, and "warning" for things that are probably mistakes but compile as intended.
+Problem = namedtuple("Problem", ["path", "severity", "message"])
+
+# What check needs from one markdown file: the read error (None if it was read), the existing title,
+# the substitutions its headings match, and its include directives as attribute dicts, with None for
+# a directive that is not well-formed.
+ScannedFile = namedtuple("ScannedFile", ["error", "title", "headings", "includes"])
+
+class TitleRecorder(dict):
+    """
+    Substitutions that record every title looked up in them, so adjust_headings reports the headings it would substitute.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.titles = set()
+
+    def get(self, title, default=None):
+        self.titles.add(title)
+        return default
+
+def scan_file(path, keep_numbers=False, substitutions=()):
+    """
+    Reads a markdown file the way compile does and returns its ScannedFile. Runs in the worker processes.
+
+    Headings are only looked up in the titles of substitutions if one of them occurs in the file at all.
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            content = f.read()
+    except UnicodeDecodeError as e:
+        return ScannedFile(f"is not valid UTF-8: {e.reason} at byte {e.start}", None, (), ())
+    except OSError as e:
+        return ScannedFile(f"cannot be read: {e.strerror or e}", None, (), ())
+
+    includes = []
+    if '<!-- include' in content:
+        matched = 0
+        for match in INCLUDE_PATTERN.finditer(content):
+            includes.append(dict(INCLUDE_ATTRIBUTE_PATTERN.findall(match.group(0))))
+            matched += 1
+        includes.extend([None] * (content.count('<!-- include') - matched))
+
+    body = content
+    frontmatter_match = FRONTMATTER_PATTERN.match(body) if body.startswith("---\n") else None
+    body = body[frontmatter_match.end():].strip() if frontmatter_match else body.strip()
+    title_match = EXISTING_TITLE_PATTERN.match(body)
+
+    headings = frozenset()
+    if any(title in body for title in substitutions):
+        recorder = TitleRecorder()
+        adjust_headings(body, 1, keep_numbers, {"substitutions": recorder})
+        headings = recorder.titles.intersection(substitutions)
+
+    return ScannedFile(None, title_match.group(1) if title_match else None, headings, includes)
+
+def find_order_roots(source, index):
+    """
+    Returns source and every directory below it that has its own order.yaml, skipping .no_compile directories.
+    """
+    roots = [source]
+    pending = [source]
+
+    while pending:
+        directory = pending.pop()
+        try:
+            names = index.listdir(directory)
+        except OSError:
+            continue
+
+        for name in names:
+            path = os.path.join(directory, name)
+            if index.is_dir(path) and not index.has_marker(path, ".no_compile"):
+                if index.is_file(os.path.join(path, "order.yaml")):
+                    roots.append(path)
+                pending.append(path)
+
+    return roots
+
+def suggest_name(folder_path, name, index):
+    """
+    Returns the entry of folder_path an order entry that does not exist probably meant, or None.
+    """
+    try:
+        names = index.listdir(folder_path)
+    except OSError:
+        return None
+
+    for candidate in (f"{name}.md", name.strip(), remove_leading_number(name)):
+        if candidate != name and candidate in names:
+            return candidate
+
+    stripped = remove_leading_number(name)
+    for candidate in names:
+        if candidate != name and stripped in (remove_leading_number(candidate), remove_leading_number(os.path.splitext(candidate)[0])):
+            return candidate
+
+    return None
+
+def check_order_entries(folder_path, item_order, order_file, index, problems):
+    """
+    Reports entries of a compiled order that are listed twice, do not exist or are neither folders nor markdown files.
+    """
+    if not item_order:
+        return
+
+    counts = Counter(entry.name for entry in item_order)
+    for name, count in counts.items():
+        if count > 1:
+            problems.add(Problem(order_file, "error", f"'{name}' is listed {count} times in the order of '{folder_path}'"))
+
+    for entry in item_order:
+        item_path = os.path.join(folder_path, entry.name)
+
+        # The title and order settings of a folder end up in its order as entries of the same name.
+        if entry.name in ("title", "order") and not index.exists(item_path):
+            continue
+
+        if not index.exists(item_path):
+            message = f"'{entry.name}' in the order of '{folder_path}' does not exist"
+            suggestion = suggest_name(folder_path, entry.name, index)
+            problems.add(Problem(order_file, "error", f"{message} (did you mean '{suggestion}'?)" if suggestion else message))
+        elif not index.is_dir(item_path) and not entry.name.endswith('.md'):
+            problems.add(Problem(order_file, "warning", f"'{entry.name}' in the order of '{folder_path}' is not a markdown file and is ignored"))
+        elif entry.order and not index.is_dir(item_path):
+            problems.add(Problem(order_file, "warning", f"'{entry.name}' in the order of '{folder_path}' has a sub-order but is not a folder"))
+
+def walk_document(folder_path, item_order, include_all, keep_numbers, order_file, index, files, titles, problems):
+    """
+    Collects the files a folder compiles into files, mapping each to its custom title, and the folder titles
+    into titles, checking every order on the way.
+    """
+    check_order_entries(folder_path, item_order, order_file, index, problems)
+
+    for kind, item_path, custom_title, sub_item_order, sub_include_all in iter_folder_items(folder_path, item_order, include_all, index):
+        if kind == "file":
+            if custom_title or item_path not in files:
+                files[item_path] = custom_title
+        elif kind == "folder":
+            titles.add(get_folder_title(item_path, custom_title, keep_numbers))
+            walk_document(item_path, compile_order(sub_item_order), sub_include_all, keep_numbers, order_file, index, files, titles, problems)
+
+def find_include_cycles(graph):
+    """
+    Returns every include cycle in graph, a dict of file paths to the paths they include, as a list
+    of paths starting and ending with the same file. Uses Tarjan's algorithm without recursion.
+    """
+    indices = {}
+    lowlinks = {}
+    stack = []
+    on_stack = set()
+    cycles = []
+    counter = 0
+
+    for start in sorted(graph):
+        if start in indices:
+            continue
+
+        work = [(start, iter(sorted(graph.get(start, ()))))]
+        indices[start] = lowlinks[start] = counter
+        counter += 1
+        stack.append(start)
+        on_stack.add(start)
+
+        while work:
+            node, successors = work[-1]
+            advanced = False
+
+            for successor in successors:
+                if successor not in indices:
+                    indices[successor] = lowlinks[successor] = counter
+                    counter += 1
+                    stack.append(successor)
+                    on_stack.add(successor)
+                    work.append((successor, iter(sorted(graph.get(successor, ())))))
+                    advanced = True
+                    break
+                if successor in on_stack:
+                    lowlinks[node] = min(lowlinks[node], indices[successor])
+
+            if advanced:
+                continue
+
+            work.pop()
+            if work:
+                lowlinks[work[-1][0]] = min(lowlinks[work[-1][0]], lowlinks[node])
+
+            if lowlinks[node] == indices[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    component.append(member)
+                    if member == node:
+                        break
+
+                if len(component) > 1 or node in graph.get(node, ()):
+                    cycles.append(trace_cycle(graph, set(component)))
+
+    return cycles
+
+def trace_cycle(graph, component):
+    """
+    Returns one cycle through the files of a strongly connected component, starting at its first path.
+    """
+    start = min(component)
+    path = [start]
+    seen = {start}
+
+    while True:
+        successors = sorted(successor for successor in graph.get(path[-1], ()) if successor in component)
+        if start in successors:
+            return path + [start]
+        following = next((successor for successor in successors if successor not in seen), successors[0])
+        if following in seen:
+            return path[path.index(following):] + [following]
+        path.append(following)
+        seen.add(following)
+
+def scan_files(paths, keep_numbers=False, substitutions=()):
+    return [(path, scan_file(path, keep_numbers, substitutions)) for path in paths]
+
+def batches(paths, jobs, size=BATCH_SIZE):
+    """
+    Splits paths into batches of at most size paths, and at least one batch per job when there are enough.
+    """
+    size = max(1, min(size, -(-len(paths) // max(1, jobs))))
+    return [paths[i:i + size] for i in range(0, len(paths), size)]
+
+def check_includes(path, result, index, graph, problems):
+    """
+    Reports the read error and broken include directives of a scanned file, adds its includes to graph
+    and returns the included paths.
+    """
+    if result.error:
+        problems.add(Problem(path, "error", result.error))
+        return []
+
+    targets = graph[path] = set()
+    for attributes in result.includes:
+        if attributes is None:
+            problems.add(Problem(path, "warning", "include directive is not well-formed and is left as it is"))
+            continue
+
+        include_file = attributes.get('file')
+        if not include_file:
+            problems.add(Problem(path, "error", "include directive has no file attribute"))
+            continue
+
+        try:
+            int(attributes.get('heading-level', 1))
+        except ValueError:
+            problems.add(Problem(path, "error", f"include of '{include_file}' has a heading-level that is not a number: '{attributes['heading-level']}'"))
+
+        target = resolve_include_path(include_file, os.path.dirname(path), index)
+        if not index.is_file(target):
+            problems.add(Problem(path, "error", f"included file '{include_file}' does not exist"))
+            continue
+
+        targets.add(os.path.abspath(target))
+
+    return sorted(targets)
+
+def check_tree(source, yaml_path=None, include_all=True, keep_numbers=False, mod_path=None, jobs=DEFAULT_JOBS):
+    """
+    Checks the source tree without compiling it and returns the sorted problems and the number of files checked.
+
+    Every directory compile would use as a document root is walked with its order file, and the
+    markdown files found, together with everything they include, are read and scanned in batches on a
+    pool of jobs processes.
+    """
+    source = os.path.abspath(source)
+    index = TreeIndex()
+    plan_cache = PlanCache()
+    problems = set()
+    files = {}
+    folder_titles = set()
+
+    roots = [source] if yaml_path else find_order_roots(source, index)
+
+    for root in roots:
+        order_file = yaml_path if yaml_path else os.path.join(root, "order.yaml")
+        order_file = os.path.abspath(order_file) if index.exists(order_file) else None
+
+        try:
+            root_title, item_order, include, _ = resolve_document(root, order_file, include_all, keep_numbers, None, index, plan_cache)
+        except (OSError, ValueError, yaml.YAMLError) as e:
+            problems.add(Problem(order_file or root, "error", f"invalid order file: {e}"))
+            continue
+
+        folder_titles.add(root_title)
+        walk_document(root, item_order, include, keep_numbers, order_file or root, index, files, folder_titles, problems)
+
+    if yaml_path and not index.exists(yaml_path):
+        problems.add(Problem(os.path.abspath(yaml_path), "error", "order file does not exist"))
+
+    substitutions = load_substitutions(mod_path, problems) if mod_path else None
+    titles = tuple(title for title in substitutions if isinstance(title, str)) if substitutions else ()
+
+    scanned = {}
+    graph = {}
+
+    with ProcessPoolExecutor(max_workers=max(1, jobs)) as executor:
+        pending = {executor.submit(scan_files, batch, keep_numbers, titles) for batch in batches(list(files), jobs)}
+        submitted = set(files)
+
+        # Include targets are scanned in further batches as they are found, while the main process
+        # resolves the include paths of finished batches in the index.
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            found = []
+
+            for future in done:
+                for path, result in future.result():
+                    scanned[path] = result
+                    for target in check_includes(path, result, index, graph, problems):
+                        if target not in submitted:
+                            submitted.add(target)
+                            found.append(target)
+
+            pending.update(executor.submit(scan_files, batch, keep_numbers, titles) for batch in batches(found, jobs))
+
+    for cycle in find_include_cycles(graph):
+        problems.add(Problem(cycle[0], "error", f"include cycle: {' -> '.join(os.path.relpath(path, source) for path in cycle)}"))
+
+    if substitutions:
+        check_substitutions(mod_path, substitutions, files, scanned, folder_titles, keep_numbers, problems)
+
+    return sorted(problems), len(scanned)
+
+def load_substitutions(mod_path, problems):
+    """
+    Returns the substitutions of a modification file, or None after reporting why it cannot be used.
+    """
+    mod_path = os.path.abspath(mod_path)
+
+    try:
+        with open(mod_path, 'r') as f:
+            mod_config = yaml.safe_load(f)
+    except OSError as e:
+        problems.add(Problem(mod_path, "error", f"modification file cannot be read: {e.strerror or e}"))
+        return None
+    except yaml.YAMLError as e:
+        problems.add(Problem(mod_path, "error", f"invalid modification file: {e}"))
+        return None
+
+    substitutions = mod_config.get("substitutions") if isinstance(mod_config, dict) else None
+    if not isinstance(substitutions, dict):
+        problems.add(Problem(mod_path, "error", "modification file has no 'substitutions' mapping"))
+        return None
+
+    return substitutions
+
+def check_substitutions(mod_path, substitutions, files, scanned, folder_titles, keep_numbers, problems):
+    """
+    Reports substitutions that match no title compile would look up: no folder or file title and no heading.
+    """
+    titles = set(folder_titles)
+    for path, custom_title in files.items():
+        result = scanned.get(path)
+        title = custom_title or (result.title if result is not None else None) or os.path.splitext(os.path.basename(path))[0]
+        titles.add(title if keep_numbers else remove_leading_number(title))
+
+    for result in scanned.values():
+        titles.update(result.headings)
+
+    for title in substitutions:
+        if title not in titles:
+            problems.add(Problem(os.path.abspath(mod_path), "warning", f"substitution for '{title}' matches no title"))
+
+def format_problem(problem, source):
+    path = os.path.relpath(problem.path, source) if problem.path.startswith(source.rstrip(os.sep) + os.sep) else problem.path
+    return f"{path}: {problem.severity}: {problem.message}"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="compile-markdown check", description="Check a Markdown source tree for broken order files, includes and substitutions without compiling it.")
+    parser.add_argument("-a", "--all", action="store_true", default=None, help="Include all markdown files, even those not in the YAML file")
+    parser.add_argument("-c", "--config", help="Path to the YAML config file (default: compile.yaml in source directory)")
+    parser.add_argument("-j", "--jobs", type=int, help="Number of worker processes scanning files (default: number of CPUs)")
+    parser.add_argument("-k", "--keep-numbers", action="store_true", default=None, help="Keep leading numbers in titles")
+    parser.add_argument("-m", "--mod", help="Path to the YAML modification file")
+    parser.add_argument("-s", "--source", help="Path to the source directory (default: current working directory)")
+    parser.add_argument("-y", "--yaml", help="Path to the YAML order file (default: order.yaml in every directory)")
+    parser.add_argument("--strict", action="store_true", help="Exit with status 1 on warnings as well")
+
+    args = parser.parse_args(argv)
+
+    include_all = args.all
+    keep_numbers = args.keep_numbers
+    source = args.source
+    yaml_path = args.yaml
+    mod_path = args.mod
+    jobs = args.jobs
+
+    config_path = args.config or "compile.yaml"
+    config = None
+    if os.path.exists(config_path):
+        with open(config_path, 'r') as f:
+            config = yaml.safe_load(f)
+
+    if config:
+        if "include_all" in config:
+            include_all = include_all if include_all else config.get("include_all")
+        if "keep_numbers" in config:
+            keep_numbers = keep_numbers if keep_numbers else config.get("keep_numbers")
+        if "source" in config:
+            source = source if source else config.get("source")
+        if "yaml_path" in config:
+            yaml_path = yaml_path if yaml_path else config.get("yaml_path")
+        if "modification_path" in config:
+            mod_path = mod_path if mod_path else config.get("modification_path")
+        if "jobs" in config:
+            jobs = jobs if jobs else config.get("jobs")
+
+    include_all = True if include_all is None else include_all
+    keep_numbers = False if keep_numbers is None else keep_numbers
+    jobs = DEFAULT_JOBS if jobs is None else jobs
+    source = os.getcwd() if source is None else source
+
+    if not os.path.isdir(source):
+        print(f"Error: Source directory '{source}' does not exist")
+        sys.exit(2)
+
+    problems, checked = check_tree(source, yaml_path, include_all, keep_numbers, mod_path, jobs)
+
+    source = os.path.abspath(source)
+    for problem in problems:
+        print(format_problem(problem, source))
+
+    errors = sum(1 for problem in problems if problem.severity == "error")
+    warnings = len(problems) - errors
+    print(f"Checked {checked} files: {errors} errors, {warnings} warnings")
+
+    if errors or (args.strict and warnings):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import os
+import sys
+import json
+import socket
+import tempfile
+
+DAEMON_PROTOCOL_VERSION = 1
+SOCKET_ENV = "COMPILE_MARKDOWN_SOCKET"
+
+def get_socket_path():
+    """
+    Returns the socket of the compile daemon: $COMPILE_MARKDOWN_SOCKET, or a per-user socket in
+    $XDG_RUNTIME_DIR or the temporary directory.
+    """
+    path = os.environ.get(SOCKET_ENV)
+    if path:
+        return os.path.abspath(path)
+
+    directory = os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir()
+    return os.path.join(directory, f"compile-markdown-{os.getuid()}.sock")
+
+def send_message(connection, message):
+    connection.sendall(json.dumps(message).encode('utf-8') + b"\n")
+
+def connect(socket_path, timeout=1.0):
+    """
+    Returns a socket connected to the daemon at socket_path, or None if no daemon of this user listens there.
+    """
+    try:
+        if os.stat(socket_path).st_uid != os.getuid():
+            return None
+    except OSError:
+        return None
+
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.settimeout(timeout)
+    try:
+        connection.connect(socket_path)
+    except OSError:
+        connection.close()
+        return None
+
+    connection.settimeout(None)
+    return connection
+
+def runs_in_process(argv):
+    """
+    Returns True for the commands the daemon does not run: subcommands and watch mode, which never returns.
+    """
+    if argv[:1] in (["serve"], ["check"], ["daemon"]):
+        return True
+
+    return any(arg == "--watch" or (arg.startswith("-") and not arg.startswith("--") and "w" in arg[1:]) for arg in argv)
+
+def reads_stdin(argv):
+    return "--changed=-" in argv or any(arg == "--changed" and value == "-" for arg, value in zip(argv, argv[1:]))
+
+def forward(argv, socket_path=None):
+    """
+    Runs compile-markdown with argv on the daemon, copying its output here, and returns the exit status,
+    or None if no daemon took the request and it has to run in this process.
+    """
+    connection = connect(get_socket_path() if socket_path is None else socket_path)
+    if connection is None:
+        return None
+
+    with connection:
+        request = {
+            "version": DAEMON_PROTOCOL_VERSION,
+            "argv": argv,
+            "cwd": os.getcwd(),
+            "stdin": sys.stdin.read() if reads_stdin(argv) else None,
+        }
+
+        answered = False
+        try:
+            send_message(connection, request)
+            for line in connection.makefile('r', encoding='utf-8'):
+                message = json.loads(line)
+                if "fallback" in message:
+                    return None
+                if "exit" in message:
+                    return message["exit"]
+
+                answered = True
+                stream = sys.stdout if "stdout" in message else sys.stderr
+                stream.write(message.get("stdout", message.get("stderr", "")))
+                stream.flush()
+        except (OSError, ValueError):
+            pass
+
+    if not answered:
+        return None
+
+    print("Error: The compile daemon stopped before finishing the request", file=sys.stderr)
+    return 1
+
+def main():
+    """
+    Entry point of compile-markdown: forwards the command to a running compile daemon, or runs it in this process.
+
+    Only socket and json are imported before forwarding, so a forwarded call skips loading the compiler.
+    """
+    argv = sys.argv[1:]
+
+    if not runs_in_process(argv):
+        status = forward(argv)
+        if status is not None:
+            sys.exit(status)
+
+    from markdown_utils.compile_markdown import main as compile_main
+    compile_main(argv)
+
+if __name__ == "__main__":
+    main()
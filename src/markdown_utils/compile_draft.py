@@ -1,34 +1,186 @@
 import os
 import argparse
 import shutil
+import hashlib
+import itertools
+from concurrent.futures import ThreadPoolExecutor
 
-def remove_directory(directory):
-    try:
-        shutil.rmtree(directory)
-    except FileNotFoundError:
-        pass
-    except OSError as e:
-        print(f"Error: Failed to remove directory '{directory}': {e}")
+# ioctl request that clones a file's extents on Linux filesystems with reflink support (Btrfs, XFS).
+FICLONE = 0x40049409
 
-def copy_directory(source_dir, target_dir):
-    try:
-        shutil.copytree(source_dir, target_dir)
-    except OSError as e:
-        print(f"Error: Failed to copy directory '{source_dir}' to '{target_dir}': {e}")
+temp_counter = itertools.count()
 
 def prevent_headings(target_dir):
     for item in os.listdir(target_dir):
         item_path = os.path.join(target_dir, item)
         if os.path.isdir(item_path):
+            marker = os.path.join(item_path, ".no-headings")
+            if os.path.exists(marker):
+                continue
             try:
-                with open(os.path.join(item_path, ".no-headings"), 'w') as f:
+                with open(marker, 'w') as f:
                     pass
             except OSError as e:
                 print(f"Error: Failed to create .no-headings file in '{item_path}': {e}")
 
+def scan_tree(root):
+    """
+    Returns {relative path: (is_dir, size, mtime_ns)} for everything below root, using one os.scandir pass per directory.
+    """
+    entries = {}
+    pending = [""]
+
+    while pending:
+        relative_dir = pending.pop()
+        try:
+            with os.scandir(os.path.join(root, relative_dir)) as it:
+                for entry in it:
+                    relative_path = os.path.join(relative_dir, entry.name)
+                    try:
+                        if entry.is_dir():
+                            entries[relative_path] = (True, -1, 0)
+                            pending.append(relative_path)
+                        else:
+                            st = entry.stat()
+                            entries[relative_path] = (False, st.st_size, st.st_mtime_ns)
+                    except OSError as e:
+                        print(f"Error: Failed to read '{entry.path}': {e}")
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Error: Failed to list directory '{os.path.join(root, relative_dir)}': {e}")
+
+    return entries
+
+def hash_file(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def file_changed(source_path, target_path, source_entry, target_entry, checksum=False):
+    if target_entry is None or target_entry[0] or source_entry[1] != target_entry[1]:
+        return True
+
+    if checksum:
+        return hash_file(source_path) != hash_file(target_path)
+
+    return source_entry[2] != target_entry[2]
+
+def reflink(source_path, target_path):
+    """
+    Clones source_path into target_path without copying data. Raises OSError where reflinks are not supported.
+    """
+    import fcntl
+
+    with open(source_path, 'rb') as src, open(target_path, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    shutil.copystat(source_path, target_path)
+
+def sync_file(source_path, target_path, hardlink=False):
+    """
+    Replaces target_path with a hardlink, reflink or copy of source_path through a temporary file,
+    so a target that shares an inode with an older source is never written through.
+    """
+    directory, name = os.path.split(target_path)
+    temp_path = os.path.join(directory, f".{name}.{os.getpid()}.{next(temp_counter)}.tmp")
+
+    try:
+        if hardlink:
+            try:
+                os.link(source_path, temp_path)
+            except OSError:
+                hardlink = False
+
+        if not hardlink:
+            try:
+                reflink(source_path, temp_path)
+            except (OSError, ImportError):
+                shutil.copy2(source_path, temp_path)
+
+        os.replace(temp_path, target_path)
+    except BaseException:
+        if os.path.lexists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def sync_directory(source_dir, target_dir, checksum=False, hardlink=False, jobs=8, keep=()):
+    """
+    Makes target_dir a mirror of source_dir, touching only what differs.
+
+    Files count as changed when their size or modification time differ, or with checksum=True when
+    their size or content hash differ. Changed files are copied on a pool of jobs threads, using
+    reflinks where the filesystem supports them or hardlinks with hardlink=True. Entries missing
+    from source_dir are deleted unless their relative path is in keep. Returns the number of
+    copied and deleted entries.
+    """
+    source_entries = scan_tree(source_dir)
+    target_entries = scan_tree(target_dir)
+    keep = set(keep)
+
+    deleted = 0
+    removed_dirs = ()
+    for relative_path in sorted(target_entries):
+        if relative_path.startswith(removed_dirs):
+            target_entries.pop(relative_path)
+            continue
+
+        target_entry = target_entries[relative_path]
+        source_entry = source_entries.get(relative_path)
+        if relative_path in keep and source_entry is None:
+            continue
+        if source_entry is not None and source_entry[0] == target_entry[0]:
+            continue
+
+        target_path = os.path.join(target_dir, relative_path)
+        try:
+            if target_entry[0]:
+                shutil.rmtree(target_path)
+                removed_dirs += (relative_path + os.sep,)
+            else:
+                os.remove(target_path)
+            deleted += 1
+        except OSError as e:
+            print(f"Error: Failed to remove '{target_path}': {e}")
+
+        target_entries.pop(relative_path)
+
+    os.makedirs(target_dir, exist_ok=True)
+    for relative_path in sorted(source_entries):
+        if source_entries[relative_path][0] and relative_path not in target_entries:
+            try:
+                os.makedirs(os.path.join(target_dir, relative_path), exist_ok=True)
+            except OSError as e:
+                print(f"Error: Failed to create directory '{os.path.join(target_dir, relative_path)}': {e}")
+
+    def copy_if_changed(relative_path):
+        source_path = os.path.join(source_dir, relative_path)
+        target_path = os.path.join(target_dir, relative_path)
+        source_entry = source_entries[relative_path]
+        target_entry = target_entries.get(relative_path)
+
+        try:
+            if not file_changed(source_path, target_path, source_entry, target_entry, checksum):
+                return False
+            sync_file(source_path, target_path, hardlink)
+            return True
+        except OSError as e:
+            print(f"Error: Failed to copy '{source_path}' to '{target_path}': {e}")
+            return False
+
+    files = [relative_path for relative_path, entry in source_entries.items() if not entry[0]]
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        copied = sum(executor.map(copy_if_changed, files))
+
+    return copied, deleted
+
 def main():
     parser = argparse.ArgumentParser(description="Compile Draft directory into the Manuscript directory")
+    parser.add_argument("-c", "--checksum", action="store_true", help="Compare file contents by hash instead of by modification time")
     parser.add_argument("-d", "--destination", help="Path to the destination directory relative to current working directory (default: './Manuscript')")
+    parser.add_argument("-j", "--jobs", type=int, default=8, help="Number of files copied in parallel (default: 8)")
+    parser.add_argument("-l", "--hardlink", action="store_true", help="Hardlink the manuscript files to the draft files instead of copying them")
     parser.add_argument("-s", "--source", help="Path to the source directory relative to the current working directory (default: ./Draft)")
 
     args = parser.parse_args()
@@ -36,9 +188,17 @@ def main():
     source = os.path.normpath(os.path.join(os.getcwd(), "Draft" if args.source is None else args.source))
     destination = os.path.normpath(os.path.join(os.getcwd(), "Manuscript" if args.destination is None else args.destination))
 
-    remove_directory(destination)
-    copy_directory(source, destination)
+    if not os.path.isdir(source):
+        print(f"Error: '{source}' is not a valid directory.")
+        return
+
+    # The .no-headings markers written into the top-level folders are not part of the draft, but must survive the sync.
+    markers = [os.path.join(name, ".no-headings") for name in os.listdir(source) if os.path.isdir(os.path.join(source, name))]
+
+    copied, deleted = sync_directory(source, destination, checksum=args.checksum, hardlink=args.hardlink, jobs=args.jobs, keep=markers)
     prevent_headings(destination)
 
+    print(f"Synced '{source}' to '{destination}': {copied} copied, {deleted} removed")
+
 if __name__ == "__main__":
     main()
@@ -1,12 +1,39 @@
 import os
 import re
+import sys
+import json
 import argparse
 import shutil
+import filecmp
+import itertools
 import yaml
+from concurrent.futures import ProcessPoolExecutor
 from typing import Any
+from markdown_utils.manifest import MANIFEST_NAME, BuildManifest, stat_signature
+from markdown_utils.fragment_store import FRAGMENT_STORE_NAME, FragmentStore
+from markdown_utils.source_map import SourceMap, get_source_map_path
+from markdown_utils.tree_index import MARKER_FILES, TreeIndex
+from markdown_utils.order_plan import PLAN_CACHE_NAME, PlanCache, compile_order
+from markdown_utils.prefetch import DEFAULT_MAX_BYTES, Prefetcher
+
+LEADING_NUMBER_PATTERN = re.compile(r'^\d+\s+')
+
+FRONTMATTER_PATTERN = re.compile(r'^---\n(.*?)\n---\n', re.DOTALL)
+EXISTING_TITLE_PATTERN = re.compile(r'^# (.+)$', re.MULTILINE)
+TITLE_LINE_PATTERN = re.compile(r'^# .+\n', re.MULTILINE)
+
+INCLUDE_PATTERN = re.compile(r'<!-- include\s+((?:[\w-]+="[^"]*"\s*)+)-->')
+INCLUDE_ATTRIBUTE_PATTERN = re.compile(r'([\w-]+)="([^"]*)"')
+INCLUDE_TITLE_PATTERN = re.compile(r'^# .+$\n*', re.MULTILINE)
+MAX_INCLUDE_DEPTH = 16
+
+# Matches either an ATX heading of level 1-8 or a code fence opener/closer at the start of a line.
+HEADING_OR_FENCE_PATTERN = re.compile(r'^(?:(#{1,8}) (.*)|( {0,3})(`{3,}|~{3,})(.*))', re.MULTILINE)
+
+temp_counter = itertools.count()
 
 def remove_leading_number(title):
-    return re.sub(r'^\d+\s+', '', title)
+    return LEADING_NUMBER_PATTERN.sub('', title, count=1)
 
 def substitute_title(title, mod_config):
     substitutions = mod_config.get("substitutions")
@@ -24,89 +51,242 @@ def read_file_safely(file_path):
     except (FileNotFoundError, PermissionError, IOError):
         return ""
 
+def read_prefetched(file_path, index=None):
+    """
+    Returns file content like read_file_safely, taking it from the prefetcher of index if it was read ahead.
+    """
+    content = None
+    if index is not None and index.prefetcher is not None:
+        content = index.prefetcher.take(file_path)
+
+    return read_file_safely(file_path) if content is None else content
+
+def find_include_paths(file_path, content):
+    """
+    Returns the paths content includes, resolved next to file_path without consulting the filesystem.
+    """
+    if '<!-- include' not in content:
+        return []
+
+    base_dir = os.path.dirname(file_path)
+    paths = []
+    for match in INCLUDE_PATTERN.finditer(content):
+        include_file = dict(INCLUDE_ATTRIBUTE_PATTERN.findall(match.group(0))).get('file')
+        if include_file:
+            paths.append(os.path.normpath(os.path.join(base_dir, include_file)))
+
+    return paths
+
+def create_prefetcher(workers, max_bytes=DEFAULT_MAX_BYTES):
+    return Prefetcher(read_file_safely, find_include_paths, workers=workers, max_bytes=max_bytes)
+
 def adjust_headings(content: str, base_level_offset: int = 0, keep_numbers: bool = False, mod_config: Any = None) -> str:
     """
     Adjusts all markdown heading levels in a string by a given offset.
+
+    Headings are rewritten in a single scan. Lines inside fenced code blocks are left untouched.
     """
-    if base_level_offset == 0:
+    if base_level_offset == 0 or '#' not in content:
         return content
 
-    for i in range(8, 0, -1):
-        def replace_func(match: re.Match) -> str:
-            original_level = len(match.group(1))
-            new_level = original_level + base_level_offset
+    fence = None
 
-            new_level = max(1, min(8, new_level))
+    def replace_func(match: re.Match) -> str:
+        nonlocal fence
 
-            title = match.group(2)
+        if match.group(1) is None:
+            marker, info = match.group(4), match.group(5)
+            if fence is None:
+                if marker[0] != '`' or '`' not in info:
+                    fence = marker
+            elif marker[0] == fence[0] and len(marker) >= len(fence) and not info.strip():
+                fence = None
+            return match.group(0)
 
-            if not keep_numbers:
-                title = remove_leading_number(title)
+        if fence is not None:
+            return match.group(0)
 
-            title = substitute_title(title, mod_config) if mod_config else title
+        new_level = max(1, min(8, len(match.group(1)) + base_level_offset))
 
-            return f'{"#" * new_level} {title}'
+        title = match.group(2)
 
-        search_pattern = re.compile(rf"^(#{'{'}{i}{'}'}) (.*)", re.MULTILINE)
-        content = search_pattern.sub(replace_func, content)
+        if not keep_numbers:
+            title = remove_leading_number(title)
 
-    return content
+        title = substitute_title(title, mod_config) if mod_config else title
+
+        return f'{"#" * new_level} {title}'
+
+    return HEADING_OR_FENCE_PATTERN.sub(replace_func, content)
 
-def process_includes(content: str, base_dir: str) -> str:
+def resolve_include_path(path, base_dir, index=None):
     """
-    Processes placeholders using this syntax: <!-- include file="path/to/file.md" heading-level="3" show-title="false" -->
+    Resolves an include path relative to the directory of the including file to an absolute path.
+
+    Trees written when includes resolved against the working directory keep working: if the path
+    does not exist next to the including file but does relative to the working directory, that is used.
+    """
+    index = TreeIndex() if index is None else index
+    resolved = os.path.abspath(os.path.join(base_dir, path))
+    if not index.exists(resolved) and index.exists(path):
+        return os.path.abspath(path)
+
+    return resolved
+
+def expand_include(path, level, show_title, include_cache=None, include_stack=(), index=None):
     """
-    pattern = re.compile(r'<!-- include\s+((?:[\w-]+="[^"]*"\s*)+)-->')
-    attr_pattern = re.compile(r'([\w-]+)="([^"]*)"')
+    Returns the heading-adjusted content of an included file, the paths it includes in turn and
+    whether the expansion was complete, i.e. did not hit a cycle or the depth limit.
+    """
+    if path in include_stack or len(include_stack) > MAX_INCLUDE_DEPTH:
+        return "", (), False
+
+    key = ("include", path, level, show_title)
+    if include_cache is not None and key in include_cache:
+        return include_cache[key]
+
+    raw_key = ("include-raw", path)
+    if include_cache is not None and raw_key in include_cache:
+        included_content = include_cache[raw_key]
+    else:
+        included_content = read_prefetched(path, index).strip()
+        if include_cache is not None:
+            include_cache[raw_key] = included_content
 
-    def parse_attributes(attr_string: str) -> dict:
-        return dict(attr_pattern.findall(attr_string))
+    if not show_title:
+        included_content = INCLUDE_TITLE_PATTERN.sub('', included_content, count=1)
+        level -= 1
+
+    included_content, nested_paths, complete = expand_includes(included_content, os.path.dirname(path), include_cache, include_stack + (path,), index)
+
+    level = max(0, level - 1)
+    result = (adjust_headings(included_content, level), tuple(nested_paths), complete)
+
+    # An incomplete expansion depends on which files were being expanded around it, so it is not reused.
+    if include_cache is not None and complete:
+        include_cache[key] = result
+
+    return result
+
+def expand_includes(content, base_dir, include_cache=None, include_stack=(), index=None):
+    included_paths = []
+    complete = True
+
+    if '<!-- include' not in content:
+        return content, included_paths, complete
+
+    index = TreeIndex() if index is None else index
 
     def replace_include(match: re.Match) -> str:
-        include_config = parse_attributes(match.group(0))
-        path = include_config['file']
+        nonlocal complete
+
+        include_config = dict(INCLUDE_ATTRIBUTE_PATTERN.findall(match.group(0)))
+        path = resolve_include_path(include_config['file'], base_dir, index)
         level = int(include_config.get('heading-level', 1))
         show_title = include_config.get('show-title', "true").lower() == "true"
 
-        included_content = read_file_safely(path).strip()
-
-        if not show_title:
-            included_content = re.sub(r'^# .+$\n*', '', included_content, count=1, flags=re.MULTILINE)
-            level -= 1
+        included_content, nested_paths, nested_complete = expand_include(path, level, show_title, include_cache, include_stack, index)
 
-        level = max(0, level - 1)
-        included_content = adjust_headings(included_content, level)
+        included_paths.append(path)
+        included_paths.extend(nested_paths)
+        complete = complete and nested_complete
 
         return included_content
 
-    return pattern.sub(replace_include, content)
+    return INCLUDE_PATTERN.sub(replace_include, content), included_paths, complete
 
-def get_content_for_path(item_path, depth=1, custom_title=None, keep_numbers=False, mod_config=None, ignore_frontmatter=False) -> str:
+def process_includes(content: str, base_dir: str, included_paths: list = None, include_cache: dict = None, include_stack: tuple = (), index: TreeIndex = None) -> str:
+    """
+    Processes placeholders using this syntax: <!-- include file="path/to/file.md" heading-level="3" show-title="false" -->
 
-    content = read_file_safely(item_path)
+    Paths resolve relative to base_dir, the directory of the including file, and includes inside
+    included files are expanded as well. An include that cycles back to a file in include_stack
+    or nests deeper than MAX_INCLUDE_DEPTH expands to nothing, like an unreadable file does.
+    The path of every included file is appended to included_paths when it is given, and
+    include_cache is a per-run dict that keeps raw and heading-adjusted include content, and
+    index the TreeIndex include paths are looked up in.
+    """
+    content, paths, _ = expand_includes(content, base_dir, include_cache, include_stack, index)
 
-    if not content:
-        return ""
+    if included_paths is not None:
+        included_paths.extend(paths)
 
-    content = process_includes(content, os.path.dirname(item_path))
+    return content
 
-    frontmatter_content = ""
+def read_source(item_path, include_cache=None, index=None):
+    """
+    Returns the parts of a markdown file that do not depend on any compile option, or None if it is empty.
 
-    frontmatter_pattern = r'^---\n(.*?)\n---\n'
-    frontmatter_match = re.match(frontmatter_pattern, content, re.DOTALL)
-    if frontmatter_match:
-        frontmatter_content = "" if ignore_frontmatter else f"## Metadata\n\n{frontmatter_match.group(1).strip()}" + "\n\n"
-        content = content[frontmatter_match.end():].strip()
-    else:
-        content = content.strip()
+    That is the frontmatter text (None without frontmatter), the existing title (None without one),
+    the content with frontmatter and first title line removed as a tuple of strings to join, and the
+    paths of the included files. With an include_cache, every file is read and include-expanded once.
+    """
+    key = ("source", item_path)
+    if include_cache is not None and key in include_cache:
+        return include_cache[key]
+
+    source = None
+    content = read_prefetched(item_path, index)
+
+    if content:
+        included_paths = []
+        content = process_includes(content, os.path.dirname(item_path), included_paths, include_cache, (os.path.abspath(item_path),), index)
+
+        frontmatter = None
+        frontmatter_match = FRONTMATTER_PATTERN.match(content) if content.startswith("---\n") else None
+        if frontmatter_match:
+            frontmatter = frontmatter_match.group(1).strip()
+            content = content[frontmatter_match.end():].strip()
+        else:
+            content = content.strip()
+
+        existing_title_match = EXISTING_TITLE_PATTERN.match(content)
+        existing_title = existing_title_match.group(1) if existing_title_match else None
+
+        # Drop the first title line and strip what is left, slicing around it instead of copying
+        # the whole content for every step. content is already stripped, so only the edges next
+        # to the removed line can carry whitespace.
+        title_line = TITLE_LINE_PATTERN.search(content)
+        if title_line is None:
+            remainder = (content,)
+        elif title_line.start() == 0:
+            remainder = (content[title_line.end():].lstrip(),)
+        elif title_line.end() == len(content):
+            remainder = (content[:title_line.start()].rstrip(),)
+        else:
+            remainder = (content[:title_line.start()], content[title_line.end():])
+
+        source = (frontmatter, existing_title, remainder, tuple(included_paths))
+
+    if include_cache is not None:
+        include_cache[key] = source
+
+    return source
+
+def get_body_for_path(item_path, custom_title=None, keep_numbers=False, mod_config=None, ignore_frontmatter=False, included_paths=None, include_cache=None, index=None) -> str:
+    """
+    Returns the titled content of a markdown file before its headings are shifted to a depth.
+    """
+    index = TreeIndex() if index is None else index
+    source = read_source(item_path, include_cache, index)
+
+    if source is None:
+        return ""
+
+    frontmatter, existing_title, remainder, paths = source
 
-    existing_title_match = re.match(r'^# (.+)$', content, re.MULTILINE)
+    if included_paths is not None:
+        included_paths.extend(paths)
+
+    frontmatter_content = ""
+    if frontmatter is not None and not ignore_frontmatter:
+        frontmatter_content = f"## Metadata\n\n{frontmatter}\n\n"
 
     new_title = os.path.splitext(os.path.basename(item_path))[0]
     if custom_title:
         new_title = custom_title
-    elif existing_title_match:
-        new_title = existing_title_match.group(1)
+    elif existing_title is not None:
+        new_title = existing_title
 
     if not keep_numbers:
         new_title = remove_leading_number(new_title)
@@ -114,82 +294,253 @@ def get_content_for_path(item_path, depth=1, custom_title=None, keep_numbers=Fal
     new_title = substitute_title(new_title, mod_config) if mod_config else new_title
     new_title_header = f"# {new_title}"
 
-    if os.path.exists(os.path.join(os.path.dirname(item_path), ".no-headings")):
+    if index.has_marker(os.path.dirname(item_path), ".no-headings"):
         new_title_header = "* * *"
 
-    content = re.sub(r'^# .+\n', '', content, count=1, flags=re.MULTILINE)
-    content = f"{new_title_header}\n\n{frontmatter_content}{content.strip()}\n"
+    return "".join((new_title_header, "\n\n", frontmatter_content, *remainder, "\n"))
+
+def render_body(body, depth=1, keep_numbers=False, mod_config=None) -> str:
+    if not body:
+        return ""
+
+    return f"\n{adjust_headings(body, depth, keep_numbers, mod_config)}"
+
+def get_content_for_path(item_path, depth=1, custom_title=None, keep_numbers=False, mod_config=None, ignore_frontmatter=False, index=None) -> str:
+    body = get_body_for_path(item_path, custom_title, keep_numbers=keep_numbers, mod_config=mod_config, ignore_frontmatter=ignore_frontmatter, index=index)
+
+    return render_body(body, depth, keep_numbers, mod_config)
+
+def fragment_key(folder_path, item_order=None, include_all=False):
+    return f"{folder_path}\0{item_order!r}\0{include_all}"
+
+def build_folder_fragment(folder_path, item_order=None, include_all=False, keep_numbers=False, mod_config=None, ignore_frontmatter=False, fragment_cache=None, lazy=False, index=None, include_cache=None, fragment_store=None):
+    """
+    Builds the depth-independent structure of a compiled folder.
+
+    The fragment is a tuple of ("file", path, body, included_paths), ("folder", path, title,
+    fragment, key) and ("skip", path) entries, the latter for folders excluded by .no_compile.
+    When a fragment_cache dict is given, file bodies and folder fragments are built once and
+    reused by every output that contains them. The cache is only valid for a single set of options.
+
+    With lazy=True the fragment is a generator instead, and nested folders are generators too,
+    so files are only read as the fragment is rendered and no body outlives its rendering. Only
+    include content is kept in fragment_cache then.
+
+    Folder listings and file types come from index, a TreeIndex shared by the whole run. Sources and
+    includes are kept in include_cache, which defaults to fragment_cache and, unlike fragment_cache,
+    can be shared between runs with different options. File bodies are also kept in fragment_store,
+    a FragmentStore that persists them between runs.
+    item_order is a list of order.yaml entries or an order compiled with compile_order.
+    """
+    item_order = compile_order(item_order)
+
+    if lazy:
+        return iter_folder_entries(folder_path, item_order, include_all, keep_numbers, mod_config, ignore_frontmatter, fragment_cache, lazy, index, include_cache, fragment_store)
+
+    cache_key = None
+    if fragment_cache is not None:
+        cache_key = fragment_key(folder_path, item_order, include_all)
+        if cache_key in fragment_cache:
+            return fragment_cache[cache_key]
+
+    fragment = tuple(iter_folder_entries(folder_path, item_order, include_all, keep_numbers, mod_config, ignore_frontmatter, fragment_cache, lazy, index, include_cache, fragment_store))
+
+    if cache_key is not None:
+        fragment_cache[cache_key] = fragment
+
+    return fragment
+
+def iter_folder_entries(folder_path, item_order=None, include_all=False, keep_numbers=False, mod_config=None, ignore_frontmatter=False, fragment_cache=None, lazy=False, index=None, include_cache=None, fragment_store=None):
+    index = TreeIndex() if index is None else index
+    include_cache = fragment_cache if include_cache is None else include_cache
+    item_order = compile_order(item_order)
+
+    def file_entry(item_path, custom_title=None):
+        file_key = ("file", item_path, custom_title)
+        if fragment_cache is not None and file_key in fragment_cache:
+            return fragment_cache[file_key]
+
+        def build_body():
+            included_paths = []
+            body = get_body_for_path(item_path, custom_title, keep_numbers=keep_numbers, mod_config=mod_config, ignore_frontmatter=ignore_frontmatter, included_paths=included_paths, include_cache=include_cache, index=index)
+            return body, included_paths
+
+        if fragment_store is None:
+            body, included_paths = build_body()
+        else:
+            no_headings = index.has_marker(os.path.dirname(item_path), ".no-headings")
+            options = [custom_title, keep_numbers, ignore_frontmatter, no_headings, fragment_store.config_hash(mod_config)]
+            body, included_paths = fragment_store.body(item_path, options, build_body, index)
+
+        entry = ("file", item_path, body, tuple(included_paths))
+
+        if fragment_cache is not None and not lazy:
+            fragment_cache[file_key] = entry
 
-    content = adjust_headings(content, depth, keep_numbers, mod_config)
+        return entry
 
-    return f"\n{content}"
+    def folder_entry(item_path, sub_item_order, sub_include_all, custom_title=None):
+        title = get_folder_title(item_path, custom_title, keep_numbers, mod_config)
 
-def process_folder(folder_path, depth=1, item_order=None, include_all=False, keep_numbers=False, mod_config=None, ignore_frontmatter=False):
-    output = []
+        sub_fragment = build_folder_fragment(item_path, sub_item_order, include_all=sub_include_all, keep_numbers=keep_numbers, mod_config=mod_config, ignore_frontmatter=ignore_frontmatter, fragment_cache=fragment_cache, lazy=lazy, index=index, include_cache=include_cache, fragment_store=fragment_store)
+
+        return ("folder", item_path, title, sub_fragment, fragment_key(item_path, sub_item_order, sub_include_all))
+
+    for kind, item_path, custom_title, sub_item_order, sub_include_all in iter_folder_items(folder_path, item_order, include_all, index):
+        if kind == "folder":
+            yield folder_entry(item_path, sub_item_order, sub_include_all, custom_title)
+        elif kind == "file":
+            yield file_entry(item_path, custom_title)
+        else:
+            yield ("skip", item_path)
+
+def get_folder_title(folder_path, custom_title=None, keep_numbers=False, mod_config=None):
+    title = custom_title or os.path.basename(folder_path)
+    if not keep_numbers:
+        title = remove_leading_number(title)
+
+    return substitute_title(title, mod_config) if mod_config else title
+
+def iter_folder_items(folder_path, item_order=None, include_all=False, index=None):
+    """
+    Yields the items of a folder in document order as (kind, path, custom_title, sub_item_order, sub_include_all),
+    where kind is "file", "folder" or "skip". item_order is an order compiled with compile_order.
+    """
     processed_items = set()
 
     if item_order:
-        for item in item_order:
-            sub_item_order = None
-            item_name = item
-            custom_title = None
-
-            if isinstance(item, dict):
-                item_name, item_value = next(iter(item.items()))
-                if isinstance(item_value, str):
-                    custom_title = item_value
-                elif isinstance(item_value, list):
-                    order_list = list()
-                    for sub_item in item_value:
-                        if isinstance(sub_item, dict) and 'order' in sub_item:
-                            sub_item_order = sub_item['order']
-                        elif isinstance(sub_item, dict) and 'title' in sub_item:
-                            custom_title = sub_item['title']
-                        elif isinstance(sub_item, str):
-                            order_list.append(sub_item)
-                    if len(order_list) > 0 and sub_item_order == None:
-                        sub_item_order = order_list
-
+        for item_name, custom_title, sub_item_order in item_order:
             item_path = os.path.join(folder_path, item_name)
             processed_items.add(item_name)
 
-            if os.path.isdir(item_path):
-                no_compile = os.path.join(item_path, ".no_compile")
-                if os.path.exists(no_compile):
+            if index.is_dir(item_path):
+                if index.has_marker(item_path, ".no_compile"):
+                    yield ("skip", item_path, None, None, False)
                     continue
 
-                folder_title = custom_title or os.path.basename(item_path)
-                if not keep_numbers:
-                    folder_title = remove_leading_number(folder_title)
-                folder_title = substitute_title(folder_title, mod_config) if mod_config else folder_title
-                output.append(f"\n{'#' * (depth + 1)} {folder_title}\n")
-                output.extend(process_folder(item_path, depth + 1, sub_item_order, include_all=(include_all or sub_item_order is None), keep_numbers=keep_numbers, mod_config=mod_config, ignore_frontmatter=ignore_frontmatter))
-            elif item_name.endswith('.md') and os.path.isfile(item_path):
-                output.append(get_content_for_path(item_path, depth, custom_title, keep_numbers=keep_numbers, mod_config=mod_config, ignore_frontmatter=ignore_frontmatter))
+                yield ("folder", item_path, custom_title, sub_item_order, include_all or sub_item_order is None)
+            elif item_name.endswith('.md') and index.is_file(item_path):
+                yield ("file", item_path, custom_title, None, False)
 
     if include_all:
-        all_items = sorted(os.listdir(folder_path))
+        all_items = index.listdir(folder_path)
         for item in all_items:
             if item not in processed_items:
                 item_path = os.path.join(folder_path, item)
-                if os.path.isdir(item_path):
-                    no_compile = os.path.join(item_path, ".no_compile")
-                    if os.path.exists(no_compile):
+                if index.is_dir(item_path):
+                    if index.has_marker(item_path, ".no_compile"):
+                        yield ("skip", item_path, None, None, False)
                         continue
-                    item_title = os.path.basename(item_path)
-                    folder_title = item_title if keep_numbers else remove_leading_number(item_title)
-                    folder_title = substitute_title(folder_title, mod_config) if mod_config else folder_title
-                    output.append(f"\n{'#' * (depth + 1)} {folder_title}\n")
-                    output.extend(process_folder(item_path, depth + 1, None, include_all=include_all, keep_numbers=keep_numbers, mod_config=mod_config, ignore_frontmatter=ignore_frontmatter))
-                elif item.endswith('.md') and os.path.isfile(item_path):
-                    output.append(get_content_for_path(item_path, depth, keep_numbers=keep_numbers, mod_config=mod_config, ignore_frontmatter=ignore_frontmatter))
+                    yield ("folder", item_path, None, None, include_all)
+                elif item.endswith('.md') and index.is_file(item_path):
+                    yield ("file", item_path, None, None, False)
+
+def iter_folder_files(folder_path, item_order=None, include_all=False, index=None):
+    """
+    Yields the paths of the markdown files a folder compiles, in document order, without reading them.
+    """
+    for kind, item_path, _, sub_item_order, sub_include_all in iter_folder_items(folder_path, item_order, include_all, index):
+        if kind == "file":
+            yield item_path
+        elif kind == "folder":
+            yield from iter_folder_files(item_path, compile_order(sub_item_order), sub_include_all, index)
+
+def render_fragment(fragment, depth=1, keep_numbers=False, mod_config=None, skeleton=None, source_map=None):
+    """
+    Yields the rendered text of a folder fragment at the given depth, re-levelling only its headings.
+
+    When a skeleton list is given, the entries are appended to it without their bodies as they
+    are rendered, so the structure of a lazy fragment is still known afterwards. When a SourceMap
+    is given, an entry is opened and closed around every folder and file; the caller passes the
+    rendered parts through its track method.
+    """
+    first = True
+
+    for entry in fragment:
+        if entry[0] == "folder":
+            first = False
+            if source_map is not None:
+                source_map.open("folder", entry[1], depth + 1, title=entry[2])
+
+            yield f"\n{'#' * (depth + 1)} {entry[2]}\n"
+
+            sub_skeleton = None if skeleton is None else []
+            yield from render_fragment(entry[3], depth + 1, keep_numbers, mod_config, sub_skeleton, source_map)
 
-    if len(output) > 0 and output[0].startswith("\n* * *\n\n"):
-        output[0] = output[0][7:]
+            if source_map is not None:
+                source_map.close()
+            if skeleton is not None:
+                skeleton.append(("folder", entry[1], entry[2], tuple(sub_skeleton), entry[4]))
+        elif entry[0] == "file":
+            if source_map is not None:
+                source_map.open("file", entry[1], depth, includes=list(entry[3]), first=first)
+
+            yield from render_file_entry(entry, depth, first, keep_numbers, mod_config)
+            first = False
+
+            if source_map is not None:
+                source_map.close()
+
+            if skeleton is not None:
+                skeleton.append(("file", entry[1], None, entry[3]))
+        elif skeleton is not None:
+            skeleton.append(entry)
+
+def render_file_entry(entry, depth=1, first=False, keep_numbers=False, mod_config=None):
+    """
+    Returns the rendered parts of a ("file", ...) fragment entry at the given depth.
+    """
+    body = entry[2]
+    if not body:
+        return ()
+
+    body = adjust_headings(body, depth, keep_numbers, mod_config)
+    if first and body.startswith("* * *\n\n"):
+        return (body[6:],)
+
+    return ("\n", body)
+
+def process_folder(folder_path, depth=1, item_order=None, include_all=False, keep_numbers=False, mod_config=None, ignore_frontmatter=False, fragment_cache=None, index=None):
+    """
+    Yields the compiled text of a folder piece by piece. Without a fragment_cache, files are read as they are rendered.
+    """
+    lazy = fragment_cache is None
+    fragment_cache = {} if lazy else fragment_cache
+    fragment = build_folder_fragment(folder_path, item_order, include_all=include_all, keep_numbers=keep_numbers, mod_config=mod_config, ignore_frontmatter=ignore_frontmatter, fragment_cache=fragment_cache, lazy=lazy, index=index)
+
+    yield from render_fragment(fragment, depth, keep_numbers, mod_config)
+
+def write_if_changed(output_file, parts, encoding=None):
+    """
+    Streams parts into a temporary file next to output_file and atomically renames it into place.
+
+    Readers never see a partially written file, and output_file is left untouched when it already
+    holds exactly the same content. Returns True if output_file was replaced. encoding defaults to
+    the locale's.
+    """
+    directory, name = os.path.split(output_file)
+    temp_path = os.path.join(directory, f".{name}.{os.getpid()}.{next(temp_counter)}.tmp")
+
+    try:
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        with open(fd, 'w', encoding=encoding) as f:
+            f.writelines(parts)
 
-    return output
+        if os.path.isfile(output_file):
+            if filecmp.cmp(temp_path, output_file, shallow=False):
+                os.remove(temp_path)
+                return False
+            shutil.copymode(output_file, temp_path)
 
-def compile_directory_to_file(root_folder, output, yaml_path=None, include_all=True, keep_numbers=False, output_name=None, mod_path=None, ignore_frontmatter=False):
+        os.replace(temp_path, output_file)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    return True
+
+def get_output_file(root_folder, output, keep_numbers=False, output_name=None):
     root_folder_name = os.path.basename(os.path.normpath(root_folder))
     root_title = root_folder_name if keep_numbers else remove_leading_number(root_folder_name)
     output_file = f"{root_title}.md" if output_name is None or not output_name else output_name
@@ -197,49 +548,268 @@ def compile_directory_to_file(root_folder, output, yaml_path=None, include_all=T
     if os.path.exists(output):
         output_file = os.path.join(output, output_file) if os.path.isdir(output) else output
 
-    frontmatter = ''
-    frontmatter_file_path = os.path.join(os.path.normpath(root_folder), 'frontmatter.yaml')
-    if os.path.exists(frontmatter_file_path):
-        with open(frontmatter_file_path, 'r') as f:
-            frontmatter = f.read().strip()
+    return output_file
+
+def get_manifest_options(yaml_path=None, mod_path=None, include_all=True, keep_numbers=False, ignore_frontmatter=False):
+    return [
+        os.path.abspath(yaml_path) if yaml_path else None,
+        os.path.abspath(mod_path) if mod_path else None,
+        include_all,
+        keep_numbers,
+        ignore_frontmatter,
+    ]
+
+def resolve_document(root_folder, yaml_path=None, include_all=True, keep_numbers=False, mod_path=None, index=None, plan_cache=None):
+    """
+    Returns the title, item order, include_all setting and modification config of root_folder compiled
+    as a document. Only the order and modification files are read, through plan_cache.
+    """
+    index = TreeIndex() if index is None else index
+    plan_cache = PlanCache() if plan_cache is None else plan_cache
+    root_folder_name = os.path.basename(os.path.normpath(root_folder))
+    root_title = root_folder_name if keep_numbers else remove_leading_number(root_folder_name)
 
-    order_config = None
+    order_plan = None
     item_order = None
     include = include_all
 
-    if yaml_path and os.path.exists(yaml_path):
-        with open(yaml_path, 'r') as f:
-            order_config = yaml.safe_load(f)
-
-    if order_config:
-        item_order = order_config.get(root_folder_name)
-        if item_order is None:
-            item_order = order_config.get("root")
-        if item_order is not None:
-            for item in item_order:
-                if "order" in item:
-                    item_order = item["order"]
-                if "title" in item:
-                    root_title = item["title"]
+    if yaml_path and index.exists(yaml_path):
+        order_plan = plan_cache.plan(yaml_path)
+
+    if order_plan is not None and not order_plan.empty:
+        folder_plan = order_plan.folder(root_folder_name)
+        if folder_plan is not None:
+            item_order = folder_plan.order
+            if folder_plan.title is not None:
+                root_title = folder_plan.title
     else:
         include = True
 
     mod_config = None
 
-    if mod_path and os.path.exists(mod_path):
-        with open(mod_path, 'r') as f:
-            mod_config = yaml.safe_load(f)
+    if mod_path and index.exists(mod_path):
+        mod_config = plan_cache.document(mod_path)
 
     if mod_config:
         root_title = substitute_title(root_title, mod_config)
 
-    with open(output_file, 'w') as f:
-        if frontmatter:
-            f.write('---\n')
-            f.write(frontmatter)
-            f.write('\n---\n\n')
-        f.write(f"# {root_title}\n")
-        f.writelines(process_folder(root_folder, item_order=item_order if order_config else None, include_all=include, keep_numbers=keep_numbers, mod_config=mod_config, ignore_frontmatter=ignore_frontmatter))
+    return root_title, item_order, include, mod_config
+
+def build_document(root_folder, yaml_path=None, include_all=True, keep_numbers=False, mod_path=None, ignore_frontmatter=False, fragment_cache=None, index=None, plan_cache=None, include_cache=None, fragment_store=None):
+    """
+    Returns the header, folder fragment, fragment key and modification config of root_folder compiled as a document.
+
+    The order and modification files are parsed through plan_cache, a PlanCache that can be shared between
+    calls. Without a fragment_cache the fragment is lazy, see build_folder_fragment.
+    """
+    index = TreeIndex() if index is None else index
+    root_title, item_order, include, mod_config = resolve_document(root_folder, yaml_path, include_all, keep_numbers, mod_path, index, plan_cache)
+
+    frontmatter_file_path = os.path.join(os.path.normpath(root_folder), 'frontmatter.yaml')
+    frontmatter = ''
+    if index.exists(frontmatter_file_path):
+        with open(frontmatter_file_path, 'r') as f:
+            frontmatter = f.read().strip()
+
+    lazy = fragment_cache is None
+    fragment_cache = {} if lazy else fragment_cache
+
+    if index.prefetcher is not None:
+        sources = fragment_cache if include_cache is None else include_cache
+        index.prefetcher.schedule(path for path in iter_folder_files(root_folder, item_order, include, index) if ("source", path) not in sources)
+
+    fragment = build_folder_fragment(root_folder, item_order, include_all=include, keep_numbers=keep_numbers, mod_config=mod_config, ignore_frontmatter=ignore_frontmatter, fragment_cache=fragment_cache, lazy=lazy, index=index, include_cache=include_cache, fragment_store=fragment_store)
+
+    header = f"---\n{frontmatter}\n---\n\n# {root_title}\n" if frontmatter else f"# {root_title}\n"
+
+    return header, fragment, fragment_key(root_folder, item_order, include), mod_config
+
+def iter_document(root_folder, yaml_path=None, include_all=True, keep_numbers=False, mod_path=None, ignore_frontmatter=False, fragment_cache=None, index=None, plan_cache=None, skeleton=None):
+    """
+    Yields the compiled text of root_folder as a document piece by piece, as compile_directory_to_file writes it.
+    """
+    header, fragment, _, mod_config = build_document(root_folder, yaml_path, include_all, keep_numbers, mod_path, ignore_frontmatter, fragment_cache, index, plan_cache)
+
+    yield header
+    yield from render_fragment(fragment, keep_numbers=keep_numbers, mod_config=mod_config, skeleton=skeleton)
+
+def compile_directory_to_file(root_folder, output, yaml_path=None, include_all=True, keep_numbers=False, output_name=None, mod_path=None, ignore_frontmatter=False, fragment_cache=None, manifest=None, index=None, plan_cache=None, include_cache=None, fragment_store=None, source_map=False, splice=False):
+    """
+    Compiles root_folder into a single markdown file. Returns True if the output file was written.
+
+    With source_map, a SourceMap of the output is saved next to it. With splice, an output that has a
+    valid source map only gets the files the manifest reports as changed rendered again and spliced
+    in, see splice_directory_to_file, unless a change may alter its structure.
+    """
+    output_file = get_output_file(root_folder, output, keep_numbers, output_name)
+    source_map_path = get_source_map_path(output_file)
+
+    frontmatter_file_path = os.path.join(os.path.normpath(root_folder), 'frontmatter.yaml')
+    manifest_options = get_manifest_options(yaml_path, mod_path, include_all, keep_numbers, ignore_frontmatter)
+    manifest_inputs = [path for path in (frontmatter_file_path, yaml_path, mod_path) if path]
+
+    if manifest is not None and manifest.is_fresh(output_file, manifest_options) and (not source_map or os.path.exists(source_map_path)):
+        return False
+
+    changed_paths = manifest.changed_inputs(output_file) if source_map and splice and manifest is not None else None
+    if changed_paths:
+        spliced = splice_directory_to_file(root_folder, output_file, changed_paths, yaml_path, include_all, keep_numbers, mod_path, ignore_frontmatter, manifest, index, plan_cache, include_cache)
+        if spliced is not None:
+            return spliced
+
+    header, fragment, key, mod_config = build_document(root_folder, yaml_path, include_all, keep_numbers, mod_path, ignore_frontmatter, fragment_cache, index, plan_cache, include_cache, fragment_store)
+
+    skeleton = []
+    mapping = SourceMap() if source_map else None
+    parts = render_fragment(fragment, keep_numbers=keep_numbers, mod_config=mod_config, skeleton=skeleton, source_map=mapping)
+
+    if mapping is not None:
+        mapping.add("header", os.path.abspath(root_folder), 1, header)
+        parts = mapping.track(parts)
+
+    # Source maps count offsets in UTF-8 bytes, which only match an output written in UTF-8.
+    written = write_if_changed(output_file, itertools.chain([header], parts), encoding='utf-8' if source_map or splice else None)
+
+    if mapping is not None:
+        mapping.save(source_map_path, root_folder, manifest_options, stat_signature(output_file))
+    elif written and os.path.exists(source_map_path):
+        os.remove(source_map_path)
+
+    if manifest is not None:
+        manifest.record_output(output_file, manifest_options, manifest_inputs, key, root_folder, tuple(skeleton))
+
+    return written
+
+def find_custom_title(root_folder, item_path, item_order):
+    """
+    Returns the custom title the order of root_folder gives the file at item_path, or None.
+    """
+    order = item_order
+    names = os.path.relpath(item_path, root_folder).split(os.sep)
+
+    for i, name in enumerate(names):
+        entry = next((entry for entry in order or () if entry.name == name), None)
+        if entry is None:
+            return None
+        if i == len(names) - 1:
+            return entry.title
+        order = compile_order(entry.order)
+
+    return None
+
+def find_splice_entries(root_folder, source_map, changed_paths, yaml_path=None, mod_path=None):
+    """
+    Returns the indices of the source map file entries to render again for changed_paths, or None
+    if a change may alter the structure of the output: its order, titles, markers or set of files.
+    """
+    root_folder = os.path.abspath(root_folder)
+    root_prefix = root_folder.rstrip(os.sep) + os.sep
+    document_files = {os.path.abspath(path) for path in (yaml_path, mod_path, os.path.join(root_folder, "order.yaml"), os.path.join(root_folder, "frontmatter.yaml")) if path}
+
+    files = [entry["path"] for entry in source_map.entries if entry["kind"] == "file"]
+    folders = {entry["path"] for entry in source_map.entries if entry["kind"] != "file"}
+    mapped = set(files).union(*(entry["includes"] for entry in source_map.entries if entry["kind"] == "file"))
+
+    # A file listed twice may have a different custom title each time.
+    if len(files) != len(set(files)):
+        return None
+
+    for path in changed_paths:
+        if path in mapped:
+            if not os.path.isfile(path):
+                return None
+        elif path in document_files or path in folders:
+            return None
+        elif path.startswith(root_prefix) and (path.endswith('.md') or os.path.basename(path) in MARKER_FILES or os.path.isdir(path)):
+            return None
+
+    return source_map.affected(changed_paths)
+
+def copy_range(source, target, length):
+    while length > 0:
+        chunk = source.read(min(length, 1 << 20))
+        if not chunk:
+            break
+        target.write(chunk)
+        length -= len(chunk)
+
+def splice_directory_to_file(root_folder, output_file, changed_paths, yaml_path=None, include_all=True, keep_numbers=False, mod_path=None, ignore_frontmatter=False, manifest=None, index=None, plan_cache=None, include_cache=None):
+    """
+    Renders the files of output_file affected by changed_paths again and splices them into it in place of their old text.
+
+    The rest of the output is copied from the existing file without reading any other source, and
+    the source map and manifest are updated to match. Returns True if the output was written, False
+    if the new text is the same, or None if it cannot be spliced and has to be compiled: there is no
+    valid source map, none of its files changed, or a change may alter the structure, see
+    find_splice_entries. changed_paths has to hold every path that changed since the output was written.
+    """
+    index = TreeIndex() if index is None else index
+    source_map_path = get_source_map_path(output_file)
+    manifest_options = get_manifest_options(yaml_path, mod_path, include_all, keep_numbers, ignore_frontmatter)
+
+    source_map = SourceMap.load(source_map_path, root_folder, manifest_options, stat_signature(output_file))
+    if source_map is None:
+        return None
+
+    affected = find_splice_entries(root_folder, source_map, changed_paths, yaml_path, mod_path)
+    if not affected:
+        return None
+
+    _, item_order, _, mod_config = resolve_document(root_folder, yaml_path, include_all, keep_numbers, mod_path, index, plan_cache)
+    include_cache = {} if include_cache is None else include_cache
+
+    replacements = []
+    spliced_files = {}
+    for i in affected:
+        entry = source_map.entries[i]
+        included_paths = []
+        custom_title = find_custom_title(root_folder, entry["path"], item_order)
+        body = get_body_for_path(entry["path"], custom_title, keep_numbers, mod_config, ignore_frontmatter, included_paths, include_cache, index)
+        text = "".join(render_file_entry(("file", entry["path"], body, tuple(included_paths)), entry["depth"], entry["first"], keep_numbers, mod_config))
+
+        replacements.append((i, text.encode('utf-8'), text.count('\n'), included_paths))
+        spliced_files[entry["path"]] = included_paths
+
+    with open(output_file, 'rb') as f:
+        unchanged = True
+        for i, data, _, _ in replacements:
+            start, end = source_map.entries[i]["bytes"]
+            f.seek(start)
+            unchanged = unchanged and f.read(end - start) == data
+
+    if not unchanged:
+        directory, name = os.path.split(output_file)
+        temp_path = os.path.join(directory, f".{name}.{os.getpid()}.{next(temp_counter)}.tmp")
+
+        try:
+            with open(output_file, 'rb') as source, open(temp_path, 'wb') as target:
+                position = 0
+                for i, data, _, _ in replacements:
+                    start, end = source_map.entries[i]["bytes"]
+                    copy_range(source, target, start - position)
+                    target.write(data)
+                    source.seek(end)
+                    position = end
+                shutil.copyfileobj(source, target)
+
+            shutil.copymode(output_file, temp_path)
+            os.replace(temp_path, output_file)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    # Resized back to front, so the ranges of the entries still to resize stay those of the old output.
+    for i, data, line_count, included_paths in reversed(replacements):
+        source_map.entries[i]["includes"] = included_paths
+        source_map.resize(i, len(data), line_count)
+
+    source_map.save(source_map_path, root_folder, manifest_options, stat_signature(output_file))
+
+    if manifest is not None:
+        manifest.record_splice(output_file, spliced_files)
+
+    return not unchanged
 
 def delete_dirs(
     source,
@@ -264,7 +834,7 @@ def delete_dirs(
 
     shutil.rmtree(output_target_dir)
 
-def compile_all(
+def collect_compile_tasks(
     source,
     output,
     recursive=False,
@@ -274,22 +844,42 @@ def compile_all(
     propagate=False,
     target="",
     mod_path=None,
-    ignore_frontmatter=False
+    ignore_frontmatter=False,
+    tasks=None,
+    index=None,
+    planned_dirs=None
 ):
+    """
+    Returns the compile_directory_to_file arguments for every output compile_all would produce, in order.
+
+    Output directories are created along the way, since later output paths depend on them existing.
+    When a planned_dirs set is given, they are only added to it instead, and treated as existing.
+    The source tree is looked up in index, which forgets the listings around every created directory.
+    """
+    tasks = [] if tasks is None else tasks
+    index = TreeIndex() if index is None else index
     source_target_dir = os.path.normpath(os.path.join(source, target))
 
-    if not os.path.exists(source_target_dir):
-        return
+    if not index.exists(source_target_dir):
+        return tasks
+
+    def is_planned(path):
+        return planned_dirs is not None and os.path.abspath(path) in planned_dirs
 
     output_name = None
 
-    if not os.path.isdir(output):
+    if not os.path.isdir(output) and not is_planned(output):
         output_name = os.path.basename(output) if os.path.basename(output) else output_name
         output = os.path.dirname(output)
 
     output_target_dir = os.path.join(output, target)
 
-    if not os.path.exists(output_target_dir) or not os.path.samefile(output, output_target_dir):
+    if os.path.exists(output_target_dir) and os.path.exists(output):
+        same_dir = os.path.samefile(output, output_target_dir)
+    else:
+        same_dir = is_planned(output_target_dir) and os.path.abspath(output) == os.path.abspath(output_target_dir)
+
+    if not same_dir:
         output_target_dir = os.path.dirname(output_target_dir)
 
     source_target_dir = os.path.abspath(source_target_dir)
@@ -297,9 +887,8 @@ def compile_all(
     source_path = os.path.abspath(source)
     output_path = os.path.abspath(output)
 
-    no_compile = os.path.join(source_target_dir, ".no_compile")
-    if os.path.exists(no_compile):
-        return
+    if index.has_marker(source_target_dir, ".no_compile"):
+        return tasks
 
     if source_path not in os.path.commonpath([source_path, source_target_dir]):
         source_target_dir = source_path
@@ -307,30 +896,37 @@ def compile_all(
     if output_path not in os.path.commonpath([output_path, output_target_dir]):
         output_target_dir = output_path
 
-    os.makedirs(output_target_dir, exist_ok=True)
+    if planned_dirs is not None:
+        directory = output_target_dir
+        while not os.path.isdir(directory) and directory not in planned_dirs:
+            planned_dirs.add(directory)
+            directory = os.path.dirname(directory)
+    elif not os.path.isdir(output_target_dir):
+        os.makedirs(output_target_dir, exist_ok=True)
+        index.invalidate(output_target_dir)
 
     order_file = yaml_path
     if yaml_path is None:
         order_file = os.path.join(source_target_dir, "order.yaml")
-        order_file = order_file if os.path.exists(order_file) else None
+        order_file = order_file if index.exists(order_file) else None
 
-    mod_file = mod_path if mod_path and os.path.exists(mod_path) else None
+    mod_file = mod_path if mod_path and index.exists(mod_path) else None
 
-    compile_directory_to_file(
-        source_target_dir,
-        output_target_dir,
-        yaml_path=order_file,
-        include_all=include_all,
-        keep_numbers=keep_numbers,
-        output_name=output_name,
-        mod_path=mod_file,
-        ignore_frontmatter=ignore_frontmatter
-    )
+    tasks.append({
+        "root_folder": source_target_dir,
+        "output": output_target_dir,
+        "yaml_path": order_file,
+        "include_all": include_all,
+        "keep_numbers": keep_numbers,
+        "output_name": output_name,
+        "mod_path": mod_file,
+        "ignore_frontmatter": ignore_frontmatter,
+    })
 
     if propagate:
         if source_target_dir != source_path:
             new_target = os.path.dirname(source_target_dir)
-            compile_all(
+            collect_compile_tasks(
                 source,
                 output,
                 recursive=False,
@@ -340,24 +936,25 @@ def compile_all(
                 propagate=propagate,
                 target=new_target,
                 mod_path=mod_file,
-                ignore_frontmatter=ignore_frontmatter
+                ignore_frontmatter=ignore_frontmatter,
+                tasks=tasks,
+                index=index,
+                planned_dirs=planned_dirs
             )
 
-        return
+        return tasks
 
     if recursive:
-        for item in os.listdir(source_target_dir):
+        for item in index.listdir(source_target_dir):
             item_path = os.path.join(source_target_dir, item)
-            if os.path.isdir(item_path):
-                no_compile = os.path.join(item_path, ".no_compile")
-                if os.path.exists(no_compile):
+            if index.is_dir(item_path):
+                if index.has_marker(item_path, ".no_compile"):
                     continue
 
-                end_compile = os.path.join(os.path.dirname(item_path), ".end_compile")
-                should_continue = not os.path.exists(end_compile)
+                should_continue = not index.has_marker(source_target_dir, ".end_compile")
 
                 item_rel_path = os.path.relpath(item_path, source_path)
-                compile_all(
+                collect_compile_tasks(
                     source,
                     output,
                     recursive=should_continue,
@@ -366,25 +963,460 @@ def compile_all(
                     propagate=propagate,
                     target=item_rel_path,
                     mod_path=mod_file,
-                    ignore_frontmatter=ignore_frontmatter
+                    ignore_frontmatter=ignore_frontmatter,
+                    tasks=tasks,
+                    index=index,
+                    planned_dirs=planned_dirs
                 )
 
-def main():
-    parser = argparse.ArgumentParser(description="Combine Markdown files from a folder hierarchy.")
+    return tasks
+
+def run_compile_task(task, fragment_cache=None, manifest=None, index=None, plan_cache=None, include_cache=None, fragment_store=None, source_map=False, splice=False):
+    return compile_directory_to_file(**task, fragment_cache=fragment_cache, manifest=manifest, index=index, plan_cache=plan_cache, include_cache=include_cache, fragment_store=fragment_store, source_map=source_map, splice=splice)
+
+def is_task_fresh(task, manifest, source_map=False):
+    output_file = get_output_file(task["root_folder"], task["output"], task["keep_numbers"], task["output_name"])
+    options = get_manifest_options(task["yaml_path"], task["mod_path"], task["include_all"], task["keep_numbers"], task["ignore_frontmatter"])
+
+    return manifest.is_fresh(output_file, options) and (not source_map or os.path.exists(get_source_map_path(output_file)))
+
+worker_state = {}
+
+def init_compile_worker(manifest_path, force, plan_cache_path, prefetch=None, fragment_store=None):
+    worker_state["fragment_cache"] = {}
+    worker_state["index"] = TreeIndex(create_prefetcher(*prefetch) if prefetch else None)
+    worker_state["plan_cache"] = PlanCache(plan_cache_path)
+    worker_state["manifest"] = BuildManifest(manifest_path, force=force) if manifest_path else None
+    worker_state["fragment_store"] = FragmentStore(*fragment_store) if fragment_store else None
+
+def run_compile_task_in_worker(task, source_map=False, splice=False):
+    manifest = worker_state["manifest"]
+    fragment_store = worker_state["fragment_store"]
+    written = run_compile_task(task, worker_state["fragment_cache"], manifest, worker_state["index"], worker_state["plan_cache"], fragment_store=fragment_store, source_map=source_map, splice=splice)
+
+    return written, manifest.export_records() if manifest is not None else None, fragment_store.export_records() if fragment_store is not None else None
+
+def run_compile_tasks(tasks, jobs=1, fragment_cache=None, manifest=None, index=None, plan_cache=None, include_cache=None, fragment_store=None, source_map=False, splice=False):
+    """
+    Compiles the given tasks in order, or across a pool of jobs worker processes.
+
+    Workers load the manifest from disk and send back what they recorded, so the manifest
+    passed in must match its saved state. Every task runs even if another one fails; the
+    error of the first failing task in task order is then raised. Each worker builds its own
+    TreeIndex, so index is only used when compiling in this process, but gets a prefetcher like
+    the one of index. Workers read the order and modification files from the cache file of
+    plan_cache, which is filled and saved beforehand. Workers open fragment_store from its directory
+    and send back the objects they used and added, like the manifest records.
+    """
+    if jobs <= 1 or len(tasks) <= 1:
+        if fragment_cache is None and len(tasks) > 1:
+            fragment_cache = {}
+
+        errors = []
+        for task in tasks:
+            try:
+                run_compile_task(task, fragment_cache, manifest, index, plan_cache, include_cache, fragment_store, source_map, splice)
+            except Exception as e:
+                errors.append(e)
+
+        if errors:
+            raise errors[0]
+        return
+
+    if manifest is not None:
+        tasks = [task for task in tasks if not is_task_fresh(task, manifest, source_map)]
+        if not tasks:
+            return
+
+    plan_cache_path = None
+    if plan_cache is not None and plan_cache.path is not None:
+        for task in tasks:
+            for path in (task["yaml_path"], task["mod_path"]):
+                try:
+                    if path:
+                        plan_cache.document(path)
+                except (OSError, ValueError, yaml.YAMLError):
+                    # The worker compiling this task reports the error.
+                    pass
+        plan_cache.save()
+        plan_cache_path = plan_cache.path
+
+    prefetch = None
+    if index is not None and index.prefetcher is not None:
+        prefetch = (index.prefetcher.workers, index.prefetcher.max_bytes)
+
+    store = (fragment_store.path, fragment_store.max_bytes) if fragment_store is not None else None
+
+    initargs = (manifest.path, manifest.force, plan_cache_path, prefetch, store) if manifest is not None else (None, False, plan_cache_path, prefetch, store)
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_compile_worker, initargs=initargs) as executor:
+        futures = [executor.submit(run_compile_task_in_worker, task, source_map, splice) for task in tasks]
+
+    errors = []
+    for future in futures:
+        error = future.exception()
+        if error is not None:
+            errors.append(error)
+            continue
+
+        _, records, store_records = future.result()
+        if manifest is not None:
+            manifest.merge_records(records)
+        if fragment_store is not None:
+            fragment_store.merge_records(store_records)
+
+    if errors:
+        raise errors[0]
+
+def collect_target_tasks(
+    source,
+    output,
+    targets,
+    recursive=False,
+    yaml_path=None,
+    include_all=True,
+    keep_numbers=True,
+    propagate=False,
+    mod_path=None,
+    ignore_frontmatter=False,
+    index=None,
+    planned_dirs=None
+):
+    """
+    Returns the tasks of collect_compile_tasks for every target, in compile order.
+
+    With several targets, every output is compiled once even if several targets lead to it, so
+    ancestors shared by propagated targets are not rebuilt for each of them. Propagated outputs
+    are compiled deepest first, so ancestors reuse the fragments of their freshly compiled descendants.
+    """
+    index = TreeIndex() if index is None else index
+
+    tasks = []
+    collected = set()
+    for target in targets:
+        for task in collect_compile_tasks(
+            source,
+            output,
+            recursive=recursive,
+            yaml_path=yaml_path,
+            include_all=include_all,
+            keep_numbers=keep_numbers,
+            propagate=propagate,
+            target=target,
+            mod_path=mod_path,
+            ignore_frontmatter=ignore_frontmatter,
+            index=index,
+            planned_dirs=planned_dirs
+        ):
+            task_key = tuple(task.items())
+            if task_key not in collected:
+                collected.add(task_key)
+                tasks.append(task)
+
+    if propagate:
+        tasks.sort(key=lambda task: task["root_folder"].count(os.sep), reverse=True)
+
+    return tasks
+
+def compile_all(
+    source,
+    output,
+    recursive=False,
+    yaml_path=None,
+    include_all=True,
+    keep_numbers=True,
+    propagate=False,
+    target="",
+    mod_path=None,
+    ignore_frontmatter=False,
+    fragment_cache=None,
+    manifest=None,
+    jobs=1,
+    index=None,
+    plan_cache=None,
+    include_cache=None,
+    fragment_store=None,
+    targets=None,
+    source_map=False,
+    splice=False,
+    changes=None
+):
+    """
+    Compiles target, or every directory in targets, into output. See compile_directory_to_file for source_map and splice.
+
+    changes are the changed paths from git_changes.get_build_changes. With them and a manifest, only the
+    outputs that depend on a changed path or are not in the manifest yet are compiled.
+    """
+    index = TreeIndex() if index is None else index
+    plan_cache = PlanCache() if plan_cache is None else plan_cache
+    targets = [target] if targets is None else targets
+
+    tasks = collect_target_tasks(
+        source,
+        output,
+        targets,
+        recursive=recursive,
+        yaml_path=yaml_path,
+        include_all=include_all,
+        keep_numbers=keep_numbers,
+        propagate=propagate,
+        mod_path=mod_path,
+        ignore_frontmatter=ignore_frontmatter,
+        index=index
+    )
+
+    if changes is not None and manifest is not None and not manifest.force:
+        from markdown_utils.git_changes import select_changed_tasks
+        tasks = select_changed_tasks(tasks, manifest, changes)
+
+    run_compile_tasks(tasks, jobs=jobs, fragment_cache=fragment_cache, manifest=manifest, index=index, plan_cache=plan_cache, include_cache=include_cache, fragment_store=fragment_store, source_map=source_map, splice=splice)
+
+def plan_task(task, index=None, plan_cache=None):
+    """
+    Returns the plan of one compile task: its output file and title, and the folders and files it
+    compiles in document order with the heading level each one's title gets. No source file is read.
+    """
+    index = TreeIndex() if index is None else index
+    root_folder = task["root_folder"]
+    keep_numbers = task["keep_numbers"]
+
+    root_title, item_order, include, mod_config = resolve_document(root_folder, task["yaml_path"], task["include_all"], keep_numbers, task["mod_path"], index, plan_cache)
+
+    root_folder_name = os.path.basename(os.path.normpath(root_folder))
+    output_name = task["output_name"] or f"{root_folder_name if keep_numbers else remove_leading_number(root_folder_name)}.md"
+
+    entries = []
+
+    def add_items(folder_path, folder_order, folder_include_all, depth):
+        for kind, item_path, custom_title, sub_item_order, sub_include_all in iter_folder_items(folder_path, folder_order, folder_include_all, index):
+            if kind == "file":
+                entries.append({"kind": "file", "path": item_path, "title": custom_title, "level": depth + 1})
+            elif kind == "folder":
+                entries.append({"kind": "folder", "path": item_path, "title": get_folder_title(item_path, custom_title, keep_numbers, mod_config), "level": depth + 1})
+                add_items(item_path, compile_order(sub_item_order), sub_include_all, depth + 1)
+
+    add_items(root_folder, item_order, include, 1)
+
+    return {
+        "output": os.path.join(task["output"], output_name),
+        "folder": root_folder,
+        "title": root_title,
+        "order_file": task["yaml_path"],
+        "mod_file": task["mod_path"],
+        "entries": entries,
+    }
+
+def plan_outputs(source, output, targets, variants=None, **compile_options):
+    """
+    Returns the plan_task plans of everything compile_all, or compile_variants with variants, would write.
+
+    Only directory listings and the order and modification files are read, and nothing is written.
+    """
+    index = TreeIndex()
+    plan_cache = PlanCache()
+    runs = [(output, compile_options)]
+
+    if variants:
+        runs = []
+        for variant in variants:
+            options = dict(compile_options)
+            options.update(variant)
+            options.pop("name", None)
+            options.pop("output", None)
+            runs.append((get_variant_output(output, variant), options))
+
+    plans = []
+    planned_dirs = set()
+    for run_output, options in runs:
+        if variants and not os.path.isdir(run_output):
+            planned_dirs.add(os.path.abspath(run_output))
+
+        for task in collect_target_tasks(source, run_output, targets, **options, index=index, planned_dirs=planned_dirs):
+            plans.append(plan_task(task, index, plan_cache))
+
+    return plans
+
+def format_plan(plans, source):
+    """
+    Returns compile plans as indented text, with source paths relative to source.
+    """
+    lines = []
+    for plan in plans:
+        inputs = ", ".join(f"{name}: {path}" for name, path in (("order", plan["order_file"]), ("mod", plan["mod_file"])) if path)
+        lines.append(f"{plan['output']} <- {plan['folder']}" + (f" ({inputs})" if inputs else ""))
+        lines.append(f"  # {plan['title']}")
+
+        for entry in plan["entries"]:
+            indent = "  " * entry["level"]
+            if entry["kind"] == "folder":
+                lines.append(f"{indent}{'#' * entry['level']} {entry['title']}")
+            else:
+                title = f" as \"{entry['title']}\"" if entry["title"] else ""
+                lines.append(f"{indent}{os.path.relpath(entry['path'], source)}{title} (level {entry['level']})")
+
+    return "\n".join(lines)
+
+VARIANT_OPTIONS = {
+    "name": str,
+    "output": str,
+    "keep_numbers": bool,
+    "ignore_frontmatter": bool,
+    "mod_path": str,
+}
+
+def parse_variant(variant):
+    """
+    Returns a variant as a dict of compile_all options, from a compile.yaml mapping or a --variant
+    string such as "name=print,keep_numbers=true,mod=print.yaml". modification_path and mod are
+    accepted for mod_path, like in compile.yaml and on the command line.
+    """
+    if isinstance(variant, str):
+        pairs = [item.split("=", 1) for item in variant.split(",") if item.strip()]
+        if any(len(pair) != 2 for pair in pairs):
+            raise ValueError(f"Invalid variant '{variant}': expected comma-separated key=value pairs")
+        variant = {key.strip(): value.strip() for key, value in pairs}
+
+    if not isinstance(variant, dict):
+        raise ValueError(f"Invalid variant {variant!r}: expected a mapping of options")
+
+    options = {}
+    for key, value in variant.items():
+        key = {"modification_path": "mod_path", "mod": "mod_path"}.get(key, key)
+        if key not in VARIANT_OPTIONS:
+            raise ValueError(f"Unknown variant option '{key}', expected one of {', '.join(VARIANT_OPTIONS)}")
+        if VARIANT_OPTIONS[key] is bool and isinstance(value, str):
+            value = value.lower() in ("1", "true", "yes", "on")
+        options[key] = value
+
+    if "output" not in options and "name" not in options:
+        raise ValueError(f"Variant {variant!r} needs a name or an output")
+
+    return options
+
+def get_changed_targets(source, paths):
+    """
+    Returns the targets, relative to source, of the directories that contain the given changed paths.
+
+    Relative paths are taken relative to source. A path that no longer exists maps to its closest
+    existing parent, and paths outside source are ignored.
+    """
+    source_path = os.path.abspath(source)
+    targets = []
+
+    for path in paths:
+        path = os.path.normpath(os.path.join(source_path, path))
+        directory = path if os.path.isdir(path) else os.path.dirname(path)
+        while not os.path.isdir(directory) and os.path.dirname(directory) != directory:
+            directory = os.path.dirname(directory)
+
+        if directory != source_path and not directory.startswith(source_path.rstrip(os.sep) + os.sep):
+            continue
+
+        target = os.path.relpath(directory, source_path)
+        if target not in targets:
+            targets.append(target)
+
+    return targets
+
+def read_changed_paths(changed_file):
+    """
+    Returns the paths listed in changed_file, one per line, or on standard input if it is "-".
+    """
+    if changed_file == "-":
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(changed_file, 'r', encoding='utf-8') as f:
+            lines = f.read().splitlines()
+
+    return [line.strip() for line in lines if line.strip()]
+
+def get_variant_output(output, variant):
+    return variant.get("output") or os.path.join(output, variant["name"])
+
+def compile_variants(source, output, variants, manifests=None, index=None, plan_cache=None, fragment_store=None, **compile_options):
+    """
+    Compiles source once per variant, each a dict from parse_variant overriding compile_options.
+
+    A variant without an output is written to a directory named after it inside output. manifests
+    maps variant outputs to their BuildManifest. Every source file is read and include-expanded
+    once for all variants; only titles, metadata and heading levels are rendered per variant.
+    """
+    include_cache = {}
+    index = TreeIndex() if index is None else index
+    plan_cache = PlanCache() if plan_cache is None else plan_cache
+
+    for variant in variants:
+        variant_output = get_variant_output(output, variant)
+        options = dict(compile_options)
+        options.update(variant)
+        options.pop("name", None)
+        options.pop("output", None)
+
+        os.makedirs(variant_output, exist_ok=True)
+        index.invalidate(variant_output)
+
+        compile_all(
+            source,
+            variant_output,
+            **options,
+            fragment_cache={},
+            manifest=manifests.get(variant_output) if manifests else None,
+            index=index,
+            plan_cache=plan_cache,
+            include_cache=include_cache,
+            fragment_store=fragment_store
+        )
+
+def main(argv=None, warm=None):
+    """
+    Runs compile-markdown with the command line arguments argv (default: sys.argv[1:]). warm is the
+    daemon.WarmState of a compile daemon, whose caches are used instead of fresh ones.
+    """
+    argv = sys.argv[1:] if argv is None else argv
+
+    if argv[:1] == ["serve"]:
+        from markdown_utils.serve import main as serve_main
+        serve_main(argv[1:])
+        return
+
+    if argv[:1] == ["check"]:
+        from markdown_utils.check import main as check_main
+        check_main(argv[1:])
+        return
+
+    if argv[:1] == ["daemon"]:
+        from markdown_utils.daemon import main as daemon_main
+        daemon_main(argv[1:])
+        return
+
+    parser = argparse.ArgumentParser(prog="compile-markdown", description="Combine Markdown files from a folder hierarchy.", epilog="Run 'compile-markdown serve --help' for the preview server, 'compile-markdown check --help' for the source tree checks and 'compile-markdown daemon --help' for the compile daemon.")
     parser.add_argument("-a", "--all", action="store_true", default=None, help="Include all markdown files, even those not in the YAML file")
     parser.add_argument("-c", "--config", help="Path to the YAML config file (default: compile.yaml in source directory)")
+    parser.add_argument("--changed", help="Compile the directories containing the paths listed in this file, one per line relative to the source directory ('-' for standard input)")
     parser.add_argument("-d", "--delete", action="store_true", default=None, help="Delete existing output directory before compiling")
+    parser.add_argument("-f", "--force", action="store_true", default=None, help="Recompile every output, even if its inputs are unchanged")
+    parser.add_argument("--fragment-cache-size", type=int, help="Keep up to this many megabytes of processed files between runs (default: 0, disabled)")
+    parser.add_argument("--git", nargs="?", const="HEAD", metavar="RANGE", help="Only compile the outputs affected by the files changed in git, between the commits of RANGE (e.g. 'main...HEAD') or from a revision to the working tree (default: HEAD, i.e. uncommitted and untracked changes)")
     parser.add_argument("-i", "--ignore-frontmatter", action="store_true", default=None, help="Do not add YAML frontmatter")
+    parser.add_argument("-j", "--jobs", type=int, help="Number of worker processes used to compile outputs (default: 1)")
     parser.add_argument("-k", "--keep-numbers", action="store_true", default=None, help="Keep leading numbers in titles")
     parser.add_argument("-m", "--mod", help="Path to the YAML modification file")
     parser.add_argument("-o", "--output", help="Output directory name (default: ./compiled in source directory)")
+    parser.add_argument("--plan", nargs="?", const="text", choices=["text", "json"], help="Print the outputs and the files feeding each one, as text or json, without compiling")
     parser.add_argument("-p", "--propagate", action="store_true", default=None, help="Propagate up to parent directories")
     parser.add_argument("-r", "--recursive", action="store_true", default=None, help="Compile files recursively")
     parser.add_argument("-s", "--source", help="Path to the source directory (default: current working directory)")
-    parser.add_argument("-t", "--target", help="Path to the target directory relative to source directory (default: './')")
+    parser.add_argument("--source-map", action="store_true", default=None, help="Write a source map next to every output, mapping its byte and line ranges to source files")
+    parser.add_argument("--splice", action="store_true", default=None, help="Splice changed files into outputs that have a source map instead of recompiling them (implies --source-map)")
+    parser.add_argument("-w", "--watch", action="store_true", default=None, help="Keep running and recompile the outputs affected by each change")
+    parser.add_argument("--poll", action="store_true", default=None, help="Poll for changes in watch mode instead of using inotify")
+    parser.add_argument("--prefetch", type=int, help="Read up to N source files ahead of the compile on a thread pool (default: off)")
+    parser.add_argument("--prefetch-memory", type=int, help="Maximum megabytes of file content read ahead and not yet compiled (default: 64)")
+    parser.add_argument("--profile", help="Write a per-file and per-stage profile of the compile to this JSON file, plus a Chrome trace next to it")
+    parser.add_argument("-t", "--target", action="append", help="Path to the target directory relative to source directory (default: './', repeatable)")
+    parser.add_argument("--variant", action="append", help="Also compile a variant, e.g. 'name=print,keep_numbers=true,mod=print.yaml' (repeatable)")
     parser.add_argument("-y", "--yaml", help="Path to the YAML order file (default: order.yaml in directory to compile)")
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     include_all = args.all
     keep_numbers = args.keep_numbers
@@ -394,8 +1426,22 @@ def main():
     yaml_path = args.yaml
     propagate = args.propagate
     target = args.target
+    changed = args.changed
+    git = args.git
+    plan = args.plan
     mod_path = args.mod
     delete = args.delete
+    force = args.force
+    watch_mode = args.watch
+    jobs = args.jobs
+    poll = args.poll
+    profile = args.profile
+    prefetch = args.prefetch
+    prefetch_memory = args.prefetch_memory
+    fragment_cache_size = args.fragment_cache_size
+    source_map = args.source_map
+    splice = args.splice
+    variants = args.variant
     ignore_frontmatter = args.ignore_frontmatter
 
     config_path = args.config or "compile.yaml"
@@ -427,6 +1473,30 @@ def main():
             ignore_frontmatter = ignore_frontmatter if ignore_frontmatter else config.get("ignore_frontmatter")
         if "delete" in config:
             delete = delete if delete else config.get("delete")
+        if "force" in config:
+            force = force if force else config.get("force")
+        if "jobs" in config:
+            jobs = jobs if jobs else config.get("jobs")
+        if "watch" in config:
+            watch_mode = watch_mode if watch_mode else config.get("watch")
+        if "poll" in config:
+            poll = poll if poll else config.get("poll")
+        if "profile" in config:
+            profile = profile if profile else config.get("profile")
+        if "prefetch" in config:
+            prefetch = prefetch if prefetch else config.get("prefetch")
+        if "prefetch_memory" in config:
+            prefetch_memory = prefetch_memory if prefetch_memory else config.get("prefetch_memory")
+        if "fragment_cache_size" in config:
+            fragment_cache_size = fragment_cache_size if fragment_cache_size is not None else config.get("fragment_cache_size")
+        if "source_map" in config:
+            source_map = source_map if source_map else config.get("source_map")
+        if "splice" in config:
+            splice = splice if splice else config.get("splice")
+        if "git" in config:
+            git = git if git else config.get("git")
+        if "variants" in config:
+            variants = variants if variants else config.get("variants")
 
     include_all = True if include_all is None else include_all
     keep_numbers = False if keep_numbers is None else keep_numbers
@@ -434,26 +1504,150 @@ def main():
     recursive = False if recursive is None else recursive
     propagate = False if propagate is None else propagate
     delete = False if delete is None else delete
+    force = False if force is None else force
+    watch_mode = False if watch_mode is None else watch_mode
+    jobs = 1 if jobs is None else jobs
+    poll = False if poll is None else poll
+    splice = False if splice is None else splice
+    source_map = True if splice else False if source_map is None else source_map
+    prefetch = 0 if prefetch is None else prefetch
+    prefetch_memory = DEFAULT_MAX_BYTES // (1024 * 1024) if prefetch_memory is None else prefetch_memory
+    fragment_cache_size = 0 if fragment_cache_size is None else fragment_cache_size
     source = os.getcwd() if source is None else source
     output = os.path.join(source, "compiled") if output is None else output
-    target = "" if target is None else target
-    target = os.path.normpath(target)
+    targets = [""] if target is None else [target] if isinstance(target, str) else target
+    targets = [os.path.normpath(target) for target in targets]
+
+    if changed:
+        try:
+            targets = get_changed_targets(source, read_changed_paths(changed))
+        except OSError as e:
+            print(f"Error: Failed to read changed paths from '{changed}': {e}")
+            sys.exit(1)
+        if not targets:
+            print("No changed paths inside the source directory, nothing to compile")
+            return
+
+    variants = [parse_variant(variant) for variant in variants] if variants else None
+
+    if plan:
+        plans = plan_outputs(
+            source,
+            output,
+            targets,
+            variants,
+            recursive=recursive,
+            yaml_path=yaml_path,
+            include_all=include_all,
+            keep_numbers=keep_numbers,
+            propagate=propagate,
+            mod_path=mod_path,
+            ignore_frontmatter=ignore_frontmatter
+        )
+        print(json.dumps({"outputs": plans}, indent=2) if plan == "json" else format_plan(plans, source))
+        return
 
     if delete:
-        delete_dirs(source, output, target)
+        for target in targets:
+            delete_dirs(source, output, target)
 
-    compile_all(
-        source,
-        output,
-        recursive=recursive,
-        yaml_path=yaml_path,
-        include_all=include_all,
-        keep_numbers=keep_numbers,
-        propagate=propagate,
-        target=target,
-        mod_path=mod_path,
-        ignore_frontmatter=ignore_frontmatter
-    )
+    if variants:
+        variant_outputs = [get_variant_output(output, variant) for variant in variants]
+        manifests = {path: BuildManifest(os.path.join(path, MANIFEST_NAME), force=force) for path in variant_outputs}
+        manifest_dir = variant_outputs[0]
+    else:
+        manifest_dir = output if os.path.isdir(output) else os.path.dirname(output)
+        manifests = {output: BuildManifest(os.path.join(manifest_dir, MANIFEST_NAME), force=force)}
+
+    manifest_path = os.path.join(manifest_dir, MANIFEST_NAME)
+    plan_cache_path = os.path.join(manifest_dir, PLAN_CACHE_NAME)
+    fragment_store_path = os.path.join(manifest_dir, FRAGMENT_STORE_NAME)
+
+    if warm is None:
+        plan_cache = PlanCache(plan_cache_path)
+        fragment_store = FragmentStore(fragment_store_path, fragment_cache_size * 1024 * 1024) if fragment_cache_size > 0 else None
+    else:
+        plan_cache = warm.plan_cache(plan_cache_path)
+        fragment_store = warm.fragment_store(fragment_store_path, fragment_cache_size * 1024 * 1024) if fragment_cache_size > 0 else None
+
+    changes = None
+    git_state = None
+    if git:
+        from markdown_utils.git_changes import get_build_changes
+        ignored = set(manifests) | {manifest_path, plan_cache_path, fragment_store_path, get_source_map_path(output)}
+        try:
+            changes, git_state = get_build_changes(source, git, manifests.values(), ignored)
+        except ValueError as e:
+            print(f"Error: Failed to read changes from git: {e}")
+            sys.exit(1)
+
+    compile_options = {
+        "recursive": recursive,
+        "yaml_path": yaml_path,
+        "include_all": include_all,
+        "keep_numbers": keep_numbers,
+        "propagate": propagate,
+        "targets": targets,
+        "mod_path": mod_path,
+        "ignore_frontmatter": ignore_frontmatter,
+        "jobs": jobs,
+        "source_map": source_map,
+        "splice": splice,
+    }
+
+    profiler = None
+    if profile:
+        from markdown_utils.profiling import Profiler
+        profiler = Profiler(sys.modules[__name__])
+        profiler.install()
+        if jobs > 1:
+            print("Profiling compiles in a single process, ignoring --jobs")
+            compile_options["jobs"] = 1
+        if prefetch > 0:
+            print("Profiling reads files when they are compiled, ignoring --prefetch")
+            prefetch = 0
+
+    prefetcher = create_prefetcher(prefetch, prefetch_memory * 1024 * 1024) if prefetch > 0 else None
+    fragment_cache = None
+
+    if warm is not None and not variants:
+        # Variants render with per-variant fragment caches, so only single-option runs reuse the warm ones.
+        compiler = warm.compiler(include_all, keep_numbers, mod_path, ignore_frontmatter)
+        index = compiler.index
+        index.prefetcher = prefetcher
+        fragment_cache = compiler.fragment_cache
+    else:
+        index = TreeIndex(prefetcher)
+
+    try:
+        if variants:
+            compile_variants(source, output, variants, manifests=manifests, index=index, plan_cache=plan_cache, fragment_store=fragment_store, changes=changes, **compile_options)
+        else:
+            compile_all(source, output, manifest=manifests[output], index=index, plan_cache=plan_cache, fragment_store=fragment_store, changes=changes, fragment_cache=fragment_cache, **compile_options)
+    finally:
+        if index.prefetcher is not None:
+            index.prefetcher.close()
+            index.prefetcher = None
+        if profiler is not None:
+            profiler.uninstall()
+            trace_path = profiler.write(profile)
+            print(f"Wrote profile to {profile} and {trace_path}")
+
+    for manifest in manifests.values():
+        if git_state is not None:
+            manifest.record_git(git_state)
+        manifest.save()
+    plan_cache.save()
+    if fragment_store is not None:
+        fragment_store.save()
+
+    if watch_mode and warm is not None:
+        print("Watch mode does not run in the compile daemon, stopping after one build")
+    elif watch_mode and variants:
+        print("Watch mode does not support variants yet, stopping after one build")
+    elif watch_mode:
+        from markdown_utils.watch import watch
+        watch(source, output, manifest_path, compile_options, polling=poll, fragment_store=fragment_store)
 
 if __name__ == "__main__":
     main()
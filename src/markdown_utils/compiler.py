@@ -0,0 +1,259 @@
+import os
+import time
+
+from markdown_utils import compile_markdown
+from markdown_utils.manifest import stat_signature
+from markdown_utils.order_plan import PlanCache
+from markdown_utils.tree_index import TreeIndex
+
+# How far apart a modification time and the clock it is compared with can be on a coarse filesystem clock.
+MTIME_RESOLUTION_NS = 1_000_000_000
+
+class Compiler:
+    """
+    Compiles markdown trees in-process with the options of compile-markdown, keeping its caches warm between calls.
+
+    File bodies, includes, folder fragments, directory listings and order plans are cached the
+    first time they are read and reused by every later call, so only the first compile of a tree
+    pays for reading it. The caches do not notice changes on disk: call invalidate with the
+    changed paths, or without arguments to drop everything, or refresh before and after every
+    compile to drop what changed according to modification times and sizes.
+    """
+
+    def __init__(
+        self,
+        recursive=False,
+        yaml_path=None,
+        include_all=True,
+        keep_numbers=False,
+        propagate=False,
+        mod_path=None,
+        ignore_frontmatter=False,
+        jobs=1,
+        plan_cache_path=None
+    ):
+        self.recursive = recursive
+        self.yaml_path = yaml_path
+        self.include_all = include_all
+        self.keep_numbers = keep_numbers
+        self.propagate = propagate
+        self.mod_path = mod_path
+        self.ignore_frontmatter = ignore_frontmatter
+        self.jobs = jobs
+        self.fragment_cache = {}
+        self.index = TreeIndex()
+        self.plan_cache = PlanCache(plan_cache_path)
+        self.signatures = {}
+        self.refreshed = None
+
+    def document_options(self, folder):
+        """
+        Returns the build_document options for folder, resolving the order file like compile_all does.
+        """
+        yaml_path = self.yaml_path
+        if yaml_path is None:
+            yaml_path = os.path.join(folder, "order.yaml")
+            yaml_path = yaml_path if self.index.exists(yaml_path) else None
+
+        return {
+            "yaml_path": yaml_path,
+            "include_all": self.include_all,
+            "keep_numbers": self.keep_numbers,
+            "mod_path": self.mod_path if self.mod_path and self.index.exists(self.mod_path) else None,
+            "ignore_frontmatter": self.ignore_frontmatter,
+        }
+
+    def iter_compile(self, folder, skeleton=None):
+        """
+        Yields the compiled text of folder piece by piece. See render_fragment for skeleton.
+        """
+        folder = os.path.abspath(folder)
+
+        return compile_markdown.iter_document(
+            folder,
+            **self.document_options(folder),
+            fragment_cache=self.fragment_cache,
+            index=self.index,
+            plan_cache=self.plan_cache,
+            skeleton=skeleton
+        )
+
+    def compile(self, folder):
+        """
+        Returns the compiled text of folder.
+        """
+        return "".join(self.iter_compile(folder))
+
+    def compile_to(self, folder, stream):
+        """
+        Writes the compiled text of folder to a text stream.
+        """
+        stream.writelines(self.iter_compile(folder))
+
+    def compile_all(self, source, output, target="", manifest=None):
+        """
+        Writes the compiled files of source to output like compile-markdown does.
+        """
+        compile_markdown.compile_all(
+            source,
+            output,
+            recursive=self.recursive,
+            yaml_path=self.yaml_path,
+            include_all=self.include_all,
+            keep_numbers=self.keep_numbers,
+            propagate=self.propagate,
+            target=target,
+            mod_path=self.mod_path,
+            ignore_frontmatter=self.ignore_frontmatter,
+            fragment_cache=self.fragment_cache,
+            manifest=manifest,
+            jobs=self.jobs,
+            index=self.index,
+            plan_cache=self.plan_cache
+        )
+
+        # compile_all creates output directories, which may lie inside a tree that is compiled later.
+        self.index.invalidate(output, descendants=True)
+
+    def invalidate(self, *paths):
+        """
+        Drops everything cached for the given files and directories, or all caches if no path is given.
+
+        A changed file invalidates its own body and include content, every file that includes it and
+        every folder that contains one of those. A directory also invalidates everything below it,
+        and a changed modification file drops all caches.
+        """
+        if not paths:
+            self.fragment_cache.clear()
+            self.index = TreeIndex()
+            self.plan_cache.invalidate()
+            return
+
+        paths = [os.path.abspath(path) for path in paths]
+        if self.mod_path and os.path.abspath(self.mod_path) in paths:
+            self.invalidate()
+            return
+
+        prefixes = tuple(path.rstrip(os.sep) + os.sep for path in paths)
+
+        def affected(path):
+            return path in paths or path.startswith(prefixes)
+
+        stale_files = set()
+        for key in list(self.fragment_cache):
+            if isinstance(key, str):
+                continue
+
+            value = self.fragment_cache[key]
+            if key[0] == "file":
+                if affected(key[1]) or any(affected(path) for path in value[3]):
+                    stale_files.add(key[1])
+                    del self.fragment_cache[key]
+            elif key[0] == "source":
+                if affected(key[1]) or (value is not None and any(affected(path) for path in value[3])):
+                    del self.fragment_cache[key]
+            elif key[0] == "include":
+                if affected(key[1]) or any(affected(path) for path in value[1]):
+                    del self.fragment_cache[key]
+            elif affected(key[1]):
+                del self.fragment_cache[key]
+
+        stale_folders = set(paths) | {os.path.dirname(path) for path in stale_files}
+
+        def contains_stale(folder_path):
+            folder_prefix = folder_path.rstrip(os.sep) + os.sep
+            return any(path == folder_path or path.startswith(folder_prefix) for path in stale_folders)
+
+        for key in [key for key in self.fragment_cache if isinstance(key, str)]:
+            folder_path = key.split("\0", 1)[0]
+            if affected(folder_path) or contains_stale(folder_path):
+                del self.fragment_cache[key]
+
+        # Order files are revalidated by the plan cache on every use.
+        for path in paths:
+            self.index.invalidate(path, descendants=True)
+
+    def invalidate_listing(self, directory):
+        """
+        Drops what depends on the entries of directory: its listing, the fragments of it and its
+        ancestors, and the files directly inside it, whose bodies depend on its marker files.
+        """
+        directory = os.path.abspath(directory)
+
+        for key in list(self.fragment_cache):
+            if isinstance(key, str):
+                folder_path = key.split("\0", 1)[0]
+                if directory == folder_path or directory.startswith(folder_path.rstrip(os.sep) + os.sep):
+                    del self.fragment_cache[key]
+            elif key[0] == "file" and os.path.dirname(key[1]) == directory:
+                del self.fragment_cache[key]
+
+        self.index.invalidate(directory)
+
+    def cached_paths(self):
+        """
+        Returns every file and directory the caches hold something read from, including the modification file.
+        """
+        paths = set(self.index.directories)
+        if self.mod_path:
+            paths.add(os.path.abspath(self.mod_path))
+
+        for key, value in self.fragment_cache.items():
+            if isinstance(key, str):
+                paths.add(key.split("\0", 1)[0])
+            elif key[0] == "file":
+                paths.add(key[1])
+                paths.update(value[3])
+            elif key[0] == "include":
+                paths.add(key[1])
+                paths.update(value[1])
+            else:
+                paths.add(key[1])
+
+        return paths
+
+    def refresh(self):
+        """
+        Drops everything cached for files and directories whose modification time or size changed since
+        the previous refresh. A directory whose time changed only has its listing dropped, see
+        invalidate_listing, and a changed modification file drops everything.
+
+        Paths are tracked from the first refresh after they were cached, so call it right after every
+        compile as well. A path modified after the previous refresh started may have changed while it
+        was read, so it is dropped instead.
+        """
+        started = time.time_ns()
+        mod_path = os.path.abspath(self.mod_path) if self.mod_path else None
+
+        changed = {}
+        for path, signature in self.signatures.items():
+            current = stat_signature(path)
+            if current != signature:
+                changed[path] = signature is not None and current is not None and signature[1] == current[1] == -1
+
+        for path in changed:
+            del self.signatures[path]
+
+        if mod_path in changed:
+            self.invalidate()
+            self.signatures.clear()
+            changed = {}
+
+        for path in self.cached_paths() - self.signatures.keys():
+            signature = stat_signature(path)
+            if self.refreshed is not None and signature is not None and signature[0] >= self.refreshed - MTIME_RESOLUTION_NS:
+                changed[path] = signature[1] == -1
+            else:
+                self.signatures[path] = signature
+
+        if mod_path in changed:
+            self.invalidate()
+            self.signatures.clear()
+        else:
+            for directory in [path for path, listing in changed.items() if listing]:
+                self.invalidate_listing(directory)
+            paths = [path for path, listing in changed.items() if not listing]
+            if paths:
+                self.invalidate(*paths)
+
+        self.refreshed = started
@@ -0,0 +1,228 @@
+import io
+import os
+import sys
+import json
+import signal
+import socket
+import argparse
+import traceback
+import contextlib
+
+from markdown_utils import compile_markdown
+from markdown_utils.client import DAEMON_PROTOCOL_VERSION, connect, get_socket_path, send_message
+from markdown_utils.compiler import Compiler
+from markdown_utils.fragment_store import FragmentStore
+from markdown_utils.manifest import stat_signature
+from markdown_utils.order_plan import PlanCache
+
+class WarmState:
+    """
+    Caches a compile daemon keeps between requests.
+
+    There is one Compiler per set of options that changes the compiled fragments, holding the file
+    bodies, includes, folder fragments and directory listings read so far; it is refreshed by
+    modification time before and after every request that uses it. Order plan caches and fragment
+    stores are kept per output directory. A fragment store is loaded again when another process
+    saved it since.
+    """
+
+    def __init__(self):
+        self.compilers = {}
+        self.plan_caches = {}
+        self.fragment_stores = {}
+        self.used = []
+
+    def compiler(self, include_all=True, keep_numbers=False, mod_path=None, ignore_frontmatter=False):
+        mod_path = os.path.abspath(mod_path) if mod_path else None
+        key = (include_all, keep_numbers, mod_path, ignore_frontmatter)
+
+        compiler = self.compilers.get(key)
+        if compiler is None:
+            compiler = self.compilers[key] = Compiler(include_all=include_all, keep_numbers=keep_numbers, mod_path=mod_path, ignore_frontmatter=ignore_frontmatter)
+
+        compiler.refresh()
+        self.used.append(compiler)
+        return compiler
+
+    def plan_cache(self, path):
+        path = os.path.abspath(path)
+        if path not in self.plan_caches:
+            self.plan_caches[path] = PlanCache(path)
+        return self.plan_caches[path]
+
+    def fragment_store(self, path, max_bytes):
+        path = os.path.abspath(path)
+        stored = self.fragment_stores.get(path)
+
+        if stored is None or stored[0].max_bytes != max_bytes or stored[1] != stat_signature(stored[0].index_path()):
+            stored = self.fragment_stores[path] = [FragmentStore(path, max_bytes), None]
+            stored[1] = stat_signature(stored[0].index_path())
+
+        return stored[0]
+
+    def finish(self):
+        """
+        Starts tracking what the compilers used by a request cached, and records the state of the fragment stores it saved.
+        """
+        for compiler in self.used:
+            compiler.refresh()
+        self.used = []
+
+        for stored in self.fragment_stores.values():
+            stored[1] = stat_signature(stored[0].index_path())
+
+class MessageStream(io.TextIOBase):
+    """
+    Text stream sending everything written to it to the client as messages of the given kind.
+
+    Once the client is gone, writes are dropped so the request still finishes and leaves the caches consistent.
+    """
+
+    def __init__(self, connection, kind):
+        self.connection = connection
+        self.kind = kind
+        self.disconnected = False
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        if text and not self.disconnected:
+            try:
+                send_message(self.connection, {self.kind: text})
+            except OSError:
+                self.disconnected = True
+        return len(text)
+
+def run_request(request, connection, warm):
+    """
+    Runs one compile-markdown command line in the working directory of the client and returns its exit status.
+    """
+    stdout = MessageStream(connection, "stdout")
+    stderr = MessageStream(connection, "stderr")
+    stdin = sys.stdin
+
+    try:
+        os.chdir(request["cwd"])
+        sys.stdin = io.StringIO(request.get("stdin") or "")
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            compile_markdown.main(request["argv"], warm=warm)
+        return 0
+    except SystemExit as e:
+        return e.code if isinstance(e.code, int) else 0 if e.code is None else 1
+    except Exception:
+        stderr.write(traceback.format_exc())
+        return 1
+    finally:
+        sys.stdin = stdin
+        warm.finish()
+
+def handle(connection, warm):
+    """
+    Answers one client connection and returns False if it asked the daemon to stop.
+    """
+    with connection:
+        try:
+            request = json.loads(connection.makefile('r', encoding='utf-8').readline())
+        except (OSError, ValueError):
+            return True
+
+        try:
+            if request.get("stop"):
+                send_message(connection, {"exit": 0})
+                return False
+            if request.get("status"):
+                send_message(connection, {"stdout": f"Compile daemon {os.getpid()} running with {len(warm.compilers)} warm option sets\n"})
+                send_message(connection, {"exit": 0})
+                return True
+            if request.get("version") != DAEMON_PROTOCOL_VERSION:
+                send_message(connection, {"fallback": "protocol version mismatch"})
+                return True
+
+            status = run_request(request, connection, warm)
+            send_message(connection, {"exit": status})
+        except OSError:
+            pass
+
+    return True
+
+def serve_daemon(socket_path):
+    """
+    Answers compile requests on a Unix domain socket at socket_path, one at a time, until stopped.
+    """
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # The umask keeps the socket private to its owner from the moment it exists.
+    umask = os.umask(0o077)
+    try:
+        listener.bind(socket_path)
+    finally:
+        os.umask(umask)
+    listener.listen()
+
+    # SIGTERM stops the daemon like Ctrl+C, so the socket is removed either way.
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    warm = WarmState()
+
+    print(f"Compile daemon listening on {socket_path} (press Ctrl+C to stop)", flush=True)
+
+    try:
+        while True:
+            connection, _ = listener.accept()
+            if not handle(connection, warm):
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.close()
+        os.remove(socket_path)
+
+def send_command(socket_path, command):
+    """
+    Sends a stop or status command to the daemon at socket_path, prints its answer and returns whether one was running.
+    """
+    connection = connect(socket_path)
+    if connection is None:
+        return False
+
+    with connection:
+        send_message(connection, {command: True})
+        for line in connection.makefile('r', encoding='utf-8'):
+            message = json.loads(line)
+            if "stdout" in message:
+                sys.stdout.write(message["stdout"])
+            if "exit" in message:
+                break
+
+    return True
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="compile-markdown daemon", description="Keep a compile-markdown process with warm caches running, which compile-markdown commands are sent to.")
+    parser.add_argument("--socket", help="Path of the Unix domain socket (default: $COMPILE_MARKDOWN_SOCKET, or a per-user socket in $XDG_RUNTIME_DIR or the temporary directory)")
+    parser.add_argument("--status", action="store_true", help="Report whether a daemon is running and exit")
+    parser.add_argument("--stop", action="store_true", help="Stop the running daemon and exit")
+
+    args = parser.parse_args(argv)
+    socket_path = os.path.abspath(args.socket) if args.socket else get_socket_path()
+
+    if args.status or args.stop:
+        if not send_command(socket_path, "stop" if args.stop else "status"):
+            print(f"No compile daemon is running on {socket_path}")
+            sys.exit(1)
+        if args.stop:
+            print(f"Stopped the compile daemon on {socket_path}")
+        return
+
+    running = connect(socket_path)
+    if running is not None:
+        running.close()
+        print(f"Error: A compile daemon is already running on {socket_path}")
+        sys.exit(1)
+
+    if os.path.exists(socket_path):
+        # Left behind by a daemon that did not shut down cleanly.
+        os.remove(socket_path)
+
+    serve_daemon(socket_path)
+
+if __name__ == "__main__":
+    main()
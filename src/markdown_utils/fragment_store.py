@@ -0,0 +1,205 @@
+import os
+import json
+import time
+import hashlib
+import itertools
+from markdown_utils.manifest import hash_file
+
+FRAGMENT_STORE_NAME = ".compile-fragments"
+FRAGMENT_STORE_VERSION = 1
+DEFAULT_STORE_BYTES = 256 * 1024 * 1024
+
+temp_counter = itertools.count()
+
+def hash_key(parts):
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=repr).encode('utf-8')).hexdigest()
+
+class FragmentStore:
+    """
+    Persistent, content-addressed store of processed file bodies.
+
+    A body is stored under a key made of the file path, the hash of its content and the compile
+    options it depends on, together with the hashes of the files it includes, and is only reused
+    while those hashes still match. Rendering a body at its depth is cheaper than reading it back,
+    so renderings are not stored. File hashes are kept with the modification time and size they
+    were taken at, so unchanged files are not read at all.
+
+    Objects live in a directory, one file each, and the least recently used ones are evicted when
+    save finds the store larger than max_bytes. Reading objects only updates their last use in
+    memory, so a run that adds nothing does not rewrite the index.
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_STORE_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.signatures = {}
+        self.entries = {}
+        self.config_hashes = {}
+        self.pending = {"signatures": {}, "entries": {}}
+        self.changed = False
+        self.load()
+
+    def index_path(self):
+        return os.path.join(self.path, "index.json")
+
+    def object_path(self, key):
+        return os.path.join(self.path, "objects", key[:2], key)
+
+    def load(self):
+        try:
+            with open(self.index_path(), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        if isinstance(data, dict) and data.get("version") == FRAGMENT_STORE_VERSION:
+            self.signatures = data.get("signatures", {})
+            self.entries = data.get("entries", {})
+
+    def save(self):
+        if not self.changed:
+            return
+
+        self.evict()
+        os.makedirs(self.path, exist_ok=True)
+
+        temp_path = f"{self.index_path()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({"version": FRAGMENT_STORE_VERSION, "signatures": self.signatures, "entries": self.entries}, f, separators=(',', ':'))
+        os.replace(temp_path, self.index_path())
+        self.changed = False
+
+    def evict(self):
+        """
+        Removes the least recently used objects until the store fits in max_bytes.
+        """
+        total = sum(entry[0] for entry in self.entries.values())
+        if total <= self.max_bytes:
+            return
+
+        for key in sorted(self.entries, key=lambda key: self.entries[key][1]):
+            try:
+                os.remove(self.object_path(key))
+            except FileNotFoundError:
+                pass
+            total -= self.entries.pop(key)[0]
+            if total <= self.max_bytes:
+                break
+
+        self.changed = True
+
+    def file_hash(self, path, index=None):
+        """
+        Returns the content hash of path, or None if it cannot be read. index is a TreeIndex to take the stat from.
+        """
+        st = index.stat(path) if index is not None else None
+        if st is None:
+            try:
+                st = os.stat(path)
+            except OSError:
+                return None
+
+        signature = self.signatures.get(path)
+        if signature is not None and signature[0] == st.st_mtime_ns and signature[1] == st.st_size:
+            return signature[2]
+
+        try:
+            digest = hash_file(path)
+        except OSError:
+            return None
+
+        self.signatures[path] = self.pending["signatures"][path] = [st.st_mtime_ns, st.st_size, digest]
+        self.changed = True
+
+        return digest
+
+    def config_hash(self, config):
+        """
+        Returns a hash of a parsed modification config, computed once per config object.
+        """
+        if config is None:
+            return None
+
+        cached = self.config_hashes.get(id(config))
+        if cached is None or cached[0] is not config:
+            cached = self.config_hashes[id(config)] = (config, hash_key(config))
+
+        return cached[1]
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+
+        try:
+            with open(self.object_path(key), 'r', encoding='utf-8') as f:
+                text = f.read()
+        except (OSError, ValueError):
+            self.entries.pop(key, None)
+            self.changed = True
+            return None
+
+        # A hit is saved along with the next change instead of forcing one.
+        self.entries[key] = self.pending["entries"][key] = [entry[0], time.time_ns()]
+        return text
+
+    def put(self, key, text):
+        path = self.object_path(key)
+        directory = os.path.dirname(path)
+        temp_path = os.path.join(directory, f".{key}.{os.getpid()}.{next(temp_counter)}.tmp")
+
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(temp_path, path)
+        except OSError:
+            # A store that cannot be written only costs the reuse, never the compile.
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+
+        self.entries[key] = self.pending["entries"][key] = [len(text.encode('utf-8')), time.time_ns()]
+        self.changed = True
+
+    def body(self, item_path, options, build, index=None):
+        """
+        Returns the body and included paths of item_path, from the store if its content and includes are
+        unchanged, or from build(), which returns both, otherwise. options are the compile options the body
+        depends on.
+        """
+        file_hash = self.file_hash(item_path, index)
+        if file_hash is None:
+            return build()
+
+        key = hash_key(["body", item_path, file_hash, options])
+        stored = self.get(key)
+
+        if stored is not None:
+            record = json.loads(stored)
+            if all(self.file_hash(path, index) == digest for path, digest in record["includes"]):
+                return record["body"], [path for path, _ in record["includes"]]
+
+        body, included_paths = build()
+        includes = [[path, self.file_hash(path, index)] for path in included_paths]
+        self.put(key, json.dumps({"includes": includes, "body": body}))
+
+        return body, included_paths
+
+    def export_records(self):
+        """
+        Returns the index records changed since the last export, for merging into the store of another process.
+        """
+        records = self.pending
+        self.pending = {"signatures": {}, "entries": {}}
+        return records
+
+    def merge_records(self, records):
+        if records["signatures"]:
+            self.signatures.update(records["signatures"])
+            self.changed = True
+
+        for key, entry in records["entries"].items():
+            if self.entries.get(key, [None])[0] != entry[0]:
+                self.changed = True
+            self.entries[key] = entry
@@ -0,0 +1,159 @@
+import os
+import subprocess
+
+from markdown_utils import compile_markdown
+from markdown_utils.watch import DependencyGraph, is_ignored
+
+ADDED = "A"
+DELETED = "D"
+MODIFIED = "M"
+
+def run_git(directory, *args):
+    """
+    Returns the standard output of a git command run in directory, or raises ValueError with git's error message.
+    """
+    try:
+        result = subprocess.run(["git", "-C", directory, *args], capture_output=True)
+    except FileNotFoundError:
+        raise ValueError("git is not installed")
+
+    if result.returncode != 0:
+        message = result.stderr.decode('utf-8', 'replace').strip().splitlines()
+        raise ValueError(message[-1] if message else f"git {args[0]} failed")
+
+    return result.stdout
+
+def find_git_root(directory):
+    """
+    Returns the top directory of the git repository containing directory, spelled like directory so
+    paths stay comparable with the manifest even through symlinks.
+    """
+    up = os.fsdecode(run_git(directory, "rev-parse", "--show-cdup")).strip()
+    return os.path.normpath(os.path.join(os.path.abspath(directory), up))
+
+def parse_name_status(output, root):
+    """
+    Returns the changes listed by git diff --name-status -z as a dict mapping absolute paths to ADDED,
+    DELETED or MODIFIED. A rename deletes its old path and adds its new one, a copy adds its new path.
+    """
+    fields = [os.fsdecode(field) for field in output.split(b'\0')]
+    changes = {}
+
+    i = 0
+    while i < len(fields) and fields[i]:
+        status = fields[i][0]
+        if status in "RC":
+            old_path, new_path = fields[i + 1], fields[i + 2]
+            if status == "R":
+                changes[os.path.join(root, old_path)] = DELETED
+            changes[os.path.join(root, new_path)] = ADDED
+            i += 3
+            continue
+
+        changes[os.path.join(root, fields[i + 1])] = ADDED if status == "A" else DELETED if status == "D" else MODIFIED
+        i += 2
+
+    return changes
+
+def get_git_changes(source, revisions="HEAD", ignored=()):
+    """
+    Returns the paths changed in the git repository containing source, as a dict mapping absolute
+    paths to ADDED, DELETED or MODIFIED.
+
+    A range such as "main..HEAD" or "main...HEAD" lists the changes between commits. A single revision
+    lists the changes from it to the working tree, staged or not, including untracked files, so the
+    default "HEAD" covers everything git status reports. Paths inside the ignored paths, such as the
+    output directory, are left out.
+    """
+    root = find_git_root(source)
+
+    changes = parse_name_status(run_git(root, "diff", "--name-status", "-z", "-M", "--no-ext-diff", revisions, "--"), root)
+
+    if ".." not in revisions:
+        for path in run_git(root, "ls-files", "--others", "--exclude-standard", "-z").split(b'\0'):
+            if path:
+                changes[os.path.join(root, os.fsdecode(path))] = ADDED
+
+    ignored = {os.path.abspath(path) for path in ignored}
+    return {os.path.normpath(path): status for path, status in changes.items() if not is_ignored(os.path.normpath(path), ignored)}
+
+def get_affected_outputs(manifest, changes):
+    """
+    Returns the outputs in manifest that depend on the changes of get_git_changes.
+
+    A modified path affects the outputs built from it. An added or deleted path also changes the
+    listing of its directory, so it affects the outputs of its closest ancestor the manifest knows,
+    which catches new files, new directories and marker files.
+    """
+    graph = DependencyGraph(manifest)
+    affected = set()
+
+    for path, status in changes.items():
+        affected |= graph.dependents.get(path, set())
+        if status == MODIFIED:
+            continue
+
+        directory = os.path.dirname(path)
+        while directory not in graph.dependents and os.path.dirname(directory) != directory:
+            directory = os.path.dirname(directory)
+        affected |= graph.dependents.get(directory, set())
+
+    return affected
+
+def get_revision(source, revision):
+    """
+    Returns the id of the commit revision names in the git repository containing source.
+    """
+    return os.fsdecode(run_git(find_git_root(source), "rev-parse", "--verify", f"{revision}^{{commit}}")).strip()
+
+def get_build_changes(source, revisions, manifests, ignored=()):
+    """
+    Returns the changes a --git run compiles as a tuple (changes, state).
+
+    A range is used as given and state is None. A single revision is compared with the working tree,
+    and the changes since every manifest was built are added: those between the revision it recorded
+    and this one, and the paths that differed from the recorded revision at the time. changes is None
+    if a manifest has no recorded state or its revision is gone, so every output is checked against
+    its manifest instead. state is what to record in the manifests once the outputs are built.
+    """
+    changes = get_git_changes(source, revisions, ignored)
+    if ".." in revisions:
+        return changes, None
+
+    revision = get_revision(source, revisions)
+    state = {"revision": revision, "changes": changes}
+
+    changes = dict(changes)
+    for manifest in manifests:
+        if manifest.previous_git is None:
+            return None, state
+
+        try:
+            since = get_git_changes(source, f"{manifest.previous_git['revision']}..{revision}", ignored)
+        except ValueError:
+            return None, state
+
+        for path, status in list(since.items()) + list(manifest.previous_git["changes"].items()):
+            if changes.get(path, MODIFIED) == MODIFIED:
+                changes[path] = status
+
+    return changes, state
+
+def select_changed_tasks(tasks, manifest, changes):
+    """
+    Returns the tasks that have to run for the changes of get_build_changes: those whose output depends
+    on a changed path, and those whose output the manifest has no record of with the same options or
+    that is missing. The inputs of the other outputs are not checked at all.
+    """
+    affected = get_affected_outputs(manifest, changes)
+    selected = []
+
+    for task in tasks:
+        output_file = os.path.abspath(compile_markdown.get_output_file(task["root_folder"], task["output"], task["keep_numbers"], task["output_name"]))
+        options = compile_markdown.get_manifest_options(task["yaml_path"], task["mod_path"], task["include_all"], task["keep_numbers"], task["ignore_frontmatter"])
+        record = manifest.outputs.get(output_file)
+
+        if output_file in affected or record is None or record["options"] != options or not os.path.exists(output_file):
+            selected.append(task)
+
+    return selected
@@ -0,0 +1,361 @@
+import os
+import json
+import stat
+import hashlib
+
+MANIFEST_NAME = ".compile-manifest.json"
+MANIFEST_VERSION = 2
+
+def hash_file(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def hash_listing(path):
+    return hashlib.sha1("\0".join(sorted(os.listdir(path))).encode('utf-8')).hexdigest()
+
+def stat_signature(path):
+    """
+    Returns [mtime_ns, size] for a file, [mtime_ns, -1] for a directory or None if the path is missing.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+
+    if stat.S_ISDIR(st.st_mode):
+        return [st.st_mtime_ns, -1]
+
+    return [st.st_mtime_ns, st.st_size]
+
+class BuildManifest:
+    """
+    Records the inputs of every compiled output so unchanged outputs can be skipped on the next run.
+
+    Inputs are stored once as [mtime_ns, size, hash] (size is -1 and hash covers the entry names for
+    directories, missing paths are stored as None). Folder fragments list their direct inputs and the
+    keys of their child fragments, so the manifest grows linearly with the source tree.
+
+    Freshness checks always compare against the manifest as it was loaded, so recording a rebuilt
+    output never hides a change from another output that shares its inputs. Outputs that were not
+    recorded again but depend on an input whose content changed are dropped on save, so later runs
+    rebuild them too.
+
+    A --git run also records the git state the outputs were built from, see git_changes.get_build_changes.
+    Any other run that changes the manifest drops it.
+    """
+
+    def __init__(self, path, force=False):
+        self.path = path
+        self.force = force
+        self.inputs = {}
+        self.fragments = {}
+        self.outputs = {}
+        self.git = None
+        self.previous_git = None
+        self.previous_inputs = {}
+        self.previous_fragments = {}
+        self.changed = False
+        self.checked_inputs = {}
+        self.checked_fragments = {}
+        self.recorded_inputs = set()
+        self.recorded_fragments = set()
+        self.recorded_outputs = set()
+        self.pending = {"inputs": {}, "fragments": {}, "outputs": {}}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        if not isinstance(data, dict) or data.get("version") != MANIFEST_VERSION:
+            return
+
+        self.previous_inputs = data.get("inputs", {})
+        self.previous_fragments = data.get("fragments", {})
+        self.inputs = dict(self.previous_inputs)
+        self.fragments = dict(self.previous_fragments)
+        self.outputs = data.get("outputs", {})
+        self.previous_git = data.get("git")
+
+    def save(self):
+        if not self.changed:
+            return
+
+        self.drop_stale_outputs()
+        self.prune()
+
+        data = {
+            "version": MANIFEST_VERSION,
+            "outputs": self.outputs,
+            "fragments": self.fragments,
+            "inputs": self.inputs,
+        }
+        if self.git is not None:
+            data["git"] = self.git
+
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(temp_path, self.path)
+        self.changed = False
+
+    def record_git(self, state):
+        """
+        Records the git state of get_build_changes the outputs were built from.
+        """
+        self.git = state
+        if state != self.previous_git:
+            self.changed = True
+
+    def drop_stale_outputs(self):
+        """
+        Drops the records of outputs that were not recorded in this run but read an input whose content
+        was recorded as changed, since those outputs still hold the old content.
+        """
+        changed = set()
+        for path, signature in self.inputs.items():
+            previous = self.previous_inputs.get(path, signature)
+            if (signature is None) != (previous is None) or (signature is not None and signature[2] != previous[2]):
+                changed.add(path)
+
+        if not changed:
+            return
+
+        stale_fragments = {}
+
+        def is_stale(key):
+            if key not in stale_fragments:
+                stale_fragments[key] = False
+                record = self.fragments.get(key)
+                if record is not None:
+                    stale_fragments[key] = not changed.isdisjoint(record["inputs"]) or any(is_stale(child) for child in record["fragments"])
+            return stale_fragments[key]
+
+        for output, record in list(self.outputs.items()):
+            if output not in self.recorded_outputs and (not changed.isdisjoint(record["inputs"]) or is_stale(record["fragment"])):
+                del self.outputs[output]
+
+    def prune(self):
+        """
+        Drops records for outputs that no longer exist and anything only they referenced.
+        """
+        self.outputs = {output: record for output, record in self.outputs.items() if os.path.exists(output)}
+
+        live_fragments = set()
+        pending = [record["fragment"] for record in self.outputs.values()]
+        while pending:
+            key = pending.pop()
+            if key in live_fragments or key not in self.fragments:
+                continue
+            live_fragments.add(key)
+            pending.extend(self.fragments[key]["fragments"])
+        self.fragments = {key: self.fragments[key] for key in live_fragments}
+
+        live_inputs = set()
+        for record in self.outputs.values():
+            live_inputs.update(record["inputs"])
+        for record in self.fragments.values():
+            live_inputs.update(record["inputs"])
+        self.inputs = {path: self.inputs[path] for path in live_inputs if path in self.inputs}
+
+    def input_unchanged(self, path):
+        if path in self.checked_inputs:
+            return self.checked_inputs[path]
+
+        unchanged = False
+        if path in self.previous_inputs:
+            recorded = self.previous_inputs[path]
+            current = stat_signature(path)
+
+            if recorded is None or current is None:
+                unchanged = recorded is None and current is None
+            elif current == recorded[:2]:
+                unchanged = True
+            elif current[1] == recorded[1]:
+                try:
+                    current_hash = hash_listing(path) if current[1] == -1 else hash_file(path)
+                except OSError:
+                    current_hash = None
+                unchanged = current_hash == recorded[2]
+                if unchanged and path not in self.recorded_inputs:
+                    self.inputs[path] = current + [current_hash]
+                    self.pending["inputs"][path] = self.inputs[path]
+                    self.changed = True
+
+        self.checked_inputs[path] = unchanged
+        return unchanged
+
+    def fragment_unchanged(self, key):
+        if key in self.checked_fragments:
+            return self.checked_fragments[key]
+
+        record = self.previous_fragments.get(key)
+        unchanged = (
+            record is not None
+            and all(self.input_unchanged(path) for path in record["inputs"])
+            and all(self.fragment_unchanged(child) for child in record["fragments"])
+        )
+
+        self.checked_fragments[key] = unchanged
+        return unchanged
+
+    def is_fresh(self, output_file, options):
+        """
+        Returns True if output_file was built with the same options and none of its inputs changed.
+        """
+        if self.force:
+            return False
+
+        record = self.outputs.get(os.path.abspath(output_file))
+        if record is None or record["options"] != options:
+            return False
+
+        if stat_signature(output_file) != record["output"]:
+            return False
+
+        return all(self.input_unchanged(path) for path in record["inputs"]) and self.fragment_unchanged(record["fragment"])
+
+    def changed_inputs(self, output_file):
+        """
+        Returns the inputs of output_file, its own and those of all its fragments, that changed since it was
+        recorded, or None if it has no complete record.
+        """
+        record = self.outputs.get(os.path.abspath(output_file))
+        if record is None:
+            return None
+
+        inputs = set(record["inputs"])
+        pending = [record["fragment"]]
+        seen = set()
+        while pending:
+            key = pending.pop()
+            if key in seen:
+                continue
+            seen.add(key)
+
+            fragment = self.previous_fragments.get(key)
+            if fragment is None:
+                return None
+            inputs.update(fragment["inputs"])
+            pending.extend(fragment["fragments"])
+
+        return {path for path in inputs if not self.input_unchanged(path)}
+
+    def record_input(self, path):
+        path = os.path.abspath(path)
+        if path in self.recorded_inputs:
+            return path
+        self.recorded_inputs.add(path)
+
+        current = stat_signature(path)
+        recorded = self.inputs.get(path)
+
+        if current is None:
+            signature = None
+        elif recorded is not None and recorded[:2] == current:
+            signature = recorded
+        else:
+            try:
+                signature = current + [hash_listing(path) if current[1] == -1 else hash_file(path)]
+            except OSError:
+                signature = current + [None]
+
+        if signature != recorded or path not in self.inputs:
+            self.inputs[path] = signature
+            self.pending["inputs"][path] = signature
+            self.changed = True
+
+        return path
+
+    def record_fragment(self, key, folder_path, fragment):
+        if key in self.recorded_fragments:
+            return
+        self.recorded_fragments.add(key)
+
+        inputs = [folder_path]
+        children = []
+
+        for entry in fragment:
+            if entry[0] == "file":
+                inputs.append(entry[1])
+                inputs.extend(entry[3])
+            elif entry[0] == "skip":
+                inputs.append(entry[1])
+            else:
+                self.record_fragment(entry[4], entry[1], entry[3])
+                children.append(entry[4])
+
+        record = {
+            "inputs": sorted(set(self.record_input(path) for path in inputs)),
+            "fragments": children,
+        }
+
+        if self.fragments.get(key) != record:
+            self.fragments[key] = record
+            self.pending["fragments"][key] = record
+            self.changed = True
+
+    def record_output(self, output_file, options, inputs, key, folder_path, fragment):
+        self.record_fragment(key, folder_path, fragment)
+
+        record = {
+            "folder": os.path.abspath(folder_path),
+            "options": options,
+            "inputs": sorted(set(self.record_input(path) for path in inputs)),
+            "fragment": key,
+            "output": stat_signature(output_file),
+        }
+
+        output_file = os.path.abspath(output_file)
+        self.recorded_outputs.add(output_file)
+        if self.outputs.get(output_file) != record:
+            self.outputs[output_file] = record
+            self.pending["outputs"][output_file] = record
+            self.changed = True
+
+    def record_splice(self, output_file, files):
+        """
+        Updates the record of output_file after files were rendered again and spliced into it in place.
+
+        files maps every spliced file to the paths it includes now. Newly included paths are added to
+        the fragments that list the file, so a later change to them is noticed.
+        """
+        output_file = os.path.abspath(output_file)
+        record = self.outputs.get(output_file)
+        if record is None:
+            return
+
+        self.recorded_outputs.add(output_file)
+        for path, included_paths in files.items():
+            path = self.record_input(path)
+            included = {self.record_input(included_path) for included_path in included_paths}
+
+            for key, fragment in self.fragments.items():
+                if path in fragment["inputs"] and not included.issubset(fragment["inputs"]):
+                    fragment = dict(fragment, inputs=sorted(included.union(fragment["inputs"])))
+                    self.fragments[key] = self.pending["fragments"][key] = fragment
+                    self.changed = True
+
+        self.outputs[output_file] = self.pending["outputs"][output_file] = dict(record, output=stat_signature(output_file))
+        self.changed = True
+
+    def export_records(self):
+        """
+        Returns the records changed since the last export, for merging into the manifest of another process.
+        """
+        records = self.pending
+        self.pending = {"inputs": {}, "fragments": {}, "outputs": {}}
+        return records
+
+    def merge_records(self, records):
+        self.recorded_outputs.update(records["outputs"])
+        for name in ("inputs", "fragments", "outputs"):
+            if records[name]:
+                getattr(self, name).update(records[name])
+                self.changed = True
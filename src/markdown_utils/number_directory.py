@@ -1,37 +1,177 @@
 import os
 import re
 import sys
+import json
 import argparse
 
-def rename_files(directory, start, digits):
-    """Renames files and subdirectories in a given directory with sequential numbers."""
+JOURNAL_NAME = ".number-directory.journal"
+JOURNAL_VERSION = 1
+
+NUMBER_PREFIX = re.compile(r'^[\d.\s]+')
+
+# Files the compiler looks up by name keep it.
+UNNUMBERED_NAMES = {"order.yaml", "frontmatter.yaml"}
+
+def numbered_name(entry, number, digits):
+    """Strips the existing numbering from entry and prefixes it with number."""
+    return f"{str(number).zfill(digits)} {NUMBER_PREFIX.sub('', entry)}"
+
+def plan_renames(directory, start, digits, recursive=False):
+    """
+    Scans directory once and returns the renames that number its entries, as a list of
+    (directory, [(old_name, temp_name, new_name), ...]) steps.
+
+    Every directory is listed a single time. Hidden entries, such as marker files, and order files
+    are neither numbered nor descended into. Steps are ordered deepest first, so each one can be
+    applied while the paths of its parents are still unchanged.
+    """
+    steps = []
+    pending = [os.path.abspath(directory)]
+
+    while pending:
+        current = pending.pop()
+        with os.scandir(current) as it:
+            listing = list(it)
+
+        names = {entry.name for entry in listing}
+        entries = sorted((entry for entry in listing if not entry.name.startswith(".") and entry.name not in UNNUMBERED_NAMES), key=lambda entry: entry.name)
+        renames = []
+        for i, entry in enumerate(entries):
+            new_name = numbered_name(entry.name, i + start, digits)
+            if new_name != entry.name:
+                temp_name = f".{os.getpid()}-{i}.renumber"
+                while temp_name in names:
+                    temp_name = f".{temp_name}"
+                renames.append((entry.name, temp_name, new_name))
+
+            if recursive and entry.is_dir(follow_symlinks=False):
+                pending.append(entry.path)
+
+        if renames:
+            steps.append((current, renames))
+
+    steps.sort(key=lambda step: step[0].count(os.sep), reverse=True)
+    return steps
+
+def write_journal(journal_path, steps):
+    temp_path = f"{journal_path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump({"version": JOURNAL_VERSION, "steps": steps}, f)
+    os.replace(temp_path, journal_path)
+
+def move_step(directory, moves):
+    """
+    Renames each (name, temp_name, new_name) of a directory in two phases: first every name to its
+    temporary name, then every temporary name to its new name, so no rename lands on a name that is
+    still in use. Moves that completed are rolled back if a rename fails.
+    """
+    done = []
+    try:
+        for name, temp_name, new_name in moves:
+            os.rename(os.path.join(directory, name), os.path.join(directory, temp_name))
+            done.append((name, temp_name, None))
+
+        for i, (name, temp_name, new_name) in enumerate(moves):
+            os.rename(os.path.join(directory, temp_name), os.path.join(directory, new_name))
+            done[i] = (name, temp_name, new_name)
+    except OSError:
+        for name, temp_name, new_name in reversed(done):
+            try:
+                if new_name is not None:
+                    os.rename(os.path.join(directory, new_name), os.path.join(directory, temp_name))
+                os.rename(os.path.join(directory, temp_name), os.path.join(directory, name))
+            except OSError as e:
+                print(f"Error restoring {os.path.join(directory, name)}: {e}")
+        raise
 
-    entries = os.listdir(directory)
-    entries.sort()
+def apply_plan(steps, journal_path=None, dry_run=False):
+    """Applies the steps of plan_renames, recording them in journal_path first. Returns False if a step failed."""
+    if dry_run:
+        for directory, renames in steps:
+            for name, temp_name, new_name in renames:
+                print(f"Would rename: {os.path.join(directory, name)} -> {new_name}")
+        return True
 
-    for i, entry in enumerate(entries):
-        old_path = os.path.join(directory, entry)
-        new_name = f"{str(i + start).zfill(digits)} {re.sub(r'^[\d.\s]+', '', entry)}"  # Strip and add numbering
-        new_path = os.path.join(directory, new_name)
+    if journal_path is not None:
+        write_journal(journal_path, steps)
 
+    for directory, renames in steps:
         try:
-            os.rename(old_path, new_path)
-            print(f"Renamed: {entry} -> {new_name}")
+            move_step(directory, renames)
         except OSError as e:
-            print(f"Error renaming {entry}: {e}")
+            print(f"Error renaming entries of {directory}: {e}")
+            return False
+
+        for name, temp_name, new_name in renames:
+            print(f"Renamed: {os.path.join(directory, name)} -> {new_name}")
+
+    return True
+
+def undo_renames(journal_path, dry_run=False):
+    """
+    Reverts the renames recorded in a journal, parents first, and removes the journal.
+    Steps that were interrupted halfway are restored from their temporary names.
+    """
+    with open(journal_path, 'r', encoding='utf-8') as f:
+        journal = json.load(f)
+
+    if journal.get("version") != JOURNAL_VERSION:
+        raise ValueError(f"{journal_path}: unsupported journal version {journal.get('version')!r}")
+
+    for directory, renames in reversed(journal["steps"]):
+        moves = []
+        for name, temp_name, new_name in renames:
+            if os.path.lexists(os.path.join(directory, new_name)):
+                moves.append((new_name, temp_name, name))
+            elif os.path.lexists(os.path.join(directory, temp_name)):
+                # Interrupted between the two phases: the entry only needs its second rename.
+                if not dry_run:
+                    os.rename(os.path.join(directory, temp_name), os.path.join(directory, name))
+                print(f"Restored: {os.path.join(directory, name)}")
+
+        if dry_run:
+            for new_name, temp_name, name in moves:
+                print(f"Would restore: {os.path.join(directory, new_name)} -> {name}")
+            continue
+
+        move_step(directory, moves)
+        for new_name, temp_name, name in moves:
+            print(f"Restored: {os.path.join(directory, new_name)} -> {name}")
+
+    if not dry_run:
+        os.remove(journal_path)
+
+def rename_files(directory, start, digits, recursive=False, dry_run=False, journal_path=None):
+    """Renames files and subdirectories in a given directory with sequential numbers."""
+    return apply_plan(plan_renames(directory, start, digits, recursive), journal_path, dry_run)
 
 def main():
     parser = argparse.ArgumentParser(description="Renames files and subdirectories in a given directory with sequential numbers")
     parser.add_argument("-p", "--path", help="Path to directory to rename (default: './')", type=str, default=".")
     parser.add_argument("-s", "--start", help="Starting Number (default: 1)", default=1, type=int)
     parser.add_argument("-d", "--digits", help="Number of digits for numbering (default: 2)", default=2, type=int)
+    parser.add_argument("-r", "--recursive", help="Also number the entries of every subdirectory", action="store_true")
+    parser.add_argument("-n", "--dry-run", help="Print the renames without applying them", action="store_true")
+    parser.add_argument("-j", "--journal", help=f"Path to the journal of applied renames (default: '{JOURNAL_NAME}' in the directory)", type=str)
+    parser.add_argument("-u", "--undo", help="Revert the renames recorded in the journal", action="store_true")
     args = parser.parse_args()
 
     if not os.path.isdir(args.path):
         print(f"Error: '{args.path}' is not a valid directory.")
         sys.exit(1)
 
-    rename_files(args.path, args.start, args.digits)
+    journal_path = args.journal if args.journal else os.path.join(args.path, JOURNAL_NAME)
+
+    if args.undo:
+        try:
+            undo_renames(journal_path, args.dry_run)
+        except (OSError, ValueError) as e:
+            print(f"Error: Failed to undo renames from '{journal_path}': {e}")
+            sys.exit(1)
+        return
+
+    if not rename_files(args.path, args.start, args.digits, args.recursive, args.dry_run, journal_path):
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,234 @@
+import os
+import json
+import yaml
+from collections import namedtuple
+from types import MappingProxyType
+from markdown_utils.manifest import hash_file
+
+PLAN_CACHE_NAME = ".compile-plans.json"
+PLAN_CACHE_VERSION = 1
+
+# The libyaml loader is several times faster than the pure-Python one and parses order files the same way.
+SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# An order.yaml entry with its custom title and sub-order. order is a tuple of OrderEntry, or None
+# when the entry is a folder that lists all of its items.
+OrderEntry = namedtuple("OrderEntry", ["name", "title", "order"])
+
+# The entry for one folder of an order file: the custom title of the folder and its order.
+FolderPlan = namedtuple("FolderPlan", ["title", "order"])
+
+class OrderPlan:
+    """
+    An order file compiled into FolderPlans for every folder it names.
+    """
+    __slots__ = ("folders", "empty")
+
+    def __init__(self, folders, empty):
+        self.folders = MappingProxyType(folders)
+        self.empty = empty
+
+    def folder(self, name):
+        """
+        Returns the FolderPlan for a folder name, falling back to the "root" entry, or None.
+        """
+        plan = self.folders.get(name)
+        return plan if plan is not None else self.folders.get("root")
+
+def parse_order_item(item):
+    """
+    Returns the name, custom title and sub-order of an order.yaml entry.
+    """
+    sub_item_order = None
+    item_name = item
+    custom_title = None
+
+    if isinstance(item, dict):
+        item_name, item_value = next(iter(item.items()))
+        if isinstance(item_value, str):
+            custom_title = item_value
+        elif isinstance(item_value, list):
+            order_list = list()
+            for sub_item in item_value:
+                if isinstance(sub_item, dict) and 'order' in sub_item:
+                    sub_item_order = sub_item['order']
+                elif isinstance(sub_item, dict) and 'title' in sub_item:
+                    custom_title = sub_item['title']
+                elif isinstance(sub_item, str):
+                    order_list.append(sub_item)
+            if len(order_list) > 0 and sub_item_order == None:
+                sub_item_order = order_list
+
+    return item_name, custom_title, sub_item_order
+
+def compile_order(items):
+    """
+    Compiles a list of order.yaml entries into a tuple of OrderEntry. Compiled orders and None are returned as they are.
+    """
+    if items is None or isinstance(items, tuple):
+        return items
+
+    if not isinstance(items, list):
+        raise ValueError(f"An order must be a list of entries, not {type(items).__name__}: {items!r}")
+
+    entries = []
+    for item in items:
+        if isinstance(item, dict) and not item:
+            continue
+        if isinstance(item, (int, float)) and not isinstance(item, bool):
+            item = str(item)
+        if not isinstance(item, (str, dict)):
+            raise ValueError(f"An order entry must be a name or a mapping, not {type(item).__name__}: {item!r}")
+
+        item_name, custom_title, sub_item_order = parse_order_item(item)
+        entries.append(OrderEntry(str(item_name), custom_title, compile_order(sub_item_order)))
+
+    return tuple(entries)
+
+def compile_folder_plan(items):
+    title = None
+    item_order = items
+
+    for item in items:
+        if isinstance(item, dict):
+            if "order" in item:
+                item_order = item["order"]
+            if "title" in item:
+                title = item["title"]
+
+    return FolderPlan(title, compile_order(item_order))
+
+def compile_plan(config, source="order file"):
+    """
+    Compiles the parsed content of an order file into an OrderPlan, raising ValueError if it is malformed.
+    """
+    if not config:
+        return OrderPlan({}, True)
+
+    if not isinstance(config, dict):
+        raise ValueError(f"{source}: expected a mapping of folder names to orders, not {type(config).__name__}")
+
+    folders = {}
+    for name, items in config.items():
+        if items is None:
+            continue
+        if not isinstance(items, list):
+            raise ValueError(f"{source}: the order of '{name}' must be a list, not {type(items).__name__}")
+        try:
+            folders[str(name)] = compile_folder_plan(items)
+        except ValueError as e:
+            raise ValueError(f"{source}: {e}") from None
+
+    return OrderPlan(folders, False)
+
+def load_yaml(path):
+    with open(path, 'r') as f:
+        return yaml.load(f, Loader=SafeLoader)
+
+def file_signature(path):
+    st = os.stat(path)
+    return [st.st_mtime_ns, st.st_size]
+
+class PlanCache:
+    """
+    Keeps parsed order and modification files, in memory and in an optional cache file.
+
+    Entries are validated by modification time and size, and by content hash when only the
+    modification time changed, so warm runs do not parse YAML at all. Documents that do not
+    survive a JSON round trip unchanged are only cached in memory.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.documents = {}
+        self.plans = {}
+        self.changed = False
+        self.load()
+
+    def load(self):
+        if self.path is None:
+            return
+
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        if isinstance(data, dict) and data.get("version") == PLAN_CACHE_VERSION:
+            self.documents = data.get("documents", {})
+
+    def save(self):
+        if self.path is None or not self.changed:
+            return
+
+        documents = {path: record for path, record in self.documents.items() if record.get("persist", True)}
+
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({"version": PLAN_CACHE_VERSION, "documents": documents}, f, separators=(',', ':'))
+        os.replace(temp_path, self.path)
+        self.changed = False
+
+    def document(self, path):
+        """
+        Returns the parsed content of a YAML file, parsing it only if it changed since it was cached.
+        """
+        path = os.path.abspath(path)
+        signature = file_signature(path)
+        record = self.documents.get(path)
+
+        if record is not None:
+            if record["signature"][:2] == signature:
+                return record["data"]
+
+            digest = hash_file(path)
+            if record["signature"][2] == digest:
+                record["signature"] = signature + [digest]
+                self.changed = self.changed or record.get("persist", True)
+                return record["data"]
+        else:
+            digest = hash_file(path)
+
+        data = load_yaml(path)
+        persist = is_json_safe(data)
+        self.documents[path] = {"signature": signature + [digest], "data": data, "persist": persist}
+        self.plans.pop(path, None)
+        self.changed = self.changed or persist
+
+        return data
+
+    def plan(self, path):
+        """
+        Returns the OrderPlan of an order file.
+        """
+        data = self.document(path)
+
+        path = os.path.abspath(path)
+        cached = self.plans.get(path)
+        if cached is not None and cached[0] is data:
+            return cached[1]
+
+        plan = compile_plan(data, path)
+        self.plans[path] = (data, plan)
+
+        return plan
+
+    def invalidate(self, path=None):
+        """
+        Forgets the cached content of path, or of every file if no path is given.
+        """
+        if path is None:
+            self.documents.clear()
+            self.plans.clear()
+        else:
+            path = os.path.abspath(path)
+            self.documents.pop(path, None)
+            self.plans.pop(path, None)
+        self.changed = self.path is not None
+
+def is_json_safe(data):
+    try:
+        return json.loads(json.dumps(data)) == data
+    except (TypeError, ValueError):
+        return False
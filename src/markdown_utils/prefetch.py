@@ -0,0 +1,121 @@
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_WORKERS = 8
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+def encoded_size(content):
+    """
+    Returns the size of content in UTF-8 bytes, without encoding it when it is ASCII.
+    """
+    return len(content) if content.isascii() else len(content.encode('utf-8'))
+
+class Prefetcher:
+    """
+    Reads files ahead of a compile on a bounded pool of threads, in the order they will be needed.
+
+    schedule queues the files of the next output in document order, and take hands out their
+    content as the compile reaches them, waiting for reads still in flight. Files found through
+    discover, e.g. include targets, jump to the front of the queue once the file naming them has
+    been read. New reads stop while the content read but not yet taken reaches max_bytes, counted
+    in UTF-8 bytes, so memory stays bounded by max_bytes plus the files in flight. Every path is
+    read ahead at most once; take returns None for anything that was not, and the caller reads it
+    itself.
+    """
+
+    def __init__(self, read, discover=None, workers=DEFAULT_WORKERS, max_bytes=DEFAULT_MAX_BYTES):
+        self.read = read
+        self.discover = discover
+        self.workers = max(1, workers)
+        self.max_bytes = max_bytes
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="prefetch")
+        self.lock = threading.Lock()
+        self.queue = deque()
+        self.queued = set()
+        self.seen = set()
+        self.futures = {}
+        self.sizes = {}
+        self.held = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def schedule(self, paths):
+        """
+        Queues paths for reading, dropping content a previous schedule read but nobody took.
+        """
+        with self.lock:
+            for path, future in list(self.futures.items()):
+                if future.cancel():
+                    del self.futures[path]
+                elif future.done():
+                    del self.futures[path]
+                    self.held -= self.sizes.pop(path, 0)
+
+            self.queue.clear()
+            self.queued.clear()
+            for path in paths:
+                if path not in self.seen:
+                    self.seen.add(path)
+                    self.queue.append(path)
+                    self.queued.add(path)
+
+            self.fill()
+
+    def fill(self):
+        # Called with the lock held. Keeps enough reads queued in the pool for every worker to stay busy.
+        while self.queue and len(self.futures) < self.workers * 2 and self.held < self.max_bytes:
+            path = self.queue.popleft()
+            if path in self.queued:
+                self.queued.discard(path)
+                self.futures[path] = self.executor.submit(self.load, path)
+
+    def load(self, path):
+        content = self.read(path)
+        size = encoded_size(content)
+
+        with self.lock:
+            self.sizes[path] = size
+            self.held += size
+
+            if self.discover is not None and content:
+                for discovered in reversed(self.discover(path, content)):
+                    if discovered not in self.seen:
+                        self.seen.add(discovered)
+                        self.queue.appendleft(discovered)
+                        self.queued.add(discovered)
+
+            self.fill()
+
+        return content
+
+    def take(self, path):
+        """
+        Returns the content read ahead for path, or None if it was not read ahead.
+        """
+        with self.lock:
+            future = self.futures.pop(path, None)
+            if future is None:
+                # The compile overtook the queue, so reading path ahead would only waste memory.
+                self.queued.discard(path)
+                return None
+
+        content = future.result()
+
+        with self.lock:
+            self.held -= self.sizes.pop(path, 0)
+            self.fill()
+
+        return content
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.futures.clear()
+        self.sizes.clear()
+        self.queue.clear()
+        self.queued.clear()
+        self.held = 0
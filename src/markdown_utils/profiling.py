@@ -0,0 +1,254 @@
+import os
+import json
+import time
+import builtins
+import functools
+
+from markdown_utils import compile_markdown, order_plan
+
+# Captured before any patching, so the profiler's own bookkeeping is not counted as filesystem calls.
+os_stat = os.stat
+
+FS_FUNCTIONS = ("stat", "lstat", "scandir", "listdir", "open", "replace", "remove", "makedirs")
+
+class Profiler:
+    """
+    Records a per-file and per-stage trace of a compile run.
+
+    While installed, the profiler wraps the stage functions of compile_markdown, the YAML loader and
+    the os functions that touch the filesystem, and restores them when uninstalled. Nothing is wrapped
+    when profiling is off, so an unprofiled run pays nothing for it. Compiles have to run in this
+    process to be recorded.
+
+    Every source file and include gets the bytes and time spent reading it, the time spent expanding
+    its includes and adjusting its headings and the bytes it contributed to the output. Every output
+    gets its total time and size.
+
+    module is the compile_markdown module to instrument, which differs from the imported one when
+    it runs as __main__.
+    """
+
+    def __init__(self, module=compile_markdown):
+        self.module = module
+        self.start = time.perf_counter()
+        self.events = []
+        self.files = {}
+        self.outputs = {}
+        self.fs_calls = dict.fromkeys(FS_FUNCTIONS, 0)
+        self.yaml_loads = 0
+        self.stack = []
+        self.patches = []
+
+    def __enter__(self):
+        self.install()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.uninstall()
+
+    def now(self):
+        return time.perf_counter() - self.start
+
+    def file_record(self, path, kind):
+        record = self.files.get(path)
+        if record is None:
+            record = self.files[path] = {
+                "kind": kind,
+                "reads": 0,
+                "bytes_read": 0,
+                "read_time": 0.0,
+                "include_time": 0.0,
+                "heading_time": 0.0,
+                "output_bytes": 0,
+            }
+        return record
+
+    def add_event(self, name, category, start, end, **args):
+        self.events.append({
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": round(start * 1e6, 3),
+            "dur": round((end - start) * 1e6, 3),
+            "pid": os.getpid(),
+            "tid": 0,
+            "args": args,
+        })
+
+    def patch(self, owner, name, make_wrapper):
+        had_attribute = name in vars(owner)
+        original = getattr(owner, name)
+        setattr(owner, name, functools.wraps(original)(make_wrapper(original)))
+        self.patches.append((owner, name, original, had_attribute))
+
+    def install(self):
+        self.patch(self.module, "read_file_safely", self.wrap_read)
+        self.patch(self.module, "get_body_for_path", self.wrap_body)
+        self.patch(self.module, "process_includes", self.wrap_process_includes)
+        self.patch(self.module, "expand_include", self.wrap_expand_include)
+        self.patch(self.module, "adjust_headings", self.wrap_adjust_headings)
+        self.patch(self.module, "render_file_entry", self.wrap_render_file_entry)
+        self.patch(self.module, "compile_directory_to_file", self.wrap_compile)
+        self.patch(order_plan, "load_yaml", self.wrap_yaml_load)
+
+        # compile_markdown opens files through the builtin, so shadow it in that module only.
+        self.module.open = self.wrap_fs_call("open", builtins.open)
+        self.patches.append((self.module, "open", builtins.open, False))
+
+        for name in FS_FUNCTIONS:
+            self.patch(os, name, functools.partial(self.wrap_fs_call, name))
+
+    def uninstall(self):
+        while self.patches:
+            owner, name, original, had_attribute = self.patches.pop()
+            if had_attribute:
+                setattr(owner, name, original)
+            else:
+                delattr(owner, name)
+
+    def wrap_fs_call(self, name, original):
+        def wrapper(*args, **kwargs):
+            self.fs_calls[name] += 1
+            return original(*args, **kwargs)
+        return wrapper
+
+    def wrap_yaml_load(self, original):
+        def wrapper(path):
+            start = self.now()
+            try:
+                return original(path)
+            finally:
+                self.yaml_loads += 1
+                self.add_event(os.path.abspath(path), "yaml", start, self.now())
+        return wrapper
+
+    def wrap_read(self, original):
+        def wrapper(file_path):
+            start = self.now()
+            content = original(file_path)
+            end = self.now()
+
+            path = os.path.abspath(file_path)
+            record = self.file_record(path, "file")
+            size = len(content.encode('utf-8'))
+            record["reads"] += 1
+            record["bytes_read"] += size
+            record["read_time"] += end - start
+            self.add_event(path, "read", start, end, bytes=size)
+
+            return content
+        return wrapper
+
+    def wrap_body(self, original):
+        def wrapper(item_path, *args, **kwargs):
+            path = os.path.abspath(item_path)
+            self.file_record(path, "file")
+            self.stack.append(path)
+            start = self.now()
+            try:
+                return original(item_path, *args, **kwargs)
+            finally:
+                self.stack.pop()
+                self.add_event(path, "file", start, self.now())
+        return wrapper
+
+    def wrap_process_includes(self, original):
+        def wrapper(*args, **kwargs):
+            start = self.now()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                if self.stack:
+                    self.file_record(self.stack[-1], "file")["include_time"] += self.now() - start
+        return wrapper
+
+    def wrap_expand_include(self, original):
+        def wrapper(include_path, *args, **kwargs):
+            path = os.path.abspath(include_path)
+            record = self.file_record(path, "include")
+            self.stack.append(path)
+            start = self.now()
+            try:
+                result = original(include_path, *args, **kwargs)
+            finally:
+                self.stack.pop()
+                end = self.now()
+                record["include_time"] += end - start
+                self.add_event(path, "include", start, end)
+
+            record["output_bytes"] += len(result[0].encode('utf-8'))
+            return result
+        return wrapper
+
+    def wrap_adjust_headings(self, original):
+        def wrapper(*args, **kwargs):
+            start = self.now()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                if self.stack:
+                    end = self.now()
+                    self.file_record(self.stack[-1], "file")["heading_time"] += end - start
+                    self.add_event(self.stack[-1], "headings", start, end)
+        return wrapper
+
+    def wrap_render_file_entry(self, original):
+        def wrapper(entry, *args, **kwargs):
+            path = os.path.abspath(entry[1])
+            self.stack.append(path)
+            try:
+                parts = original(entry, *args, **kwargs)
+            finally:
+                self.stack.pop()
+
+            self.file_record(path, "file")["output_bytes"] += sum(len(part.encode('utf-8')) for part in parts)
+            return parts
+        return wrapper
+
+    def wrap_compile(self, original):
+        def wrapper(root_folder, output, *args, **kwargs):
+            output_name = kwargs.get("output_name")
+            keep_numbers = kwargs.get("keep_numbers", False)
+            output_file = os.path.abspath(self.module.get_output_file(root_folder, output, keep_numbers, output_name))
+
+            start = self.now()
+            written = original(root_folder, output, *args, **kwargs)
+            end = self.now()
+
+            try:
+                size = os_stat(output_file).st_size
+            except OSError:
+                size = None
+
+            self.outputs[output_file] = {
+                "folder": os.path.abspath(root_folder),
+                "time": end - start,
+                "bytes": size,
+                "written": written,
+            }
+            self.add_event(output_file, "output", start, end, written=written, bytes=size)
+
+            return written
+        return wrapper
+
+    def report(self):
+        return {
+            "total_time": self.now(),
+            "outputs": self.outputs,
+            "files": self.files,
+            "fs_calls": self.fs_calls,
+            "yaml_loads": self.yaml_loads,
+        }
+
+    def write(self, path):
+        """
+        Writes the report to path and the Chrome trace (chrome://tracing, Perfetto) next to it as <name>.trace.json.
+        """
+        with builtins.open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, indent=2)
+
+        trace_path = f"{os.path.splitext(path)[0]}.trace.json"
+        with builtins.open(trace_path, 'w', encoding='utf-8') as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+
+        return trace_path
@@ -1,6 +1,20 @@
 import os
+import sys
 import argparse
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+SYMBOLS = re.compile(r'[^a-zA-Z0-9._-]')
+
+def clean_name(filename):
+    """
+    Returns filename with everything except alphanumeric characters, dots, underscores, and hyphens removed.
+    """
+    new_filename = SYMBOLS.sub('', filename)
+
+    # Ensure the filename is not empty after stripping
+    return new_filename if new_filename else "renamed_item"
 
 def rename_path(path, dry_run):
     """
@@ -8,70 +22,125 @@ def rename_path(path, dry_run):
     Returns the new filename (not the full path).
     """
     directory, filename = os.path.split(path)
-
-    # Keep only alphanumeric characters, dots, underscores, and hyphens
-    new_filename = re.sub(r'[^a-zA-Z0-9._-]', '', filename)
-
-    # Ensure the filename is not empty after stripping
-    if not new_filename:
-        new_filename = "renamed_item"
-
-    full_new_path = os.path.join(directory, new_filename)
+    new_filename = clean_name(filename)
 
     # Perform rename if names differ and not in dry_run mode
     if filename != new_filename:
         if not dry_run:
             try:
-                os.rename(path, full_new_path)
+                os.rename(path, os.path.join(directory, new_filename))
             except OSError as e:
                 print(f"Error renaming {path}: {e}")
                 return filename
 
     return new_filename
 
-def process_folder(path, recursive, dry_run, absolute):
-
-    if not os.path.exists(path):
-        return ""
-
-    # output_string accumulates the log of changes
-    output_string = ""
-
-    # List directory contents
-    try:
-        items = os.listdir(path)
-    except OSError as e:
-        print(f"Error reading directory {path}: {e}")
-        return ""
-
-    for item in items:
-        item_path = os.path.join(path, item)
-
-        # Get the new cleaned filename
-        new_filename = rename_path(item_path, dry_run=dry_run)
-
-        # Construct the full path for the new name
-        new_full_path = os.path.join(path, new_filename)
-
-        # Prepare strings for logging
-        display_old = os.path.abspath(item_path) if absolute else item_path
-        display_new = os.path.abspath(new_full_path) if absolute else new_full_path
+def scan_subtree(path, recursive):
+    """
+    Lists path and, if recursive, every directory below it with one os.scandir call each.
+    Returns (directory, [(name, is_dir), ...]) pairs with every directory before its subdirectories.
+    """
+    folders = []
+    pending = [path]
 
-        log_entry = f"{display_old} -> {display_new}"
-        output_string = "\n".join([output_string, log_entry]) if output_string else log_entry
+    while pending:
+        directory = pending.pop()
+        try:
+            with os.scandir(directory) as it:
+                items = [(entry.name, entry.is_dir(follow_symlinks=False)) for entry in it]
+        except OSError as e:
+            print(f"Error reading directory {directory}: {e}")
+            continue
 
-        # Recursion logic
-        # Must check if the *new* path is a directory, as the old path may no longer exist
-        target_for_recursion = new_full_path if not dry_run else item_path
+        folders.append((directory, items))
+        if recursive:
+            pending.extend(os.path.join(directory, name) for name, is_dir in reversed(items) if is_dir)
 
-        if recursive and os.path.isdir(target_for_recursion):
-            # If we renamed the directory, we must recurse into the new name
-            child_list = process_folder(target_for_recursion, recursive=recursive, dry_run=dry_run, absolute=absolute)
+    return folders
 
-            if child_list:
-                output_string = f"{output_string}\n{child_list}"
+def find_collisions(folders):
+    """
+    Returns (directory, new_name, names) for every set of entries of a directory that would end up with the same name.
+    """
+    collisions = []
+    for directory, items in folders:
+        targets = {}
+        for name, is_dir in items:
+            targets.setdefault(clean_name(name), []).append(name)
+        for new_name, names in targets.items():
+            if len(names) > 1:
+                collisions.append((directory, new_name, sorted(names)))
+
+    return collisions
+
+def process_folder(path, recursive, dry_run, absolute, write=print, jobs=8):
+    """
+    Renames every entry of path, and of its subdirectories if recursive, and passes one log line per entry to write.
 
-    return output_string
+    The whole tree is listed before anything is renamed. If two entries of a directory would get the
+    same name, nothing is renamed and ValueError is raised. Entries are renamed bottom-up, so a
+    directory keeps its name until everything inside it is done, and the subtrees of the top-level
+    directories are processed in parallel. Returns the number of logged entries.
+    """
+    if not os.path.exists(path):
+        return 0
+
+    top_level = scan_subtree(path, recursive=False)
+    if not top_level:
+        return 0
+
+    subtrees = []
+    if recursive:
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+            subtrees = list(executor.map(
+                lambda name: scan_subtree(os.path.join(path, name), recursive=True),
+                [name for name, is_dir in top_level[0][1] if is_dir]
+            ))
+
+    collisions = find_collisions(top_level + [folder for subtree in subtrees for folder in subtree])
+    if collisions:
+        details = "\n".join(f"  {os.path.join(directory, new_name)} <- {', '.join(names)}" for directory, new_name, names in collisions)
+        raise ValueError(f"{len(collisions)} renamed items would collide:\n{details}")
+
+    # Log lines show the path each directory will have once its parents are renamed, as the renames happen bottom-up.
+    final_paths = {path: path}
+    for directory, items in top_level + [folder for subtree in subtrees for folder in subtree]:
+        for name, is_dir in items:
+            if is_dir:
+                final_paths[os.path.join(directory, name)] = os.path.join(final_paths[directory], clean_name(name))
+
+    lock = threading.Lock()
+    count = 0
+
+    def rename_items(directory, items):
+        nonlocal count
+        display_dir = directory if dry_run else final_paths[directory]
+        lines = []
+        for name, is_dir in items:
+            new_filename = rename_path(os.path.join(directory, name), dry_run=dry_run)
+
+            display_old = os.path.join(display_dir, name)
+            display_new = os.path.join(display_dir, new_filename)
+            if absolute:
+                display_old, display_new = os.path.abspath(display_old), os.path.abspath(display_new)
+            lines.append(f"{display_old} -> {display_new}")
+
+        with lock:
+            for line in lines:
+                write(line)
+            count += len(lines)
+
+    def rename_subtree(folders):
+        for directory, items in reversed(folders):
+            rename_items(directory, items)
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        for future in [executor.submit(rename_subtree, subtree) for subtree in subtrees]:
+            future.result()
+
+    rename_items(*top_level[0])
+
+    return count
 
 def main():
     parser = argparse.ArgumentParser(description="Rename files and directories to remove special characters.")
@@ -81,6 +150,7 @@ def main():
     parser.add_argument("-t", "--target", help="Path to the target directory (default: current directory)")
     parser.add_argument("-d", "--dry-run", action="store_true", help="Print changes without saving")
     parser.add_argument("-s", "--skip-write", action="store_true", help="Do not write changes to file")
+    parser.add_argument("-j", "--jobs", type=int, default=8, help="Number of subtrees processed in parallel (default: 8)")
 
     args = parser.parse_args()
 
@@ -92,16 +162,6 @@ def main():
     dry_run = args.dry_run
     output_file = "renamed.txt" if args.output is None else args.output
 
-    changes = process_folder(target, recursive=recursive, dry_run=dry_run, absolute=absolute)
-
-    if changes:
-        print(changes)
-    else:
-        print("No items found or no changes needed.")
-
-    if skip_write:
-        return
-
     # Handle output file path logic
     if not os.path.exists(output_file):
         # If output is just a filename or doesn't exist, put it in cwd or use as is
@@ -113,13 +173,38 @@ def main():
 
     output_file = os.path.abspath(output_file)
 
-    if changes:
+    log = None
+
+    def write(line):
+        nonlocal log, skip_write
+        print(line)
+        if skip_write:
+            return
+
+        # The log is opened with the first entry, after the tree was listed, so it never shows up in its own listing.
         try:
-            with open(output_file, 'w') as f:
-                f.write(changes)
-            print(f"\nLog saved to: {output_file}")
+            if log is None:
+                log = open(output_file, 'w')
+                log.write(line)
+            else:
+                log.write(f"\n{line}")
         except IOError as e:
             print(f"Error writing to log file: {e}")
+            skip_write = True
+
+    try:
+        changes = process_folder(target, recursive=recursive, dry_run=dry_run, absolute=absolute, write=write, jobs=args.jobs)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    finally:
+        if log is not None:
+            log.close()
+
+    if not changes:
+        print("No items found or no changes needed.")
+    elif not skip_write:
+        print(f"\nLog saved to: {output_file}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,223 @@
+import os
+import sys
+import hashlib
+import argparse
+import threading
+import urllib.parse
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import yaml
+
+from markdown_utils.compiler import Compiler
+from markdown_utils.watch import InotifyWatcher, create_watcher
+
+class PreviewCache:
+    """
+    Compiled documents of the directories served so far, with the paths each one was built from.
+
+    A change to a path drops every document that read it or lists the directory it is in,
+    so unchanged sections keep their cached text and ETag. The directories of the paths a document
+    was built from are added to watcher, which catches includes outside the served tree.
+    """
+
+    def __init__(self, compiler, watcher=None):
+        self.compiler = compiler
+        self.watcher = watcher
+        self.documents = {}
+        self.lock = threading.Lock()
+
+    def get(self, folder):
+        """
+        Returns the compiled text of folder as UTF-8 bytes and its ETag.
+        """
+        with self.lock:
+            document = self.documents.get(folder)
+            if document is None:
+                document = self.build(folder)
+                self.documents[folder] = document
+                self.watch(document[2])
+            return document[0], document[1]
+
+    def build(self, folder):
+        skeleton = []
+        body = "".join(self.compiler.iter_compile(folder, skeleton=skeleton)).encode('utf-8')
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+
+        options = self.compiler.document_options(folder)
+        dependencies = {folder} | {os.path.abspath(path) for path in (options["yaml_path"], options["mod_path"]) if path}
+        collect_dependencies(skeleton, dependencies)
+
+        return body, etag, dependencies
+
+    def watch(self, dependencies):
+        # Like in watch mode, only inotify watches directories added after it started.
+        if isinstance(self.watcher, InotifyWatcher):
+            for directory in {os.path.dirname(path) for path in dependencies}:
+                if os.path.isdir(directory):
+                    self.watcher.add_watch(directory)
+
+    def invalidate(self, paths):
+        paths = {os.path.abspath(path) for path in paths}
+        if not paths:
+            return
+
+        with self.lock:
+            self.compiler.invalidate(*paths)
+            for folder, document in list(self.documents.items()):
+                dependencies = document[2]
+                if any(path in dependencies or os.path.dirname(path) in dependencies for path in paths):
+                    del self.documents[folder]
+
+def collect_dependencies(skeleton, dependencies):
+    for entry in skeleton:
+        dependencies.add(entry[1])
+        if entry[0] == "file":
+            dependencies.update(entry[3])
+        elif entry[0] == "folder":
+            collect_dependencies(entry[3], dependencies)
+
+def resolve_folder(source, url_path):
+    """
+    Returns the source directory a request path names, or None if it is not a directory inside source.
+    """
+    relative = urllib.parse.unquote(urllib.parse.urlsplit(url_path).path).strip("/")
+    folder = os.path.realpath(os.path.join(source, relative))
+
+    if folder != source and not folder.startswith(source.rstrip(os.sep) + os.sep):
+        return None
+
+    return folder if os.path.isdir(folder) else None
+
+def make_handler(source, cache):
+    class PreviewHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.respond(send_body=True)
+
+        def do_HEAD(self):
+            self.respond(send_body=False)
+
+        def respond(self, send_body):
+            folder = resolve_folder(source, self.path)
+            if folder is None:
+                self.send_error(HTTPStatus.NOT_FOUND, "No such directory in the source tree")
+                return
+
+            try:
+                body, etag = cache.get(folder)
+            except (OSError, ValueError, yaml.YAMLError) as e:
+                self.send_error(HTTPStatus.INTERNAL_SERVER_ERROR, f"Failed to compile {folder}: {e}")
+                return
+
+            if etag in [tag.strip() for tag in self.headers.get("If-None-Match", "").split(",")]:
+                self.send_response(HTTPStatus.NOT_MODIFIED)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+
+            self.send_response(HTTPStatus.OK)
+            self.send_header("Content-Type", "text/plain; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+
+            if send_body:
+                self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            sys.stderr.write(f"{self.address_string()} - {format % args}\n")
+
+    return PreviewHandler
+
+def watch_changes(watcher, cache):
+    while True:
+        cache.invalidate(watcher.wait(None))
+
+def serve(source, compiler, host="127.0.0.1", port=8000, polling=False):
+    """
+    Serves the compiled document of every directory in source until interrupted.
+
+    Documents are compiled on the first request and cached until a file they were built from changes.
+    """
+    source = os.path.realpath(source)
+
+    directories = {source} | {os.path.dirname(os.path.abspath(path)) for path in (compiler.yaml_path, compiler.mod_path) if path}
+    watcher = create_watcher({directory for directory in directories if os.path.isdir(directory)}, set(), polling=polling)
+    cache = PreviewCache(compiler, watcher)
+
+    threading.Thread(target=watch_changes, args=(watcher, cache), daemon=True).start()
+
+    server = ThreadingHTTPServer((host, port), make_handler(source, cache))
+    print(f"Serving {source} on http://{host}:{server.server_address[1]}/ (press Ctrl+C to stop)")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="compile-markdown serve", description="Serve compiled Markdown for any directory of the source tree over HTTP.")
+    parser.add_argument("-a", "--all", action="store_true", default=None, help="Include all markdown files, even those not in the YAML file")
+    parser.add_argument("-c", "--config", help="Path to the YAML config file (default: compile.yaml in source directory)")
+    parser.add_argument("-i", "--ignore-frontmatter", action="store_true", default=None, help="Do not add YAML frontmatter")
+    parser.add_argument("-k", "--keep-numbers", action="store_true", default=None, help="Keep leading numbers in titles")
+    parser.add_argument("-m", "--mod", help="Path to the YAML modification file")
+    parser.add_argument("-s", "--source", help="Path to the source directory (default: current working directory)")
+    parser.add_argument("-y", "--yaml", help="Path to the YAML order file (default: order.yaml in directory to compile)")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on (default: 8000)")
+    parser.add_argument("--poll", action="store_true", default=None, help="Poll for changes instead of using inotify")
+
+    args = parser.parse_args(argv)
+
+    include_all = args.all
+    keep_numbers = args.keep_numbers
+    source = args.source
+    yaml_path = args.yaml
+    mod_path = args.mod
+    ignore_frontmatter = args.ignore_frontmatter
+    poll = args.poll
+
+    config_path = args.config or "compile.yaml"
+    config = None
+    if os.path.exists(config_path):
+        with open(config_path, 'r') as f:
+            config = yaml.safe_load(f)
+
+    if config:
+        if "include_all" in config:
+            include_all = include_all if include_all else config.get("include_all")
+        if "keep_numbers" in config:
+            keep_numbers = keep_numbers if keep_numbers else config.get("keep_numbers")
+        if "source" in config:
+            source = source if source else config.get("source")
+        if "yaml_path" in config:
+            yaml_path = yaml_path if yaml_path else config.get("yaml_path")
+        if "modification_path" in config:
+            mod_path = mod_path if mod_path else config.get("modification_path")
+        if "ignore_frontmatter" in config:
+            ignore_frontmatter = ignore_frontmatter if ignore_frontmatter else config.get("ignore_frontmatter")
+        if "poll" in config:
+            poll = poll if poll else config.get("poll")
+
+    include_all = True if include_all is None else include_all
+    keep_numbers = False if keep_numbers is None else keep_numbers
+    ignore_frontmatter = False if ignore_frontmatter is None else ignore_frontmatter
+    poll = False if poll is None else poll
+    source = os.getcwd() if source is None else source
+
+    compiler = Compiler(
+        yaml_path=yaml_path,
+        include_all=include_all,
+        keep_numbers=keep_numbers,
+        mod_path=mod_path,
+        ignore_frontmatter=ignore_frontmatter
+    )
+
+    serve(source, compiler, args.host, args.port, poll)
+
+if __name__ == "__main__":
+    main()
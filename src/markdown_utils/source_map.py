@@ -0,0 +1,165 @@
+import os
+import json
+import bisect
+
+SOURCE_MAP_SUFFIX = ".map.json"
+SOURCE_MAP_VERSION = 1
+
+def get_source_map_path(output_file):
+    return f"{output_file}{SOURCE_MAP_SUFFIX}"
+
+class SourceMap:
+    """
+    Maps the byte and line ranges of a compiled output back to the folders and files they came from.
+
+    Entries are dicts in document order with the kind ("header", "folder" or "file"), the source
+    path, the depth it was rendered at, the index of the enclosing folder entry as parent (None at
+    the top) and its ranges: bytes as [start, end) offsets into the UTF-8 output and lines as
+    [start, end) line numbers counted from 1. A folder range covers its heading and everything
+    inside it. File entries also hold the paths they include and whether they were rendered as
+    the first file of their folder, which is everything needed to render them again on their own.
+
+    While an output is written, track counts the parts passing through it and render_fragment
+    opens and closes an entry around every folder and file.
+    """
+
+    def __init__(self, entries=None):
+        self.entries = [] if entries is None else entries
+        self.offset = 0
+        self.line = 1
+        self.open_entries = []
+
+    def advance(self, text):
+        self.offset += len(text.encode('utf-8'))
+        self.line += text.count('\n')
+
+    def track(self, parts):
+        """
+        Yields parts unchanged, advancing the current byte offset and line past each one.
+        """
+        for part in parts:
+            self.advance(part)
+            yield part
+
+    def add(self, kind, path, depth, text, **fields):
+        """
+        Adds an entry covering text, which is written at the current position without passing through track.
+        """
+        self.open(kind, path, depth, **fields)
+        self.advance(text)
+        self.close()
+
+    def open(self, kind, path, depth, **fields):
+        """
+        Starts an entry at the current position, inside the innermost open entry, and returns its index.
+        """
+        entry = {
+            "kind": kind,
+            "path": path,
+            "depth": depth,
+            "parent": self.open_entries[-1] if self.open_entries else None,
+            "bytes": [self.offset, self.offset],
+            "lines": [self.line, self.line],
+        }
+        entry.update(fields)
+
+        self.entries.append(entry)
+        self.open_entries.append(len(self.entries) - 1)
+
+        return len(self.entries) - 1
+
+    def close(self):
+        """
+        Ends the innermost open entry at the current position.
+        """
+        entry = self.entries[self.open_entries.pop()]
+        entry["bytes"][1] = self.offset
+        entry["lines"][1] = self.line
+
+    def affected(self, paths):
+        """
+        Returns the indices of the file entries whose file or includes are in paths.
+        """
+        return [
+            i for i, entry in enumerate(self.entries)
+            if entry["kind"] == "file" and (entry["path"] in paths or not paths.isdisjoint(entry["includes"]))
+        ]
+
+    def resize(self, index, size, line_count):
+        """
+        Gives entry index a new size in bytes and lines, moving every later entry and growing its enclosing folders.
+        """
+        entry = self.entries[index]
+        byte_delta = size - (entry["bytes"][1] - entry["bytes"][0])
+        line_delta = line_count - (entry["lines"][1] - entry["lines"][0])
+        if not byte_delta and not line_delta:
+            return
+
+        entry["bytes"][1] += byte_delta
+        entry["lines"][1] += line_delta
+
+        parent = entry["parent"]
+        while parent is not None:
+            self.entries[parent]["bytes"][1] += byte_delta
+            self.entries[parent]["lines"][1] += line_delta
+            parent = self.entries[parent]["parent"]
+
+        for later in self.entries[index + 1:]:
+            later["bytes"][0] += byte_delta
+            later["bytes"][1] += byte_delta
+            later["lines"][0] += line_delta
+            later["lines"][1] += line_delta
+
+    def find_line(self, line):
+        """
+        Returns the innermost entry covering an output line, or None.
+        """
+        # Entries start in document order and nest like the folders, so the last entry starting
+        # at or before line that still covers it is the innermost one.
+        starts = [entry["lines"][0] for entry in self.entries]
+
+        for i in range(bisect.bisect_right(starts, line) - 1, -1, -1):
+            entry = self.entries[i]
+            if line < entry["lines"][1]:
+                return entry
+
+        return None
+
+    def save(self, path, root_folder, options, output_signature):
+        """
+        Writes the map next to its output, with the compile options and the output signature it is valid for.
+        """
+        data = {
+            "version": SOURCE_MAP_VERSION,
+            "folder": os.path.abspath(root_folder),
+            "options": options,
+            "output": output_signature,
+            "entries": self.entries,
+        }
+
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path, root_folder, options, output_signature):
+        """
+        Returns the map saved at path, or None if there is none or it was saved for other options or another state of the output.
+        """
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if (
+            not isinstance(data, dict)
+            or data.get("version") != SOURCE_MAP_VERSION
+            or data.get("folder") != os.path.abspath(root_folder)
+            or data.get("options") != options
+            or data.get("output") != output_signature
+        ):
+            return None
+
+        return cls(data["entries"])
@@ -0,0 +1,141 @@
+import os
+
+MARKER_FILES = (".no_compile", ".end_compile", ".no-headings")
+
+def is_root(path):
+    path = os.path.abspath(path)
+    return os.path.dirname(path) == path
+
+class IndexedDirectory:
+    __slots__ = ("entries", "names", "markers")
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.names = sorted(entries)
+        self.markers = frozenset(name for name in MARKER_FILES if name in entries)
+
+class TreeIndex:
+    """
+    Snapshot of the directories a compile run looks at, built with one os.scandir call per directory.
+
+    Directories are listed the first time something inside them is queried and never again for the
+    lifetime of the index. Entry types come from the scan itself and sizes and modification times are
+    cached on the DirEntry objects, so repeated existence, type and marker checks cost no syscalls.
+    Create a new index for every run, since it does not notice later changes on disk.
+
+    prefetcher is an optional Prefetcher that reads the files of the run ahead of the compile.
+    """
+
+    def __init__(self, prefetcher=None):
+        self.directories = {}
+        self.prefetcher = prefetcher
+
+    def scan(self, directory):
+        if directory not in self.directories:
+            directory = os.path.abspath(directory)
+        if directory in self.directories:
+            return self.directories[directory]
+
+        try:
+            with os.scandir(directory) as it:
+                indexed = IndexedDirectory({entry.name: entry for entry in it})
+        except OSError:
+            indexed = None
+
+        self.directories[directory] = indexed
+        return indexed
+
+    def entry(self, path):
+        """
+        Returns the DirEntry for path, or None if it does not exist. The filesystem root has no
+        entry and is looked up directly.
+        """
+        parent, name = os.path.split(path)
+        indexed = self.directories.get(parent) if name not in ("", ".", "..") else None
+
+        if indexed is None:
+            parent, name = os.path.split(os.path.abspath(path))
+            if not name:
+                return None
+            indexed = self.scan(parent)
+
+        return indexed.entries.get(name) if indexed is not None else None
+
+    def exists(self, path):
+        entry = self.entry(path)
+        if entry is None:
+            return is_root(path) and os.path.exists(path)
+
+        if entry.is_symlink():
+            try:
+                entry.stat()
+            except OSError:
+                return False
+
+        return True
+
+    def is_dir(self, path):
+        entry = self.entry(path)
+        if entry is None:
+            return is_root(path) and os.path.isdir(path)
+
+        try:
+            return entry.is_dir()
+        except OSError:
+            return False
+
+    def is_file(self, path):
+        entry = self.entry(path)
+        if entry is None:
+            return False
+
+        try:
+            return entry.is_file()
+        except OSError:
+            return False
+
+    def stat(self, path):
+        """
+        Returns the os.stat_result of path, or None if it does not exist.
+        """
+        entry = self.entry(path)
+        if entry is None:
+            return None
+
+        try:
+            return entry.stat()
+        except OSError:
+            return None
+
+    def listdir(self, directory):
+        """
+        Returns the sorted entry names of directory, or raises like os.listdir if it cannot be listed.
+        """
+        indexed = self.scan(directory)
+        if indexed is None:
+            return sorted(os.listdir(directory))
+
+        return indexed.names
+
+    def invalidate(self, path, descendants=False):
+        """
+        Forgets the listings of path and its ancestors, e.g. after creating path, and with
+        descendants=True also those of everything below path.
+        """
+        path = os.path.abspath(path)
+
+        if descendants:
+            prefix = path.rstrip(os.sep) + os.sep
+            for directory in [directory for directory in self.directories if directory.startswith(prefix)]:
+                del self.directories[directory]
+
+        while True:
+            self.directories.pop(path, None)
+            parent = os.path.dirname(path)
+            if parent == path:
+                return
+            path = parent
+
+    def has_marker(self, directory, name):
+        indexed = self.scan(directory)
+        return indexed is not None and name in indexed.markers
@@ -0,0 +1,317 @@
+import os
+import sys
+import time
+import ctypes
+import ctypes.util
+import select
+import struct
+
+import yaml
+
+from markdown_utils import compile_markdown
+from markdown_utils.manifest import BuildManifest
+from markdown_utils.tree_index import TreeIndex
+
+# Marker and order files whose creation or removal changes which outputs exist or how they are called.
+STRUCTURAL_FILES = {".no_compile", ".end_compile", "order.yaml"}
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+EVENT_HEADER = struct.Struct('iIII')
+
+class DependencyGraph:
+    """
+    Maps every input recorded in a build manifest to the outputs that depend on it.
+
+    Directories map to the outputs that list them, so marker files such as .no-headings
+    resolve to their directory's dependents.
+    """
+
+    def __init__(self, manifest):
+        self.outputs = manifest.outputs
+        self.dependents = {}
+        self.directories = set()
+
+        fragment_inputs = {}
+
+        def collect(key):
+            if key not in fragment_inputs:
+                fragment_inputs[key] = set()
+                record = manifest.fragments.get(key)
+                if record is not None:
+                    inputs = set(record["inputs"])
+                    for child in record["fragments"]:
+                        inputs |= collect(child)
+                    fragment_inputs[key] = inputs
+            return fragment_inputs[key]
+
+        for output, record in self.outputs.items():
+            for path in collect(record["fragment"]) | set(record["inputs"]):
+                self.dependents.setdefault(path, set()).add(output)
+
+        for path, signature in manifest.inputs.items():
+            if signature is not None and signature[1] == -1:
+                self.directories.add(path)
+
+    def affected(self, paths):
+        """
+        Returns the outputs affected by the changed paths, or None if the set of outputs itself may change.
+        """
+        affected = set()
+
+        for path in paths:
+            if os.path.basename(path) in STRUCTURAL_FILES or path in self.directories or os.path.isdir(path):
+                return None
+
+            affected |= self.dependents.get(path, set())
+            affected |= self.dependents.get(os.path.dirname(path), set())
+
+        return affected
+
+    def watched_directories(self):
+        return self.directories | {os.path.dirname(path) for path in self.dependents}
+
+class InotifyWatcher:
+    """
+    Reports changed paths using Linux inotify, with one watch per directory.
+    """
+
+    def __init__(self, directories, ignored):
+        libc_name = ctypes.util.find_library("c")
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        self.ignored = ignored
+        self.paths = {}
+        self.watched = set()
+        for directory in directories:
+            self.add_tree(directory)
+
+    def add_tree(self, directory):
+        for dir_path, dir_names, _ in os.walk(directory):
+            if is_ignored(dir_path, self.ignored):
+                dir_names[:] = []
+                continue
+            self.add_watch(dir_path)
+
+    def add_watch(self, directory):
+        if directory in self.watched:
+            return
+
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd >= 0:
+            self.paths[wd] = directory
+            self.watched.add(directory)
+
+    def wait(self, timeout=None):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+
+        changes = set()
+        try:
+            buffer = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return changes
+
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(buffer, offset)
+            offset += EVENT_HEADER.size
+            name = buffer[offset:offset + length].rstrip(b'\0')
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                changes.update(self.paths.values())
+                continue
+
+            directory = self.paths.get(wd)
+            if directory is None:
+                continue
+
+            path = os.path.join(directory, os.fsdecode(name)) if name else directory
+            if is_ignored(path, self.ignored):
+                continue
+
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self.add_tree(path)
+
+            changes.add(path)
+
+        return changes
+
+    def close(self):
+        os.close(self.fd)
+
+class PollingWatcher:
+    """
+    Reports changed paths by comparing stat snapshots of the watched directories.
+    """
+
+    def __init__(self, directories, ignored, interval=1.0):
+        self.directories = set(directories)
+        self.ignored = ignored
+        self.interval = interval
+        self.snapshot = self.scan()
+
+    def scan(self):
+        snapshot = {}
+        for directory in self.directories:
+            for dir_path, dir_names, file_names in os.walk(directory):
+                if is_ignored(dir_path, self.ignored):
+                    dir_names[:] = []
+                    continue
+                for name in [dir_path] + [os.path.join(dir_path, name) for name in file_names]:
+                    try:
+                        st = os.stat(name)
+                    except OSError:
+                        continue
+                    snapshot[name] = (st.st_mtime_ns, st.st_size)
+        return snapshot
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            delay = self.interval if deadline is None else max(0, min(self.interval, deadline - time.monotonic()))
+            time.sleep(delay)
+
+            snapshot = self.scan()
+            changes = {path for path in snapshot.keys() | self.snapshot.keys() if snapshot.get(path) != self.snapshot.get(path)}
+            self.snapshot = snapshot
+
+            changes = {path for path in changes if not is_ignored(path, self.ignored)}
+            if changes or (deadline is not None and time.monotonic() >= deadline):
+                return changes
+
+    def close(self):
+        pass
+
+def is_ignored(path, ignored):
+    return any(path == ignored_path or path.startswith(ignored_path + os.sep) for ignored_path in ignored)
+
+def top_directories(directories):
+    """
+    Returns the directories that are not nested inside another one of the given directories.
+    """
+    top = []
+    for directory in sorted(directories):
+        if not top or not directory.startswith(top[-1].rstrip(os.sep) + os.sep):
+            top.append(directory)
+    return top
+
+def create_watcher(directories, ignored, interval=1.0, polling=False):
+    directories = top_directories(directories)
+
+    if not polling and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(directories, ignored)
+        except (OSError, AttributeError):
+            pass
+
+    return PollingWatcher(directories, ignored, interval)
+
+def collect_changes(watcher, debounce):
+    """
+    Blocks until something changes, then keeps collecting until no new change arrives for debounce seconds.
+    """
+    changes = watcher.wait(None)
+    while True:
+        more = watcher.wait(debounce)
+        if not more:
+            return changes
+        changes |= more
+
+def recompile_outputs(outputs, manifest, fragment_store=None, source_map=False, splice=False):
+    fragment_cache = {}
+    index = TreeIndex()
+    written = []
+
+    for output_file in sorted(outputs):
+        record = manifest.outputs.get(output_file)
+        if record is None:
+            continue
+
+        yaml_path, mod_path, include_all, keep_numbers, ignore_frontmatter = record["options"]
+        if compile_markdown.compile_directory_to_file(
+            record["folder"],
+            os.path.dirname(output_file),
+            yaml_path=yaml_path,
+            include_all=include_all,
+            keep_numbers=keep_numbers,
+            output_name=os.path.basename(output_file),
+            mod_path=mod_path,
+            ignore_frontmatter=ignore_frontmatter,
+            fragment_cache=fragment_cache,
+            manifest=manifest,
+            index=index,
+            fragment_store=fragment_store,
+            source_map=source_map,
+            splice=splice
+        ):
+            written.append(output_file)
+
+    return written
+
+def watch(source, output, manifest_path, compile_options, interval=1.0, debounce=0.2, polling=False, fragment_store=None):
+    """
+    Recompiles the outputs affected by each burst of filesystem changes until interrupted.
+
+    Changes to files the dependency graph knows about only recompile their dependents. Changes that
+    can add or remove outputs (new directories, .no_compile, .end_compile, order.yaml) fall back to
+    a full compile_all pass, which still skips every output the manifest reports as fresh.
+    Unchanged files of a recompiled output are taken from fragment_store when one is given. A failed
+    recompile is reported and watching goes on.
+    """
+    output_dir = os.path.abspath(output if os.path.isdir(output) else os.path.dirname(output))
+    ignored = {output_dir, os.path.abspath(manifest_path)}
+    if fragment_store is not None:
+        ignored.add(os.path.abspath(fragment_store.path))
+
+    graph = DependencyGraph(BuildManifest(manifest_path))
+    watcher = create_watcher({os.path.abspath(source)} | graph.watched_directories(), ignored, interval, polling)
+
+    print(f"Watching {os.path.abspath(source)} for changes (press Ctrl+C to stop)")
+
+    try:
+        while True:
+            changes = collect_changes(watcher, debounce)
+            manifest = BuildManifest(manifest_path)
+            affected = graph.affected(changes)
+
+            try:
+                if affected is None:
+                    compile_markdown.compile_all(source, output, manifest=manifest, fragment_store=fragment_store, **compile_options)
+                    print(f"Recompiled {os.path.abspath(source)}")
+                else:
+                    for output_file in recompile_outputs(affected, manifest, fragment_store, compile_options.get("source_map", False), compile_options.get("splice", False)):
+                        print(f"Recompiled {output_file}")
+            except (OSError, ValueError, yaml.YAMLError) as e:
+                # Keep the previous dependency graph and wait for the change that fixes the error.
+                print(f"Error: Failed to recompile {os.path.abspath(source)}: {e}")
+                continue
+
+            manifest.save()
+            if fragment_store is not None:
+                fragment_store.save()
+            graph = DependencyGraph(manifest)
+            for directory in graph.watched_directories():
+                if isinstance(watcher, InotifyWatcher) and os.path.isdir(directory):
+                    watcher.add_watch(directory)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
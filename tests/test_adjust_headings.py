@@ -0,0 +1,105 @@
+import random
+import re
+
+import pytest
+
+from markdown_utils.compile_markdown import adjust_headings, remove_leading_number, substitute_title
+
+def adjust_headings_per_level(content, base_level_offset=0, keep_numbers=False, mod_config=None):
+    """
+    The former implementation, one regex pass per heading level, for content without code fences.
+    """
+    if base_level_offset == 0:
+        return content
+
+    for i in range(8, 0, -1):
+        def replace_func(match):
+            new_level = max(1, min(8, len(match.group(1)) + base_level_offset))
+            title = match.group(2)
+            if not keep_numbers:
+                title = re.sub(r'^\d+\s+', '', title)
+            title = substitute_title(title, mod_config) if mod_config else title
+            return f'{"#" * new_level} {title}'
+
+        content = re.compile(rf"^(#{{{i}}}) (.*)", re.MULTILINE).sub(replace_func, content)
+
+    return content
+
+LINES = [
+    "# Title", "## 01 Numbered", "### 2 Two", "#### Deep", "######## Eight", "######### Nine",
+    "#NoSpace", "# ", "#  Two spaces", " # Indented", "text with # hash", "1 plain", "",
+    "## Substituted", "### 10 20 Twice", "## trailing #", "#\ttab",
+]
+
+def random_document(rng):
+    return "\n".join(rng.choice(LINES) for _ in range(rng.randint(0, 40))) + rng.choice(["", "\n"])
+
+@pytest.mark.parametrize("offset", [1, 2, 3, 7])
+@pytest.mark.parametrize("keep_numbers", [False, True])
+def test_matches_per_level_implementation(offset, keep_numbers):
+    rng = random.Random(offset * 2 + keep_numbers)
+    mod_config = {"substitutions": {"Substituted": "Replaced", "Deep": "Shallow"}}
+
+    for _ in range(200):
+        content = random_document(rng)
+        for config in (None, mod_config):
+            assert adjust_headings(content, offset, keep_numbers, config) == adjust_headings_per_level(content, offset, keep_numbers, config)
+
+def test_zero_offset_returns_content():
+    content = "# 01 Title\n\n## Section\n"
+    assert adjust_headings(content, 0) is content
+
+def test_levels_are_clamped():
+    assert adjust_headings("# A\n######## H\n", 3) == "#### A\n######## H\n"
+    assert adjust_headings("### A\n# B\n", -2) == "# A\n# B\n"
+
+def test_fenced_code_is_left_untouched():
+    content = (
+        "# 01 Title\n"
+        "\n"
+        "```python\n"
+        "# 01 comment\n"
+        "## not a heading\n"
+        "```\n"
+        "\n"
+        "## 02 After\n"
+        "~~~~\n"
+        "# tilde fence\n"
+        "```\n"
+        "# still inside\n"
+        "~~~~\n"
+        "# 03 Last\n"
+    )
+
+    assert adjust_headings(content, 1) == (
+        "## Title\n"
+        "\n"
+        "```python\n"
+        "# 01 comment\n"
+        "## not a heading\n"
+        "```\n"
+        "\n"
+        "### After\n"
+        "~~~~\n"
+        "# tilde fence\n"
+        "```\n"
+        "# still inside\n"
+        "~~~~\n"
+        "## Last\n"
+    )
+
+def test_fence_closes_only_with_matching_marker():
+    content = "````\n# a\n```\n# b\n````\n# c\n"
+    assert adjust_headings(content, 1) == "````\n# a\n```\n# b\n````\n## c\n"
+
+def test_inline_backticks_do_not_open_fence():
+    content = "```code``` inline\n# Heading\n"
+    assert adjust_headings(content, 1) == "```code``` inline\n## Heading\n"
+
+def test_unclosed_fence_runs_to_end():
+    content = "# A\n```\n# B\n"
+    assert adjust_headings(content, 2) == "### A\n```\n# B\n"
+
+def test_remove_leading_number_only_strips_first():
+    assert remove_leading_number("10 20 Title") == "20 Title"
+    assert remove_leading_number("Title 10") == "Title 10"
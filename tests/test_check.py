@@ -0,0 +1,70 @@
+import os
+
+import pytest
+
+from markdown_utils.check import check_tree
+from markdown_utils.compile_markdown import main
+
+from tests.util import make_tree
+
+CLEAN = {
+    "book/order.yaml": "root:\n  - intro.md\n  - \"01 Part\"\n",
+    "book/intro.md": "# Intro\n\n<!-- include file=\"snippets/note.md\" -->\n",
+    "book/snippets/note.md": "# Note\n",
+    "book/01 Part/01 Start.md": "# Start\n",
+}
+
+def run_check(*args):
+    with pytest.raises(SystemExit) as exit_info:
+        main(["check", "-s", "book", *args])
+        raise SystemExit(0)
+    return exit_info.value.code
+
+@pytest.fixture
+def book(tmp_path, monkeypatch):
+    make_tree(tmp_path, CLEAN)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+def test_clean_tree_exits_0(book, capsys):
+    assert run_check("-j", "1") == 0
+    assert "0 errors, 0 warnings" in capsys.readouterr().out
+
+def test_errors_exit_1(book, capsys):
+    make_tree(book, {
+        "book/order.yaml": "root:\n  - intro.md\n  - intro.md\n  - \"02 Part\"\n",
+        "book/snippets/a.md": "<!-- include file=\"b.md\" -->\n",
+        "book/snippets/b.md": "<!-- include file=\"a.md\" -->\n",
+        "book/01 Part/02 Broken.md": "<!-- include file=\"missing.md\" -->\n<!-- include heading-level=\"x\" file=\"../snippets/note.md\" -->\n",
+    })
+
+    assert run_check("-j", "2") == 1
+    out = capsys.readouterr().out
+
+    assert "'intro.md' is listed 2 times" in out
+    assert "did you mean '01 Part'?" in out
+    assert "included file 'missing.md' does not exist" in out
+    assert "heading-level that is not a number" in out
+    assert "include cycle: snippets/a.md -> snippets/b.md -> snippets/a.md" in out
+
+def test_warnings_exit_1_only_when_strict(book, capsys):
+    make_tree(book, {"book/mod.yaml": "substitutions:\n  Apendix: Appendix\n"})
+
+    assert run_check("-j", "1", "-m", "book/mod.yaml") == 0
+    assert "substitution for 'Apendix' matches no title" in capsys.readouterr().out
+    assert run_check("-j", "1", "-m", "book/mod.yaml", "--strict") == 1
+
+def test_invalid_arguments_exit_2(book):
+    assert run_check("-s", "missing") == 2
+
+    with pytest.raises(SystemExit) as exit_info:
+        main(["check", "--no-such-option"])
+    assert exit_info.value.code == 2
+
+def test_invalid_order_file_is_an_error(book):
+    make_tree(book, {"book/01 Part/order.yaml": "root: [unclosed\n"})
+
+    problems, checked = check_tree(str(book / "book"), jobs=1)
+
+    assert checked == 3
+    assert [(os.path.basename(problem.path), problem.severity) for problem in problems] == [("order.yaml", "error")]
@@ -0,0 +1,89 @@
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from markdown_utils.compile_markdown import main
+from markdown_utils.manifest import BuildManifest
+
+from tests.util import read, write
+
+pytestmark = pytest.mark.skipif(shutil.which("git") is None, reason="git is not installed")
+
+def git(directory, *args):
+    subprocess.run(["git", "-C", str(directory), "-c", "user.name=test", "-c", "user.email=test@example.com", *args], check=True, capture_output=True)
+
+@pytest.fixture
+def repo(tmp_path, monkeypatch):
+    write(tmp_path / "book" / "a" / "x.md", "# X\n\nx text\n")
+    write(tmp_path / "book" / "b" / "y.md", "# Y\n\ny text\n")
+    write(tmp_path / ".gitignore", "out/\n")
+    os.makedirs(tmp_path / "out")
+
+    git(tmp_path, "init", "-q")
+    git(tmp_path, "add", ".")
+    git(tmp_path, "commit", "-q", "-m", "init")
+
+    monkeypatch.chdir(tmp_path)
+    main(["-s", "book", "-r", "-o", "out", "--git"])
+    return tmp_path
+
+def test_git_compiles_uncommitted_change(repo):
+    before = os.stat(repo / "out" / "b.md").st_mtime_ns
+    write(repo / "book" / "a" / "x.md", "# X\n\nx text edited\n")
+
+    main(["-s", "book", "-r", "-o", "out", "--git"])
+
+    assert "x text edited" in read(repo / "out" / "a.md")
+    assert os.stat(repo / "out" / "b.md").st_mtime_ns == before
+
+def test_git_does_not_check_unchanged_outputs(repo, monkeypatch):
+    checked = []
+    is_fresh = BuildManifest.is_fresh
+
+    def record_is_fresh(self, output_file, options):
+        checked.append(os.path.abspath(output_file))
+        return is_fresh(self, output_file, options)
+
+    monkeypatch.setattr(BuildManifest, "is_fresh", record_is_fresh)
+    before = os.stat(repo / "out" / "b.md").st_mtime_ns
+    write(repo / "book" / "a" / "x.md", "# X\n\nx text edited\n")
+
+    main(["-s", "book", "-r", "-o", "out", "--git"])
+
+    assert "x text edited" in read(repo / "out" / "a.md")
+    assert str(repo / "out" / "b.md") not in checked
+    assert os.stat(repo / "out" / "b.md").st_mtime_ns == before
+
+def test_git_compiles_reverted_change(repo):
+    write(repo / "book" / "a" / "x.md", "# X\n\nx text edited\n")
+    main(["-s", "book", "-r", "-o", "out", "--git"])
+
+    write(repo / "book" / "a" / "x.md", "# X\n\nx text\n")
+    main(["-s", "book", "-r", "-o", "out", "--git"])
+
+    assert "x text edited" not in read(repo / "out" / "a.md")
+
+def test_git_compiles_untracked_file(repo):
+    write(repo / "book" / "b" / "z.md", "# Z\n\nnew file\n")
+
+    main(["-s", "book", "-r", "-o", "out", "--git"])
+
+    assert "new file" in read(repo / "out" / "b.md")
+
+def test_git_compiles_change_committed_since_build(repo):
+    write(repo / "book" / "a" / "x.md", "# X\n\nx text committed\n")
+    git(repo, "commit", "-q", "-a", "-m", "edit")
+
+    main(["-s", "book", "-r", "-o", "out", "--git"])
+
+    assert "x text committed" in read(repo / "out" / "a.md")
+
+def test_git_range_selects_changed_outputs(repo):
+    write(repo / "book" / "b" / "y.md", "# Y\n\ny text on branch\n")
+    git(repo, "commit", "-q", "-a", "-m", "edit")
+
+    main(["-s", "book", "-r", "-o", "out", "--git", "HEAD~1..HEAD"])
+
+    assert "y text on branch" in read(repo / "out" / "b.md")
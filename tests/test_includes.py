@@ -0,0 +1,47 @@
+import os
+
+from markdown_utils.compile_markdown import get_content_for_path, resolve_include_path
+
+from tests.util import write
+
+def test_resolve_include_path_is_absolute(tmp_path, monkeypatch):
+    write(tmp_path / "book" / "ch" / "part.md", "# Part\n")
+    monkeypatch.chdir(tmp_path)
+
+    assert resolve_include_path("part.md", os.path.join("book", "ch")) == str(tmp_path / "book" / "ch" / "part.md")
+
+def test_self_include_with_relative_path(tmp_path, monkeypatch):
+    write(tmp_path / "book" / "ch" / "self.md", "# Self\n\nonly once\n\n<!-- include file=\"self.md\" -->\n")
+    monkeypatch.chdir(tmp_path)
+
+    content = get_content_for_path(os.path.join("book", "ch", "self.md"))
+
+    assert content.count("only once") == 1
+
+def test_include_cycle_stops(tmp_path):
+    write(tmp_path / "a.md", "# A\n\n<!-- include file=\"b.md\" -->\n")
+    write(tmp_path / "b.md", "# B\n\nfrom b\n\n<!-- include file=\"a.md\" -->\n")
+
+    content = get_content_for_path(str(tmp_path / "a.md"))
+
+    assert content.count("from b") == 1
+    assert content.count("# A") == 1
+
+def test_relative_include_from_nested_file(tmp_path, monkeypatch):
+    write(tmp_path / "book" / "ch" / "main.md", "# Main\n\n<!-- include file=\"../shared/note.md\" -->\n")
+    write(tmp_path / "book" / "shared" / "note.md", "# Note\n\nshared text\n")
+    monkeypatch.chdir(tmp_path / "book")
+
+    content = get_content_for_path(os.path.join("ch", "main.md"))
+
+    assert "## Note" in content
+    assert "shared text" in content
+
+def test_include_relative_to_working_directory(tmp_path, monkeypatch):
+    write(tmp_path / "book" / "ch" / "main.md", "# Main\n\n<!-- include file=\"snippets/code.md\" -->\n")
+    write(tmp_path / "snippets" / "code.md", "# Code\n\nlegacy include\n")
+    monkeypatch.chdir(tmp_path)
+
+    content = get_content_for_path(os.path.join("book", "ch", "main.md"))
+
+    assert "legacy include" in content
@@ -0,0 +1,57 @@
+import os
+
+import pytest
+import yaml
+
+from markdown_utils.compile_markdown import main
+
+from tests.util import make_tree, read_tree
+
+BOOK = {
+    "book/intro.md": "---\nauthor: someone\n---\n# Intro\n\n<!-- include file=\"snippets/note.md\" -->\n",
+    "book/snippets/note.md": "# Note\n\nnote text\n",
+    "book/01 Part/order.yaml": "root:\n  - \"02 Second.md\"\n  - \"01 First.md\"\n",
+    "book/01 Part/01 First.md": "# 01 First\n\n## Section\n\ntext\n",
+    "book/01 Part/02 Second.md": "second without title\n",
+    "book/01 Part/03 Deep/leaf.md": "# Leaf\n\n```\n# code\n```\n",
+    "book/02 Other/other.md": "# Other\n\n<!-- include file=\"../snippets/note.md\" show-title=\"false\" -->\n",
+    "book/03 Empty/.no_compile": "",
+}
+
+@pytest.fixture
+def book(tmp_path, monkeypatch):
+    make_tree(tmp_path, BOOK)
+    os.makedirs(tmp_path / "serial")
+    os.makedirs(tmp_path / "parallel")
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+@pytest.mark.parametrize("args", [["-r"], ["-r", "-k", "-i"], ["-p", "-t", "01 Part/03 Deep", "-t", "02 Other"]])
+def test_jobs_match_serial_compile(book, args):
+    main(["-s", "book", "-o", "serial", *args])
+    main(["-s", "book", "-o", "parallel", "-j", "2", *args])
+
+    serial = read_tree(book / "serial")
+    assert serial and read_tree(book / "parallel") == serial
+
+def test_jobs_rebuild_matches_serial(book):
+    main(["-s", "book", "-o", "serial", "-r"])
+    main(["-s", "book", "-o", "parallel", "-r", "-j", "2"])
+
+    make_tree(book, {"book/snippets/note.md": "# Note\n\nnote edited\n", "book/02 Other/new.md": "# New\n"})
+    main(["-s", "book", "-o", "serial", "-r"])
+    main(["-s", "book", "-o", "parallel", "-r", "-j", "2"])
+
+    assert read_tree(book / "parallel") == read_tree(book / "serial")
+    assert "note edited" in read_tree(book / "parallel")["Other.md"]
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_failing_task_does_not_stop_the_others(book, jobs):
+    make_tree(book, {"book/01 Part/order.yaml": "root: [unclosed\n"})
+
+    with pytest.raises(yaml.YAMLError):
+        main(["-s", "book", "-o", "serial", "-r", "-j", jobs])
+
+    outputs = read_tree(book / "serial")
+    assert "Part.md" not in outputs
+    assert "note text" in outputs["Other.md"]
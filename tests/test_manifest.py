@@ -0,0 +1,123 @@
+import os
+import json
+
+import pytest
+
+from markdown_utils.compile_markdown import main
+from markdown_utils.manifest import MANIFEST_NAME, BuildManifest
+
+from tests.util import make_tree, read, write
+
+@pytest.fixture
+def book(tmp_path, monkeypatch):
+    make_tree(tmp_path, {
+        "book/a/x.md": "# X\n\nx text\n",
+        "book/b/y.md": "# Y\n\ny text\n",
+        "book/b/z.md": "# Z\n\n<!-- include file=\"../shared/note.md\" -->\n",
+        "book/shared/note.md": "# Note\n\nnote text\n",
+    })
+    os.makedirs(tmp_path / "out")
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+def compile_book(*args):
+    main(["-s", "book", "-o", "out", *args])
+
+def mtimes(directory):
+    return {name: os.stat(os.path.join(directory, name)).st_mtime_ns for name in os.listdir(directory)}
+
+def load_outputs(directory):
+    with open(os.path.join(directory, MANIFEST_NAME), encoding='utf-8') as f:
+        return json.load(f)["outputs"]
+
+def test_unchanged_tree_is_skipped(book):
+    compile_book("-r")
+    before = mtimes(book / "out")
+
+    compile_book("-r")
+
+    assert mtimes(book / "out") == before
+
+def test_edit_rebuilds_affected_outputs_only(book):
+    compile_book("-r")
+    before = mtimes(book / "out")
+
+    write(book / "book" / "a" / "x.md", "# X\n\nx text edited\n")
+    compile_book("-r")
+
+    after = mtimes(book / "out")
+    assert "x text edited" in read(book / "out" / "a.md")
+    assert "x text edited" in read(book / "out" / "book.md")
+    assert after["b.md"] == before["b.md"]
+
+def test_included_file_edit_rebuilds_output(book):
+    compile_book("-r")
+
+    write(book / "book" / "shared" / "note.md", "# Note\n\nnote edited\n")
+    compile_book("-r")
+
+    assert "note edited" in read(book / "out" / "b.md")
+
+def test_same_size_edit_is_noticed(book):
+    compile_book("-r")
+    path = book / "book" / "a" / "x.md"
+    st = os.stat(path)
+
+    write(path, "# X\n\ny text\n")
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+    compile_book("-r")
+
+    assert "y text" in read(book / "out" / "a.md")
+
+def test_touched_file_with_same_content_is_fresh(book):
+    compile_book("-r")
+    manifest = BuildManifest(str(book / "out" / MANIFEST_NAME))
+    record = manifest.outputs[str(book / "out" / "a.md")]
+
+    path = book / "book" / "a" / "x.md"
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1_000_000_000))
+
+    assert manifest.is_fresh(str(book / "out" / "a.md"), record["options"])
+    assert not manifest.is_fresh(str(book / "out" / "a.md"), record["options"] + ["other"])
+
+def test_option_change_and_missing_output_rebuild(book):
+    make_tree(book, {"book/a/01 Numbered.md": "# 01 Numbered\n"})
+    compile_book("-r")
+    assert "# Numbered" in read(book / "out" / "a.md")
+
+    compile_book("-r", "-k")
+    assert "01 Numbered" in read(book / "out" / "a.md")
+
+    os.remove(book / "out" / "b.md")
+    compile_book("-r", "-k")
+    assert "y text" in read(book / "out" / "b.md")
+
+def test_force_rebuilds_everything(book):
+    compile_book("-r")
+    manifest = BuildManifest(str(book / "out" / MANIFEST_NAME), force=True)
+    record = manifest.outputs[str(book / "out" / "a.md")]
+
+    assert not manifest.is_fresh(str(book / "out" / "a.md"), record["options"])
+
+def test_output_left_stale_by_another_run_is_rebuilt(book):
+    compile_book("-r")
+
+    write(book / "book" / "a" / "x.md", "# X\n\nx text edited\n")
+    compile_book("-t", "a")
+
+    assert "x text edited" in read(book / "out" / "a.md")
+    assert "x text edited" not in read(book / "out" / "book.md")
+    assert str(book / "out" / "book.md") not in load_outputs(book / "out")
+
+    compile_book("-r")
+
+    assert "x text edited" in read(book / "out" / "book.md")
+
+def test_prune_drops_records_of_removed_outputs(book):
+    compile_book("-r")
+
+    os.remove(book / "out" / "b.md")
+    write(book / "book" / "a" / "x.md", "# X\n\nx text edited\n")
+    compile_book("-t", "a")
+
+    assert str(book / "out" / "b.md") not in load_outputs(book / "out")
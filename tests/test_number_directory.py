@@ -0,0 +1,87 @@
+import os
+import sys
+
+import pytest
+
+from markdown_utils.number_directory import JOURNAL_NAME, main, move_step, plan_renames, rename_files, undo_renames, write_journal
+
+from tests.util import make_tree, read_tree
+
+TREE = {
+    "book/b.md": "b",
+    "book/02 a.md": "a",
+    "book/1 c/x.md": "x",
+    "book/1 c/order.yaml": "root: []\n",
+    "book/1 c/.no-headings": "",
+    "book/.end_compile": "",
+    "book/order.yaml": "root: []\n",
+    "book/frontmatter.yaml": "title: Book\n",
+}
+
+def run(monkeypatch, *args):
+    monkeypatch.setattr(sys, "argv", ["number-directory", *args])
+    main()
+
+def test_numbers_entries_in_name_order(tmp_path):
+    make_tree(tmp_path, TREE)
+
+    assert rename_files(str(tmp_path / "book"), 1, 2)
+
+    assert sorted(os.listdir(tmp_path / "book")) == [".end_compile", "01 a.md", "02 c", "03 b.md", "frontmatter.yaml", "order.yaml"]
+    assert sorted(os.listdir(tmp_path / "book" / "02 c")) == [".no-headings", "order.yaml", "x.md"]
+
+def test_recursive_skips_hidden_entries_and_compiler_files(tmp_path):
+    make_tree(tmp_path, dict(TREE, **{"book/.git/HEAD": "ref"}))
+
+    steps = plan_renames(str(tmp_path / "book"), 1, 2, recursive=True)
+    renamed = {name for directory, renames in steps for name, temp_name, new_name in renames}
+
+    assert renamed == {"b.md", "02 a.md", "1 c", "x.md"}
+
+    assert rename_files(str(tmp_path / "book"), 1, 2, recursive=True)
+    assert sorted(read_tree(tmp_path / "book", skip_hidden=False)) == sorted([
+        ".end_compile", ".git/HEAD", "frontmatter.yaml", "order.yaml", "01 a.md", "03 b.md",
+        os.path.join("02 c", ".no-headings"), os.path.join("02 c", "order.yaml"), os.path.join("02 c", "01 x.md"),
+    ])
+
+def test_swapped_names_do_not_collide(tmp_path):
+    make_tree(tmp_path, {"book/01 b.md": "first", "book/02 a.md": "second", "book/a.md": "third"})
+
+    assert rename_files(str(tmp_path / "book"), 1, 2)
+
+    assert read_tree(tmp_path / "book") == {"01 b.md": "first", "02 a.md": "second", "03 a.md": "third"}
+
+def test_undo_restores_the_tree(tmp_path, monkeypatch):
+    make_tree(tmp_path, TREE)
+    before = read_tree(tmp_path / "book", skip_hidden=False)
+
+    run(monkeypatch, "-p", str(tmp_path / "book"), "-r")
+    assert read_tree(tmp_path / "book", skip_hidden=False) != before
+
+    run(monkeypatch, "-p", str(tmp_path / "book"), "-u")
+    assert read_tree(tmp_path / "book", skip_hidden=False) == before
+    assert not os.path.exists(tmp_path / "book" / JOURNAL_NAME)
+
+def test_undo_finishes_an_interrupted_step(tmp_path):
+    make_tree(tmp_path, {"book/a.md": "a", "book/b.md": "b"})
+    book = str(tmp_path / "book")
+    journal_path = os.path.join(book, JOURNAL_NAME)
+
+    steps = plan_renames(book, 1, 2)
+    write_journal(journal_path, steps)
+    # Only the first phase ran: both entries sit at their temporary names.
+    for name, temp_name, new_name in steps[0][1]:
+        os.rename(os.path.join(book, name), os.path.join(book, temp_name))
+
+    undo_renames(journal_path)
+
+    assert read_tree(tmp_path / "book") == {"a.md": "a", "b.md": "b"}
+
+def test_failed_step_is_rolled_back(tmp_path):
+    make_tree(tmp_path, {"book/a.md": "a", "book/b.md": "b"})
+    book = str(tmp_path / "book")
+
+    with pytest.raises(OSError):
+        move_step(book, [("a.md", ".tmp-a", "01 a.md"), ("missing.md", ".tmp-m", "02 missing.md")])
+
+    assert read_tree(tmp_path / "book") == {"a.md": "a", "b.md": "b"}
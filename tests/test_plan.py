@@ -0,0 +1,77 @@
+import os
+import json
+
+import pytest
+
+from markdown_utils.compile_markdown import main
+
+from tests.util import make_tree, read_tree
+
+BOOK = {
+    "book/order.yaml": (
+        "root:\n"
+        "  - intro.md\n"
+        "  - \"02 Guide\":\n"
+        "      - title: \"The Guide\"\n"
+        "      - order:\n"
+        "          - second.md\n"
+        "          - first.md\n"
+        "  - \"01 Basics\"\n"
+        "  - missing.md\n"
+    ),
+    "book/intro.md": "# Intro\n\nintro text\n",
+    "book/01 Basics/01 Start.md": "# 01 Start\n\nstart text\n",
+    "book/01 Basics/02 Nested/01 Leaf.md": "# Leaf\n\nleaf text\n",
+    "book/02 Guide/first.md": "# First\n\nfirst text\n",
+    "book/02 Guide/second.md": "# Second\n\nsecond text\n",
+    "book/02 Guide/third.md": "# Third\n\nthird text\n",
+    "book/03 Skipped/.no_compile": "",
+    "book/03 Skipped/skipped.md": "# Skipped\n\nskipped text\n",
+}
+
+@pytest.fixture
+def book(tmp_path, monkeypatch):
+    make_tree(tmp_path, BOOK)
+    os.makedirs(tmp_path / "out")
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+def get_plan(capsys, *args):
+    main(["-s", "book", "-o", "out", "--plan", "json", *args])
+    return json.loads(capsys.readouterr().out)["outputs"]
+
+@pytest.mark.parametrize("args", [["-r"], [], ["-t", "01 Basics"], ["-p", "-t", "01 Basics/02 Nested"], ["-r", "-k"]])
+def test_plan_lists_the_outputs_a_compile_writes(book, capsys, args):
+    plans = get_plan(capsys, *args)
+    assert os.listdir(book / "out") == []
+
+    main(["-s", "book", "-o", "out", "--source-map", *args])
+    written = {os.path.join(book, "out", path) for path in read_tree(book / "out") if not path.endswith(".map.json")}
+
+    assert [plan["output"] for plan in plans] and {plan["output"] for plan in plans} == written
+
+    for plan in plans:
+        with open(f"{plan['output']}.map.json", encoding='utf-8') as f:
+            entries = json.load(f)["entries"]
+        # A file rendered at depth d has its title at level d + 1, a folder heading is at level d.
+        mapped = [(entry["kind"], entry["path"], entry["depth"] + (entry["kind"] == "file")) for entry in entries if entry["kind"] != "header"]
+
+        assert [(entry["kind"], entry["path"], entry["level"]) for entry in plan["entries"]] == mapped
+
+def test_plan_shows_titles_and_skips(book, capsys):
+    plans = get_plan(capsys)
+
+    assert len(plans) == 1
+    entries = {os.path.relpath(entry["path"], book / "book"): entry for entry in plans[0]["entries"]}
+
+    assert entries["02 Guide"]["title"] == "The Guide"
+    assert "03 Skipped/skipped.md" not in entries
+    assert "missing.md" not in entries
+
+def test_plan_text(book, capsys):
+    main(["-s", "book", "-o", "out", "-r", "--plan"])
+    text = capsys.readouterr().out
+
+    assert "The Guide" in text
+    assert "intro.md" in text
+    assert not os.listdir(book / "out")
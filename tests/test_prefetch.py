@@ -0,0 +1,39 @@
+from markdown_utils.prefetch import Prefetcher, encoded_size
+
+def test_encoded_size_counts_utf8_bytes():
+    assert encoded_size("abc") == 3
+    assert encoded_size("é") == 2
+    assert encoded_size("") == 0
+
+def test_held_content_is_counted_in_bytes():
+    contents = {"a": "a", "b": "é" * 10, "c": "c"}
+
+    # b holds 20 bytes but only 10 characters, so with a cap of 15 bytes c waits until b is taken.
+    with Prefetcher(contents.get, workers=1, max_bytes=15) as prefetcher:
+        prefetcher.schedule(["a", "b", "c"])
+        prefetcher.futures["b"].result()
+
+        assert prefetcher.take("a") == "a"
+        assert prefetcher.held == 20
+        assert "c" not in prefetcher.futures
+
+        assert prefetcher.take("b") == contents["b"]
+        assert prefetcher.take("c") == "c"
+        assert prefetcher.held == 0
+
+def test_take_returns_none_for_paths_not_read_ahead():
+    with Prefetcher(lambda path: path, workers=2) as prefetcher:
+        prefetcher.schedule(["a"])
+
+        assert prefetcher.take("other") is None
+        assert prefetcher.take("a") == "a"
+        assert prefetcher.take("a") is None
+
+def test_discovered_paths_are_read_ahead():
+    files = {"main": "includes part", "part": "part content"}
+
+    with Prefetcher(files.get, discover=lambda path, content: ["part"] if path == "main" else [], workers=1) as prefetcher:
+        prefetcher.schedule(["main"])
+
+        assert prefetcher.take("main") == "includes part"
+        assert prefetcher.take("part") == "part content"
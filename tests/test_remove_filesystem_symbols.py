@@ -0,0 +1,49 @@
+import os
+import sys
+
+import pytest
+
+from markdown_utils.remove_filesystem_symbols import main, process_folder
+
+from tests.util import make_tree, read
+
+def run(monkeypatch, *args):
+    monkeypatch.setattr(sys, "argv", ["remove-filesystem-symbols", *args])
+    main()
+
+def test_renames_bottom_up(tmp_path):
+    make_tree(tmp_path, {"a b/c (1).md": "", "a b/d?/e!.md": ""})
+    lines = []
+
+    count = process_folder(str(tmp_path), recursive=True, dry_run=False, absolute=False, write=lines.append, jobs=2)
+
+    assert count == 4
+    assert sorted(os.listdir(tmp_path / "ab")) == ["c1.md", "d"]
+    assert os.listdir(tmp_path / "ab" / "d") == ["e.md"]
+    assert os.path.join(str(tmp_path), "ab", "d", "e!.md") + " -> " + os.path.join(str(tmp_path), "ab", "d", "e.md") in lines
+
+def test_dry_run_renames_nothing(tmp_path):
+    make_tree(tmp_path, {"a b/c (1).md": ""})
+
+    process_folder(str(tmp_path), recursive=True, dry_run=True, absolute=False, write=lambda line: None)
+
+    assert os.listdir(tmp_path) == ["a b"]
+
+def test_collision_renames_nothing_and_exits_1(tmp_path, monkeypatch, capsys):
+    make_tree(tmp_path, {"dir/a b.md": "", "dir/ab.md": "", "dir/c d.md": ""})
+    monkeypatch.chdir(tmp_path)
+
+    with pytest.raises(SystemExit) as exit_info:
+        run(monkeypatch, "-r", "-t", "dir")
+
+    assert exit_info.value.code == 1
+    assert "would collide" in capsys.readouterr().out
+    assert sorted(os.listdir(tmp_path / "dir")) == ["a b.md", "ab.md", "c d.md"]
+
+def test_log_is_written(tmp_path, monkeypatch):
+    make_tree(tmp_path, {"dir/a b.md": ""})
+    monkeypatch.chdir(tmp_path)
+
+    run(monkeypatch, "-t", "dir", "-o", "log.txt")
+
+    assert read(tmp_path / "log.txt") == f"{os.path.join('dir', 'a b.md')} -> {os.path.join('dir', 'ab.md')}"
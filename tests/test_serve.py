@@ -0,0 +1,81 @@
+import os
+import threading
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from markdown_utils.compiler import Compiler
+from markdown_utils.serve import PreviewCache, make_handler
+from markdown_utils.watch import InotifyWatcher, create_watcher
+
+from tests.util import make_tree, write
+
+@pytest.fixture
+def tree(tmp_path):
+    make_tree(tmp_path, {
+        "book/intro.md": "# Intro\n\n<!-- include file=\"../shared/note.md\" -->\n",
+        "book/01 Part/start.md": "# Start\n\nstart text\n",
+        "shared/note.md": "# Note\n\nnote text\n",
+        "config/mod.yaml": "substitutions:\n  Start: Beginning\n",
+    })
+    return tmp_path
+
+def wait_for_changes(watcher, paths):
+    changes = set()
+    for _ in range(20):
+        changes |= watcher.wait(0.1)
+        if paths <= changes:
+            break
+    return changes
+
+@pytest.mark.skipif(not hasattr(os, "uname") or os.uname().sysname != "Linux", reason="inotify is only available on Linux")
+def test_includes_and_mod_file_outside_the_tree_are_watched(tree):
+    source = str(tree / "book")
+    mod_path = str(tree / "config" / "mod.yaml")
+    compiler = Compiler(mod_path=mod_path)
+
+    watcher = create_watcher({source, os.path.dirname(mod_path)}, set())
+    assert isinstance(watcher, InotifyWatcher)
+    cache = PreviewCache(compiler, watcher)
+
+    try:
+        body, etag = cache.get(source)
+        assert b"note text" in body and b"Beginning" in body
+
+        note = str(tree / "shared" / "note.md")
+        write(note, "# Note\n\nnote edited\n")
+        cache.invalidate(wait_for_changes(watcher, {note}))
+
+        body, changed_etag = cache.get(source)
+        assert b"note edited" in body and changed_etag != etag
+
+        write(mod_path, "substitutions:\n  Start: Opening\n")
+        cache.invalidate(wait_for_changes(watcher, {mod_path}))
+
+        assert b"Opening" in cache.get(source)[0]
+    finally:
+        watcher.close()
+
+def test_unchanged_document_answers_304(tree):
+    source = str(tree / "book")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(source, PreviewCache(Compiler())))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/01%20Part"
+
+    try:
+        with urllib.request.urlopen(url) as response:
+            etag = response.headers["ETag"]
+            assert b"start text" in response.read()
+
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(urllib.request.Request(url, headers={"If-None-Match": etag}))
+        assert error.value.code == 304
+
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(f"http://127.0.0.1:{server.server_address[1]}/../shared")
+        assert error.value.code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,108 @@
+import os
+import json
+import shutil
+
+import pytest
+
+from markdown_utils import compile_markdown
+from markdown_utils.compile_markdown import main
+
+from tests.util import make_tree, read_tree, write
+
+BOOK = {
+    "book/order.yaml": "root:\n  - \"02 Second.md\"\n  - \"01 First.md\"\n  - \"01 Main Part\"\n  - \"02 Other Part\"\n",
+    "book/01 First.md": "---\nauthor: someone\n---\n# 01 First\n\nfirst text\n\n## Section\n",
+    "book/02 Second.md": "# Second\n\nsecond text é\n\n```\n# not a heading\n```\n",
+    "book/01 Main Part/01 Intro.md": "# Intro\n\n<!-- include file=\"../snippets/note.md\" heading-level=\"2\" -->\n",
+    "book/01 Main Part/02 Body.md": "body without title\n",
+    "book/01 Main Part/03 Deep/01 Leaf.md": "# Leaf\n\nleaf text\n\n### Subsection\n",
+    "book/02 Other Part/01 Other.md": "# Other\n\n<!-- include file=\"../snippets/note.md\" show-title=\"false\" -->\n",
+    "book/snippets/note.md": "# Note\n\nnote text\n",
+}
+
+@pytest.fixture
+def book(tmp_path, monkeypatch):
+    make_tree(tmp_path, BOOK)
+    os.makedirs(tmp_path / "out")
+    os.makedirs(tmp_path / "ref")
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+@pytest.fixture
+def spliced(monkeypatch):
+    results = []
+    original = compile_markdown.splice_directory_to_file
+
+    def counting(*args, **kwargs):
+        result = original(*args, **kwargs)
+        results.append(result)
+        return result
+
+    monkeypatch.setattr(compile_markdown, "splice_directory_to_file", counting)
+    return results
+
+def compile_book(output, *args):
+    main(["-s", "book", "-o", output, "-r", *args])
+
+def append(path, text):
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(text)
+
+def assert_same_as_fresh_build(book):
+    shutil.rmtree(book / "ref")
+    os.makedirs(book / "ref")
+    compile_book("ref")
+
+    outputs = {path: content for path, content in read_tree(book / "out").items() if not path.endswith(".map.json")}
+    assert outputs == read_tree(book / "ref")
+
+def assert_map_matches_output(output_file):
+    with open(f"{output_file}.map.json", encoding='utf-8') as f:
+        source_map = json.load(f)
+    with open(output_file, 'rb') as f:
+        data = f.read()
+
+    assert source_map["entries"]
+    for entry in source_map["entries"]:
+        start, end = entry["bytes"]
+        first_line, last_line = entry["lines"]
+        assert data[:start].count(b"\n") + 1 == first_line
+        assert data[:end].count(b"\n") + 1 == last_line
+
+def test_source_map_covers_output(book):
+    compile_book("out", "--source-map")
+
+    for path in read_tree(book / "out"):
+        if path.endswith(".md"):
+            assert_map_matches_output(book / "out" / path)
+
+def test_splice_matches_fresh_build(book, spliced):
+    compile_book("out", "--source-map")
+
+    edits = [
+        lambda: append(book / "book" / "01 First.md", "\nmore first text\n\n## Added heading\n"),
+        lambda: write(book / "book" / "01 Main Part" / "03 Deep" / "01 Leaf.md", "# Leaf\n\nshort\n"),
+        lambda: append(book / "book" / "snippets" / "note.md", "\nnote addition é\n"),
+        lambda: write(book / "book" / "02 Second.md", "second without title\n"),
+        lambda: write(book / "book" / "01 Main Part" / "02 Body.md", "# New Title\n\nbody\n"),
+    ]
+
+    for edit in edits:
+        edit()
+        compile_book("out", "--splice")
+        assert_same_as_fresh_build(book)
+
+        for path in read_tree(book / "out"):
+            if path.endswith(".md"):
+                assert_map_matches_output(book / "out" / path)
+
+    assert any(spliced)
+
+def test_structural_change_compiles_fully(book, spliced):
+    compile_book("out", "--source-map")
+
+    write(book / "book" / "01 Main Part" / "04 New.md", "# New\n\nnew file\n")
+    compile_book("out", "--splice")
+
+    assert_same_as_fresh_build(book)
+    assert "new file" in read_tree(book / "out")["Main Part.md"]
@@ -0,0 +1,35 @@
+import os
+
+from markdown_utils import watch as watch_module
+from markdown_utils.compile_markdown import main
+from markdown_utils.manifest import MANIFEST_NAME
+
+from tests.util import make_tree, read, write
+
+def test_watch_recovers_from_invalid_order_file(tmp_path, monkeypatch, capsys):
+    make_tree(tmp_path, {
+        "book/01 Part/01 First.md": "# First\n\nfirst text\n",
+        "book/01 Part/02 Second.md": "# Second\n\nsecond text\n",
+    })
+    os.makedirs(tmp_path / "out")
+    monkeypatch.chdir(tmp_path)
+    main(["-s", "book", "-r", "-o", "out"])
+
+    order_path = str(tmp_path / "book" / "01 Part" / "order.yaml")
+    edits = [
+        "root: [unclosed\n",
+        "root:\n  - \"02 Second.md\"\n  - \"01 First.md\"\n",
+    ]
+
+    def collect_changes(watcher, debounce):
+        if not edits:
+            raise KeyboardInterrupt
+        write(order_path, edits.pop(0))
+        return {order_path}
+
+    monkeypatch.setattr(watch_module, "collect_changes", collect_changes)
+    watch_module.watch("book", "out", os.path.join("out", MANIFEST_NAME), {"recursive": True, "keep_numbers": False}, polling=True)
+
+    assert "Error: Failed to recompile" in capsys.readouterr().out
+    part = read(tmp_path / "out" / "Part.md")
+    assert part.index("second text") < part.index("first text")
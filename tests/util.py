@@ -0,0 +1,30 @@
+import os
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(content)
+
+def read(path):
+    with open(path, encoding='utf-8') as f:
+        return f.read()
+
+def make_tree(root, files):
+    """
+    Writes files, a dict mapping paths relative to root to their content.
+    """
+    for path, content in files.items():
+        write(os.path.join(root, path), content)
+
+def read_tree(root, skip_hidden=True):
+    """
+    Returns a dict mapping the paths of the files below root, relative to root, to their content.
+    """
+    files = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        for filename in filenames:
+            if skip_hidden and filename.startswith("."):
+                continue
+            path = os.path.join(dirpath, filename)
+            files[os.path.relpath(path, root)] = read(path)
+    return files